@@ -1,37 +1,230 @@
+import atexit
 import os
 import logging
 import uuid
 import pandas as pd
 import hashlib
+import time
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, flash, redirect, url_for
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, render_template, request, jsonify, session, flash, redirect, url_for, g, Response, stream_with_context
+from sqlalchemy.orm import validates
 from werkzeug.utils import secure_filename
 import json
 import re
 import sqlalchemy as sa
+from clustering import cluster_contacts, parse_key_types
+from contact_matches import cluster_matches, ensure_match_triggers, similar_contact_ids, MatchRecorder, MATCH_TYPES, SIMILAR_MATCH_TYPES
+from contact_queries import fetch_page, filters_from_args, listing_order, parse_bool, parse_cursor, parse_limit, wants_page, LISTING_FIELDS
+from databases import DatabaseRegistry, RoutedSQLAlchemy, DATABASE_HEADER, SESSION_KEY
+from fuzzy_matching import find_fuzzy_matches, merge_fuzzy_matches, parse_threshold
+from extra_fields import (ensure_field_triggers, field_contacts, list_fields, parse_field_cursor,
+                          parse_field_limit, parse_number, ExtraFieldWriter, MAX_INDEXED_TEXT)
+from federation import lookup_keys, match_query, merge_matches, FederatedLookup, NORMALIZERS, DEFAULT_FEDERATED_WORKERS
+from file_export import check_format, stream_export, EXPORT_FORMATS
+from geo import (contacts_in_box, contacts_near, ensure_geo_index, find_nearby_matches, parse_bbox,
+                 parse_nearby_limit, parse_point, parse_radius, MAX_PAIR_DISTANCE_M)
+from maintenance import database_health, run_maintenance, MaintenanceScheduler, DEFAULT_INTERVAL as DEFAULT_MAINTENANCE_INTERVAL
+from merging import merge_duplicate_groups, DEFAULT_MERGE_BATCH_SIZE
+from mysql_export import build_connection_uri, define_contacts_table, ensure_target_schema, export_contacts, DEFAULT_EXPORT_BATCH_SIZE
+from migrations import backfill_normalized_contacts, backfill_row_hashes, ensure_columns, ensure_foreign_keys, ensure_indexes
+from normalization import normalize_email, normalize_phone
+from engine_registry import EngineRegistry, EXPORT_ENGINE_OPTIONS
+from ingest import estimate_rows, insert_row_batches, log_ingest, spool_upload, ParsePool, DEFAULT_BATCH_SIZE
+from jobs import parse_job_limit, JobCancelled, JobManager, DEFAULT_MAX_WORKERS
+from known_rows import parse_known_rows_mode, KnownRows
+from metrics import QueryTracker, Registry, RequestProfiler, StageTimer
+from payloads import compress_response, contact_payload, negotiate_encoding, parse_layout, FastJSONProvider, MIN_COMPRESS_BYTES
+from response_cache import bump_generation, ensure_generation_table, read_generation, ResponseCache, DEFAULT_MAX_ENTRIES
+from search import ensure_search_index, match_filter, parse_search_limit, search_contacts
+from storage import configure_pragmas, configure_writer, writer_engine_options, ReadPool, DEFAULT_READ_POOL_SIZE, DEFAULT_WRITE_TIMEOUT
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key")
 
-# Configure SQLite
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///contact_data.db'
+# Default SQLite database (DATABASE_URI points the app at another file, e.g. for benchmarks);
+# requests can select any other instance/*.db file, see databases.py
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///contact_data.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Initialize SQLAlchemy
-db = SQLAlchemy(app)
+# Seconds a write waits for the single writer connection or the database lock
+app.config['SQLITE_WRITE_TIMEOUT'] = int(os.environ.get('SQLITE_WRITE_TIMEOUT', DEFAULT_WRITE_TIMEOUT))
 
-# Maximum file size (10MB)
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024
+# All writes share one connection; reads use a separate read-only pool
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = writer_engine_options(app.config['SQLITE_WRITE_TIMEOUT'])
+
+# Background jobs are tracked in their own SQLite file, so progress updates
+# never wait on the write lock held by a running import or merge
+app.config['SQLALCHEMY_BINDS'] = {'jobs': os.environ.get('JOBS_DATABASE_URI', 'sqlite:///jobs.sqlite')}
+
+# Initialize SQLAlchemy; the default engine is chosen per request
+db = RoutedSQLAlchemy(app)
+
+# Writer engines kept open for non-default databases, and seconds an unused one stays open
+app.config['DATABASE_MAX_ENGINES'] = int(os.environ.get('DATABASE_MAX_ENGINES', 8))
+app.config['DATABASE_IDLE_TIMEOUT'] = int(os.environ.get('DATABASE_IDLE_TIMEOUT', 600))
+
+# Maximum file size (500MB by default); uploads are streamed, so memory stays flat
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 500)) * 1024 * 1024
+
+# Rows per executemany batch when ingesting uploads
+app.config['UPLOAD_BATCH_SIZE'] = int(os.environ.get('UPLOAD_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+
+# Rows of an upload already imported from another file: upsert, skip or insert them (see known_rows.py)
+app.config['KNOWN_ROWS'] = parse_known_rows_mode(os.environ.get('KNOWN_ROWS'))
+
+# Worker processes parsing multi-file uploads (1 parses in the request thread)
+app.config['UPLOAD_WORKERS'] = int(os.environ.get('UPLOAD_WORKERS', os.cpu_count() or 1))
+
+# Contact ids loaded per batch when merging duplicates
+app.config['MERGE_BATCH_SIZE'] = int(os.environ.get('MERGE_BATCH_SIZE', DEFAULT_MERGE_BATCH_SIZE))
+
+# Rows per multi-row INSERT when exporting to MySQL
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', DEFAULT_EXPORT_BATCH_SIZE))
+
+# Optional SQLAlchemy URI replacing the MySQL export target (e.g. a local SQLite stand-in)
+app.config['EXPORT_TARGET_URI'] = os.environ.get('EXPORT_TARGET_URI')
+
+# Pooled engines for MySQL export targets, reused across requests
+export_engines = EngineRegistry(
+    max_engines=int(os.environ.get('EXPORT_MAX_ENGINES', 4)),
+    idle_timeout=int(os.environ.get('EXPORT_ENGINE_IDLE_TIMEOUT', 600)),
+    engine_options=EXPORT_ENGINE_OPTIONS
+)
+
+# Read-only SQLite connections, so listings keep working during imports
+read_pool = ReadPool(
+    pool_size=int(os.environ.get('SQLITE_READ_POOL_SIZE', DEFAULT_READ_POOL_SIZE)),
+    busy_timeout=app.config['SQLITE_WRITE_TIMEOUT']
+)
+
+# Process pool parsing uploaded files; inserts stay on a single writer
+upload_parser = ParsePool(app.config['UPLOAD_WORKERS'])
+# Stop its worker processes cleanly when the server (or a benchmark run) exits
+atexit.register(upload_parser.shutdown)
+
+# JSON responses at least this large are gzip/brotli compressed when the client accepts it
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', MIN_COMPRESS_BYTES))
+
+# Cached read responses, dropped when the database's write generation changes
+response_cache = ResponseCache(
+    lambda: read_generation(read_session()),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_MB', 64)) * 1024 * 1024,
+    max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+    compress_min_bytes=app.config['COMPRESS_MIN_BYTES']
+)
+
+# Requests taking at least this many milliseconds leave a profile in PROFILE_DIR (0 disables profiling)
+app.config['SLOW_REQUEST_PROFILE_MS'] = int(os.environ.get('SLOW_REQUEST_PROFILE_MS', 0))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+app.config['PROFILER'] = os.environ.get('PROFILER', 'cprofile')
+
+# Request latency, SQL statement and stage timing metrics served at /metrics
+metrics = Registry()
+query_tracker = QueryTracker(metrics)
+query_tracker.install()
+request_profiler = RequestProfiler(
+    app.config['PROFILE_DIR'], app.config['SLOW_REQUEST_PROFILE_MS'], app.config['PROFILER']
+)
+
+def request_route():
+    return request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+
+@app.before_request
+def start_request_metrics():
+    query_tracker.start_request()
+    if request_profiler.enabled:
+        g.profiler = request_profiler.start()
+    g.request_started = time.perf_counter()
+
+def finish_request_metrics(status):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    route = request_route()
+    statements, sql_seconds = query_tracker.finish_request()
+    metrics.request_seconds.observe(elapsed, request.method, route, status)
+    metrics.request_queries.observe(statements, route)
+    metrics.request_sql_seconds.observe(sql_seconds, route)
+    profiler = g.pop('profiler', None)
+    if profiler is not None and request_profiler.stop(profiler, route, elapsed) is not None:
+        metrics.profiles.inc(1, route)
+
+# Registered before compression, so it runs after it and the latency includes it
+@app.after_request
+def record_request_metrics(response):
+    finish_request_metrics(response.status_code)
+    return response
+
+@app.teardown_request
+def record_failed_request_metrics(exception=None):
+    # Unhandled errors skip after_request
+    if exception is not None:
+        finish_request_metrics(500)
+
+@app.after_request
+def compress_json_response(response):
+    """Compress large JSON bodies; cached views arrive already compressed."""
+    return compress_response(response, negotiate_encoding(request.accept_encodings),
+                             app.config['COMPRESS_MIN_BYTES'])
+
+@app.before_request
+def select_request_database():
+    """Route the request to the database named by the X-Database header or the session."""
+    name = request.headers.get(DATABASE_HEADER)
+    if name:
+        try:
+            g.database = databases.resolve(name)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        return None
+    
+    name = session.get(SESSION_KEY)
+    if name:
+        try:
+            g.database = databases.resolve(name)
+        except (ValueError, LookupError):
+            # Deleted since it was selected; fall back to the default database
+            session.pop(SESSION_KEY, None)
+
+@app.before_request
+def start_maintenance_scheduler():
+    # On the first request rather than at import, so parse workers importing the app skip it
+    maintenance_scheduler.start()
+
+def current_database():
+    """Key of the active database for cached responses."""
+    return g.get('database') or databases.default_path or app.config['SQLALCHEMY_DATABASE_URI']
+
+def use_database(path):
+    """Select the database of the current app context (None for the default)."""
+    g.database = path
+    g.pop('database_engine', None)
+
+def database_engine():
+    """Writer engine of the database selected for the current request or job."""
+    if 'database_engine' not in g:
+        g.database_engine = databases.engine(g.get('database'))
+    return g.database_engine
+
+def bump_write_generation():
+    """Invalidate cached responses of the active database; call before committing a write."""
+    bump_generation(db.session)
 
 # Define SQLite models
 class Contact(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    file_id = db.Column(db.String(255), nullable=False)
+    # Deleting a processed file deletes its contacts; checked at commit, since
+    # ingest inserts the contacts before their file row
+    file_id = db.Column(db.String(255), db.ForeignKey('processed_file.id', ondelete='CASCADE',
+                                                      deferrable=True, initially='DEFERRED'), nullable=False)
     category = db.Column(db.String(255))
     name = db.Column(db.String(255))
     email = db.Column(db.String(255))
@@ -46,20 +239,183 @@ class Contact(db.Model):
     notes = db.Column(db.Text)
     merged = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Normalized copies of email/phone for indexed duplicate lookups
+    email_norm = db.Column(db.String(255), index=True)
+    phone_norm = db.Column(db.String(255), index=True)
+    # Google Maps identifiers from scraper exports
+    place_id = db.Column(db.String(255), index=True)
+    cid = db.Column(db.String(64), index=True)
+    # Coordinates from scraper exports; indexed by the contact_geo R*Tree
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Fingerprint of the normalized fields as imported, probed to skip rows imported again (known_rows.py)
+    row_hash = db.Column(db.String(32), index=True)
+
+    @validates('email')
+    def _set_email_norm(self, key, value):
+        self.email_norm = normalize_email(value)
+        return value
+
+    @validates('phone')
+    def _set_phone_norm(self, key, value):
+        self.phone_norm = normalize_phone(value)
+        return value
+
+    __table_args__ = (
+        # Keyset pagination on (review_count, id), optionally within a filter
+        db.Index('ix_contact_review_id', 'review_count', 'id'),
+        db.Index('ix_contact_file_review_id', 'file_id', 'review_count', 'id'),
+        db.Index('ix_contact_city_review_id', 'city', 'review_count', 'id'),
+        db.Index('ix_contact_category_review_id', 'category', 'review_count', 'id'),
+        db.Index('ix_contact_with_email_review_id', 'review_count', 'id',
+                 sqlite_where=sa.text("email IS NOT NULL AND email != ''")),
+    )
+
+class ContactMatch(db.Model):
+    """Duplicate link recorded at ingest; maintained by triggers (see contact_matches.py)."""
+    __tablename__ = 'contact_matches'
+    id = db.Column(db.Integer, primary_key=True)
+    contact_id = db.Column(db.Integer, nullable=False)
+    # Earliest other contact sharing the key, overall or within the file
+    match_id = db.Column(db.Integer, nullable=False)
+    # email, phone, place_id or cid
+    match_type = db.Column(db.String(20), nullable=False)
+    # global or file
+    scope = db.Column(db.String(10), nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('contact_id', 'match_id', 'match_type', 'scope', name='uq_contact_matches_link'),
+        db.Index('ix_contact_matches_match', 'match_id', 'match_type'),
+    )
+
+class ExtraField(db.Model):
+    """A non-standard column name seen in uploads (see extra_fields.py)."""
+    __tablename__ = 'extra_fields'
+    id = db.Column(db.Integer, primary_key=True)
+    # Cleaned column name, e.g. average_rating
+    name = db.Column(db.String(255), nullable=False, unique=True)
+    # Column header as first uploaded, e.g. Average Rating
+    label = db.Column(db.String(255))
+
+class ContactField(db.Model):
+    """Value of an extra column for one contact."""
+    __tablename__ = 'contact_fields'
+    contact_id = db.Column(db.Integer, primary_key=True)
+    field_id = db.Column(db.Integer, primary_key=True)
+    value_text = db.Column(db.Text, nullable=False)
+    # Numeric (or yes/no as 1/0) value used for range filters and sorting
+    value_num = db.Column(db.Float)
+    
+    __table_args__ = (
+        db.Index('ix_contact_fields_num', 'field_id', 'value_num', 'contact_id',
+                 sqlite_where=sa.text('value_num IS NOT NULL')),
+        db.Index('ix_contact_fields_text', 'field_id', 'value_text', 'contact_id',
+                 sqlite_where=sa.text(f'length(value_text) <= {MAX_INDEXED_TEXT}')),
+        {'sqlite_with_rowid': False},
+    )
 
 class ProcessedFile(db.Model):
     id = db.Column(db.String(255), primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
-    file_hash = db.Column(db.String(255), nullable=False)
+    # Looked up for every upload to skip files already imported
+    file_hash = db.Column(db.String(255), nullable=False, index=True)
     creation_date = db.Column(db.DateTime, nullable=False)
-    processed_date = db.Column(db.DateTime, default=datetime.utcnow)
+    # Order of the processed files list
+    processed_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Contacts inserted from the file
     row_count = db.Column(db.Integer, nullable=False)
+    # Rows in the file, including those skipped as known or that updated another file's contact
+    rows_read = db.Column(db.Integer)
+    # JSON list of the file's extra columns, stored in contact_fields
+    extra_columns = db.Column(db.Text)
+
+class Job(db.Model):
+    __bind_key__ = 'jobs'
+    id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    # queued, running, succeeded, failed or cancelled
+    status = db.Column(db.String(20), nullable=False, index=True)
+    processed = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer)
+    # JSON response of the finished job; job parameters are not stored
+    # because export requests carry database passwords
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    # Process running the job; jobs of dead processes are failed at startup
+    worker_pid = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+# Worker pool for uploads, duplicate search, merges and exports
+job_manager = JobManager(
+    app, db, Job, max_workers=int(os.environ.get('JOB_WORKERS', DEFAULT_MAX_WORKERS)),
+    current_database=lambda: g.get('database'), use_database=use_database
+)
+
+# Create or upgrade the contact tables of one database
+def prepare_database(engine):
+    db.metadata.create_all(engine)
+    added = ensure_columns(engine, Contact.__table__)
+    ensure_columns(engine, ProcessedFile.__table__)
+    ensure_foreign_keys(engine, Contact.__table__)
+    ensure_indexes(engine, [Contact.__table__, ContactMatch.__table__, ContactField.__table__, ProcessedFile.__table__])
+    ensure_search_index(engine, Contact.__tablename__)
+    ensure_geo_index(engine, Contact.__tablename__)
+    ensure_match_triggers(engine, Contact.__tablename__)
+    ensure_field_triggers(engine, Contact.__tablename__)
+    ensure_generation_table(engine)
+    if 'email_norm' in added or 'phone_norm' in added:
+        backfill_normalized_contacts(engine, Contact.__table__)
+    if 'row_hash' in added:
+        backfill_row_hashes(engine, Contact.__table__)
+
+# Engines of the instance/*.db databases, opened and prepared on first use;
+# their read-only pools are disposed along with them
+with app.app_context():
+    databases = DatabaseRegistry(
+        app.instance_path, db.engine,
+        engine_options=app.config['SQLALCHEMY_ENGINE_OPTIONS'],
+        max_engines=app.config['DATABASE_MAX_ENGINES'],
+        idle_timeout=app.config['DATABASE_IDLE_TIMEOUT'],
+        configure=configure_writer, prepare=prepare_database,
+        on_dispose=lambda engine: read_pool.discard(engine.url)
+    )
+db.select_engine = database_engine
+
+# Threads querying the databases in parallel for cross-database lookups
+app.config['FEDERATED_WORKERS'] = int(os.environ.get('FEDERATED_WORKERS', DEFAULT_FEDERATED_WORKERS))
+
+# Read-only engines for lookups across every database, separate from the writers above
+federated = FederatedLookup(
+    databases, max_workers=app.config['FEDERATED_WORKERS'], busy_timeout=app.config['SQLITE_WRITE_TIMEOUT']
+)
+
+# Seconds between background ANALYZE/vacuum passes over the open databases (0 disables them)
+app.config['MAINTENANCE_INTERVAL'] = int(os.environ.get('MAINTENANCE_INTERVAL', DEFAULT_MAINTENANCE_INTERVAL))
+
+# Last maintenance result per database path
+last_maintenance = {}
+
+def maintain_open_databases():
+    for path, engine in databases.open_engines():
+        result = run_maintenance(engine)
+        if result is not None:
+            last_maintenance[path] = result
+
+maintenance_scheduler = MaintenanceScheduler(maintain_open_databases, app.config['MAINTENANCE_INTERVAL'])
 
 # Create database tables
 def setup_database():
     try:
-        db.create_all()
+        configure_writer(db.engine)
+        configure_pragmas(job_manager.engine)
+        prepare_database(db.engine)
+        db.create_all(bind_key='jobs')
+        ensure_columns(job_manager.engine, Job.__table__)
+        job_manager.recover_interrupted()
         logging.info("Database setup completed successfully")
     except Exception as e:
         logging.error(f"Error setting up database: {e}")
@@ -67,22 +423,38 @@ def setup_database():
 with app.app_context():
     setup_database()
 
+def open_read_session():
+    """New ORM session on the read-only pool of the current database; the caller closes it.
+    
+    Job functions use it as a context manager rather than read_session(),
+    so their reader connection is returned as soon as they are done.
+    """
+    return sa.orm.Session(read_pool.engine(db.engine))
+
+def read_session():
+    """Read-only ORM session of the current request, closed when its app context ends."""
+    if 'read_session' not in g:
+        g.read_session = open_read_session()
+    return g.read_session
+
+@app.teardown_appcontext
+def close_read_session(exception=None):
+    read_session = g.pop('read_session', None)
+    if read_session is not None:
+        read_session.close()
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/upload', methods=['POST'])
-def upload_files():
-    if 'files[]' not in request.files:
-        return jsonify({'error': 'No files provided'}), 400
-    
-    files = request.files.getlist('files[]')
-    
-    if not files or files[0].filename == '':
-        return jsonify({'error': 'No files selected'}), 400
-    
-    uploaded_files = []
+def spool_request_files(files):
+    """Spool uploaded files to temp files.
+
+    Returns (pending, errors); each pending entry describes one spooled file.
+    """
+    pending = []
     errors = []
+    stages = StageTimer()
     
     for file in files:
         # Check file extension
@@ -94,120 +466,162 @@ def upload_files():
             continue
         
         try:
-            # Create file ID
-            file_id = str(uuid.uuid4())
-            
-            # Calculate file hash for duplicate detection
-            file_content = file.read()
-            file_hash = hashlib.md5(file_content).hexdigest()
-            file.seek(0)  # Reset file pointer after reading
-            
-            # Check if file was already processed
-            existing_file = ProcessedFile.query.filter_by(file_hash=file_hash).first()
-            
-            if existing_file:
-                errors.append(f"{filename}: File already processed")
-                continue
-            
-            # Read file content based on extension
-            if file_ext in ['csv', 'txt']:
-                df = pd.read_csv(file)
-            else:  # xls or xlsx
-                df = pd.read_excel(file)
-            
-            # Clean column names (lowercase, remove spaces)
-            df.columns = [col.lower().strip().replace(' ', '_') for col in df.columns]
-            
-            # Map common column variations to standard names
-            column_mapping = {
-                'category': ['category', 'категория', 'cat', 'type', 'тип'],
-                'name': ['name', 'fullname', 'full_name', 'contact_name', 'person', 'заведение', 'название', 'имя'],
-                'email': ['email', 'email_address', 'emailaddress', 'mail', 'почта', 'эл_почта', 'электронная_почта'],
-                'phone': ['phone', 'phone_number', 'phonenumber', 'telephone', 'mobile', 'cell', 'телефон', 'номер', 'тел'],
-                'facebook': ['facebook', 'fb', 'facebook_url', 'fb_url', 'фейсбук'],
-                'website': ['website', 'site', 'web', 'url', 'сайт', 'веб-сайт', 'web_site'],
-                'city': ['city', 'town', 'город', 'населенный_пункт', 'нас_пункт'],
-                'address': ['address', 'location', 'full_address', 'адрес', 'местоположение'],
-                'company': ['company', 'organization', 'business_name', 'company_name', 'компания', 'организация', 'фирма'],
-                'position': ['position', 'title', 'job_title', 'должность', 'позиция', 'роль']
-            }
-            
-            # Standardize column names
-            standard_columns = {}
-            for std_col, variations in column_mapping.items():
-                for col in df.columns:
-                    if col in variations:
-                        standard_columns[col] = std_col
-            
-            # Rename columns
-            df.rename(columns=standard_columns, inplace=True)
-            
-            # Make sure all standard columns exist
-            for col in ['category', 'name', 'email', 'phone', 'facebook', 'website', 'city', 'address', 'company', 'position']:
-                if col not in df.columns:
-                    df[col] = None
-            
-            # Add notes column if not present
-            if 'notes' not in df.columns:
-                df['notes'] = None
-            
-            # Insert data into SQLite
-            row_count = 0
-            
-            for _, row in df.iterrows():
-                contact = Contact(
-                    file_id=file_id,
-                    category=row.get('category', None),
-                    name=row.get('name', None),
-                    email=row.get('email', None),
-                    phone=row.get('phone', None),
-                    facebook=row.get('facebook', None),
-                    website=row.get('website', None),
-                    city=row.get('city', None),
-                    address=row.get('address', None),
-                    company=row.get('company', None),
-                    position=row.get('position', None),
-                    notes=row.get('notes', None)
-                )
-                db.session.add(contact)
-                row_count += 1
-            
-            # Add file to processed_files
-            processed_file = ProcessedFile(
-                id=file_id,
-                filename=filename,
-                file_size=len(file_content),
-                file_hash=file_hash,
-                creation_date=datetime.now(),
-                row_count=row_count
-            )
-            db.session.add(processed_file)
-            
-            db.session.commit()
-            
-            # Add to uploaded files list
-            uploaded_files.append({
-                'id': file_id,
+            # Spool the upload to disk, hashing it for duplicate detection
+            with stages.stage('spool'):
+                tmp_path, file_hash, file_size = spool_upload(file.stream, suffix=f'.{file_ext}')
+            pending.append({
                 'filename': filename,
-                'rows': row_count,
-                'columns': list(df.columns)
+                'file_ext': file_ext,
+                'path': tmp_path,
+                'hash': file_hash,
+                'size': file_size
             })
-            
         except Exception as e:
-            logging.error(f"Error processing file {filename}: {str(e)}")
+            logging.error(f"Error spooling file {filename}: {str(e)}")
             errors.append(f"{filename}: {str(e)}")
     
-    return jsonify({
+    metrics.record_stages('upload', stages.seconds)
+    return pending, errors
+
+def discard_spooled_files(pending):
+    for item in pending:
+        if os.path.exists(item['path']):
+            os.remove(item['path'])
+
+def ingest_spooled_files(pending, errors, progress=None, known_rows_mode=None, session=None):
+    """Import spooled files, one transaction per file, and remove them.
+    
+    Files are parsed in parallel by the parse pool while this thread, the
+    only writer, inserts them one after another. Rows imported before are
+    skipped or update their contact, as known_rows_mode says.
+    """
+    known_rows_mode = known_rows_mode or app.config['KNOWN_ROWS']
+    session = session or read_session()
+    uploaded_files = []
+    
+    try:
+        if progress is not None:
+            estimates = [estimate_rows(item['path'], item['file_ext']) for item in pending]
+            if all(estimate is not None for estimate in estimates):
+                progress.set_total(sum(estimates))
+        
+        # Check which files were already processed before parsing any of them
+        to_import = []
+        seen_hashes = set()
+        for item in pending:
+            existing_file = session.scalar(
+                sa.select(ProcessedFile).where(ProcessedFile.file_hash == item['hash']).limit(1)
+            )
+            if existing_file or item['hash'] in seen_hashes:
+                errors.append(f"{item['filename']}: File already processed")
+                continue
+            seen_hashes.add(item['hash'])
+            # Create file ID
+            to_import.append({**item, 'file_id': str(uuid.uuid4())})
+        
+        parsed_files = upload_parser.parse(to_import, app.config['UPLOAD_BATCH_SIZE'])
+        try:
+            for item, batches in parsed_files:
+                filename = item['filename']
+                file_id = item['file_id']
+                try:
+                    # Insert the parsed batches of this file, linking each batch
+                    # to the contacts it duplicates
+                    extra_writer = ExtraFieldWriter(db.session, ExtraField.__table__, ContactField.__table__)
+                    known_rows = None
+                    if known_rows_mode != 'insert':
+                        known_rows = KnownRows(db.session, Contact.__table__, file_id, known_rows_mode, extra_writer)
+                    columns, stats = insert_row_batches(
+                        db.session, Contact.__table__, batches,
+                        batch_size=app.config['UPLOAD_BATCH_SIZE'],
+                        progress=progress,
+                        after_batch=MatchRecorder(db.session),
+                        extra_writer=extra_writer,
+                        known_rows=known_rows
+                    )
+                    log_ingest(file_id, stats)
+                    
+                    # Add file to processed_files
+                    processed_file = ProcessedFile(
+                        id=file_id,
+                        filename=filename,
+                        file_size=item['size'],
+                        file_hash=item['hash'],
+                        creation_date=datetime.now(),
+                        row_count=stats.rows,
+                        rows_read=stats.rows_read,
+                        extra_columns=json.dumps(extra_writer.names, ensure_ascii=False)
+                    )
+                    db.session.add(processed_file)
+                    
+                    bump_write_generation()
+                    with stats.stages.stage('commit'):
+                        db.session.commit()
+                    metrics.record_stages('upload', stats.stages.seconds, rows=stats.rows_read)
+                    
+                    # Add to uploaded files list
+                    uploaded_files.append({
+                        'id': file_id,
+                        'filename': filename,
+                        'rows': stats.rows_read,
+                        'new': stats.rows,
+                        'updated': known_rows.updated if known_rows else 0,
+                        'skipped': known_rows.skipped if known_rows else 0,
+                        'columns': columns,
+                        'rows_per_sec': round(stats.rows_per_sec, 1)
+                    })
+                
+                except JobCancelled:
+                    db.session.rollback()
+                    raise
+                except Exception as e:
+                    db.session.rollback()
+                    logging.error(f"Error processing file {filename}: {str(e)}")
+                    errors.append(f"{filename}: {str(e)}")
+        finally:
+            # Cancels parses not consumed yet, e.g. after a cancellation
+            parsed_files.close()
+    finally:
+        discard_spooled_files(pending)
+    
+    return {
         'success': len(uploaded_files) > 0,
         'uploaded_files': uploaded_files,
         'errors': errors
-    })
+    }
+
+def request_upload_files():
+    """Uploaded files of the current request, or an error response."""
+    if 'files[]' not in request.files:
+        return None, (jsonify({'error': 'No files provided'}), 400)
+    
+    files = request.files.getlist('files[]')
+    
+    if not files or files[0].filename == '':
+        return None, (jsonify({'error': 'No files selected'}), 400)
+    
+    return files, None
+
+@app.route('/upload', methods=['POST'])
+def upload_files():
+    files, error_response = request_upload_files()
+    if error_response:
+        return error_response
+    
+    try:
+        known_rows_mode = parse_known_rows_mode(request.form.get('known_rows'), app.config['KNOWN_ROWS'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    pending, errors = spool_request_files(files)
+    return jsonify(ingest_spooled_files(pending, errors, known_rows_mode=known_rows_mode))
 
 @app.route('/get_all_contacts')
+@response_cache.cached(current_database)
 def get_all_contacts():
     try:
-        # Get all contacts from the database
-        contacts = Contact.query.all()
+        table = Contact.__table__
+        filters = filters_from_args(table, request.args)
         
         # Prepare columns info (same structure as in get_file_data)
         columns = [
@@ -226,108 +640,249 @@ def get_all_contacts():
             {'name': 'created_at', 'display_name': 'Дата создания', 'visible': False}
         ]
         
-        # Convert contacts to JSON serializable format
-        contacts_json = []
-        for contact in contacts:
-            contact_dict = {
-                'id': contact.id,
-                'file_id': contact.file_id,
-                'category': contact.category,
-                'name': contact.name,
-                'email': contact.email,
-                'phone': contact.phone,
-                'facebook': contact.facebook,
-                'website': contact.website,
-                'city': contact.city,
-                'address': contact.address,
-                'company': contact.company,
-                'position': contact.position,
-                'review_count': contact.review_count,
-                'notes': contact.notes,
-                'merged': contact.merged,
-                'created_at': contact.created_at.isoformat() if contact.created_at else None
-            }
-            contacts_json.append(contact_dict)
+        layout = parse_layout(request.args.get('format'))
         
-        # Sort by review count (descending)
-        contacts_json.sort(key=lambda x: (x.get('review_count') or 0), reverse=True)
+        # Paginated listing: one keyset page plus the total on the first page
+        if wants_page(request.args):
+            page = fetch_page(
+                read_session(), table, filters,
+                limit=parse_limit(request.args.get('limit')),
+                after=parse_cursor(request.args.get('after')),
+                layout=layout
+            )
+            return jsonify({
+                'filename': 'Вся база данных',
+                'columns': columns,
+                **page
+            })
+        
+        # Full listing, sorted by review count (descending) in SQLite
+        rows = read_session().execute(
+            sa.select(*(table.c[field] for field in LISTING_FIELDS))
+            .where(*filters).order_by(*listing_order(table))
+        ).all()
         
         return jsonify({
             'filename': 'Вся база данных',
             'columns': columns,
-            'contacts': contacts_json
+            'contacts': contact_payload(rows, LISTING_FIELDS, layout)
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app.logger.error(f"Error fetching all contacts: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Fields returned by get_file_data, in column order
+FILE_DATA_FIELDS = [
+    'id', 'category', 'name', 'email', 'phone', 'facebook', 'website', 'city',
+    'address', 'company', 'position', 'review_count', 'notes', 'merged'
+]
+
 @app.route('/get_file_data/<file_id>')
+@response_cache.cached(current_database)
 def get_file_data(file_id):
     try:
-        # Get all contacts for the given file
-        contacts = Contact.query.filter_by(file_id=file_id).all()
-        
         # Get file info
-        file_info = ProcessedFile.query.get(file_id)
+        file_info = read_session().get(ProcessedFile, file_id)
         
         if not file_info:
             return jsonify({'error': 'File not found'}), 404
         
-        # Convert contacts to dictionaries for JSON serialization
-        contact_list = []
-        for contact in contacts:
-            contact_dict = {
-                'id': contact.id,
-                'category': contact.category,
-                'name': contact.name,
-                'email': contact.email,
-                'phone': contact.phone,
-                'facebook': contact.facebook,
-                'website': contact.website,
-                'city': contact.city,
-                'address': contact.address,
-                'company': contact.company,
-                'position': contact.position,
-                'review_count': contact.review_count,
-                'notes': contact.notes,
-                'merged': contact.merged
-            }
-            contact_list.append(contact_dict)
-            
-        # Сортировка по количеству отзывов (более высокие значения выше)
-        contact_list = sorted(contact_list, key=lambda x: x.get('review_count', 0) or 0, reverse=True)
-        
-        # Generate column list
-        columns = []
-        if contact_list:
-            for key in contact_list[0].keys():
-                if key not in ['id', 'file_id']:
-                    columns.append({
-                        'name': key,
-                        'display_name': key.replace('_', ' ').title(),
-                        'visible': True
-                    })
+        table = Contact.__table__
+        filters = filters_from_args(table, request.args, file_id=file_id)
+        
+        layout = parse_layout(request.args.get('format'))
+        columns = [
+            {'name': key, 'display_name': key.replace('_', ' ').title(), 'visible': True}
+            for key in FILE_DATA_FIELDS if key not in ['id', 'file_id']
+        ]
+        
+        # Paginated listing: one keyset page plus the total on the first page
+        if wants_page(request.args):
+            page = fetch_page(
+                read_session(), table, filters,
+                limit=parse_limit(request.args.get('limit')),
+                after=parse_cursor(request.args.get('after')),
+                fields=FILE_DATA_FIELDS,
+                layout=layout
+            )
+            return jsonify({
+                'filename': file_info.filename,
+                'columns': columns,
+                **page
+            })
+        
+        # Get all contacts for the given file, sorted by review count in SQLite
+        rows = read_session().execute(
+            sa.select(*(table.c[field] for field in FILE_DATA_FIELDS))
+            .where(*filters).order_by(*listing_order(table))
+        ).all()
         
         return jsonify({
             'filename': file_info.filename,
-            'columns': columns,
-            'contacts': contact_list
+            # No columns for an empty file, as before
+            'columns': columns if rows else [],
+            'contacts': contact_payload(rows, FILE_DATA_FIELDS, layout)
         })
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error fetching file data: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/find_duplicates/<file_id>')
-def find_duplicates(file_id):
+@app.route('/search')
+def search():
+    """Ranked full-text search over name, company, category, city, address and notes.
+    
+    ?q= holds the search words (the last one matches as a prefix); ?file_id=
+    limits the search to one file. Pages with ?limit= and ?offset=.
+    """
     try:
-        # Get all contacts for the file
-        contacts = Contact.query.filter_by(file_id=file_id).all()
+        query = request.args.get('q', '')
+        if not query.strip():
+            return jsonify({'error': 'Missing search query'}), 400
+        
+        results = search_contacts(
+            read_session(), query,
+            limit=parse_search_limit(request.args.get('limit')),
+            offset=max(request.args.get('offset', 0, type=int), 0),
+            file_id=request.args.get('file_id') or None
+        )
+        return jsonify({'success': True, 'query': query, **results})
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error searching contacts: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/nearby')
+def nearby():
+    """Contacts near a point or inside a bounding box.
+    
+    ?lat=&lon= with ?radius= (metres, default 500) returns the nearest
+    contacts first with their distance; ?bbox=south,west,north,east returns
+    the contacts inside the box. ?file_id= and ?limit= narrow the result.
+    """
+    try:
+        file_id = request.args.get('file_id') or None
+        limit = parse_nearby_limit(request.args.get('limit'))
+        
+        if request.args.get('bbox'):
+            south, west, north, east = parse_bbox(request.args['bbox'])
+            contacts = contacts_in_box(read_session(), south, west, north, east, file_id=file_id, limit=limit)
+            return jsonify({'success': True, 'bbox': [south, west, north, east], 'contacts': contacts})
+        
+        if request.args.get('lat') is None or request.args.get('lon') is None:
+            return jsonify({'error': 'Pass lat and lon, or bbox'}), 400
+        lat, lon = parse_point(request.args['lat'], request.args['lon'])
+        radius = parse_radius(request.args.get('radius'))
+        contacts = contacts_near(read_session(), lat, lon, radius, file_id=file_id, limit=limit)
+        return jsonify({'success': True, 'lat': lat, 'lon': lon, 'radius': radius, 'contacts': contacts})
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error finding nearby contacts: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/extra_fields')
+def get_extra_fields():
+    """Extra columns kept from uploads (name and original header)."""
+    try:
+        return jsonify({'success': True, 'fields': list_fields(read_session())})
+    except Exception as e:
+        logging.error(f"Error listing extra fields: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/extra_fields/<name>/contacts')
+def get_extra_field_contacts(name):
+    """Contacts filtered and sorted by an extra column, through its indexes.
+    
+    ?eq= matches the exact text (e.g. Claimed=YES); otherwise contacts with
+    a numeric value in [?min=, ?max=] are returned ordered by value
+    (?order=desc or asc). Pages with ?limit= and the returned ?after= cursor.
+    """
+    try:
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify({'error': 'order must be asc or desc'}), 400
+        
+        results = field_contacts(
+            read_session(), name,
+            minimum=parse_number(request.args.get('min'), 'min'),
+            maximum=parse_number(request.args.get('max'), 'max'),
+            equals=request.args.get('eq') or None,
+            descending=order == 'desc',
+            limit=parse_field_limit(request.args.get('limit')),
+            after=parse_field_cursor(request.args.get('after'))
+        )
+        return jsonify({'success': True, **results})
+    
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error filtering by extra field: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export/<export_format>')
+def export_contacts_file(export_format):
+    """Download contacts as CSV, NDJSON, XLSX or Parquet.
+    
+    Exports one file (?file_id=) or the whole database, narrowed by the
+    listing filters (city, category, has_email) and an optional full-text
+    query (?q=). The response is streamed in batches.
+    """
+    try:
+        check_format(export_format)
         
-        # Convert to dictionaries for easier processing
-        contact_list = []
-        for contact in contacts:
-            contact_dict = {
+        file_id = request.args.get('file_id') or None
+        export_name = 'all_contacts'
+        if file_id:
+            file_info = read_session().get(ProcessedFile, file_id)
+            if not file_info:
+                return jsonify({'error': 'File not found'}), 404
+            export_name = file_info.filename.rsplit('.', 1)[0]
+        
+        table = Contact.__table__
+        filters = filters_from_args(table, request.args, file_id=file_id)
+        if request.args.get('q'):
+            filters.append(match_filter(table, request.args['q']))
+        
+        chunks = stream_export(read_session(), table, filters, export_format)
+        download_name = secure_filename(f"{export_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}") or 'contacts'
+        fmt = EXPORT_FORMATS[export_format]
+        return Response(
+            stream_with_context(chunks),
+            mimetype=fmt['mimetype'],
+            headers={'Content-Disposition': f"attachment; filename={download_name}.{fmt['extension']}"}
+        )
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error exporting contacts: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Maximum number of bound ids per IN (...) query
+ID_CHUNK_SIZE = 900
+
+def load_duplicate_groups(groups, similarity=None, session=None):
+    """Load contacts for groups of ids, keeping group and id order.
+    
+    With a similarity mapping, each contact carries its match score.
+    """
+    session = session or read_session()
+    contacts_by_id = {}
+    all_ids = [contact_id for group in groups for contact_id in group]
+    for start in range(0, len(all_ids), ID_CHUNK_SIZE):
+        chunk = all_ids[start:start + ID_CHUNK_SIZE]
+        for contact in session.scalars(sa.select(Contact).where(Contact.id.in_(chunk))):
+            contacts_by_id[contact.id] = {
                 'id': contact.id,
                 'category': contact.category,
                 'name': contact.name,
@@ -341,134 +896,141 @@ def find_duplicates(file_id):
                 'position': contact.position,
                 'review_count': contact.review_count,
                 'notes': contact.notes,
-                'merged': contact.merged
+                'merged': contact.merged,
+                'file_id': contact.file_id,
+                'latitude': contact.latitude,
+                'longitude': contact.longitude
             }
-            contact_list.append(contact_dict)
-        
-        # Use the JavaScript duplicate detection approach in Python
-        # Group contacts by email and phone
-        groups_by_email = {}
-        groups_by_phone = {}
-        
-        for contact in contact_list:
-            if contact['email']:
-                email = contact['email'].lower()
-                if email not in groups_by_email:
-                    groups_by_email[email] = []
-                groups_by_email[email].append(contact)
-                
-            if contact['phone']:
-                # Normalize phone by removing non-digit characters
-                phone = ''.join(char for char in contact['phone'] if char.isdigit())
-                if phone and phone not in groups_by_phone:
-                    groups_by_phone[phone] = []
-                groups_by_phone[phone].append(contact)
-        
-        # Find groups with more than one contact
-        duplicate_groups = []
-        processed_ids = set()
-        
-        # Process email groups
-        for email, group in groups_by_email.items():
-            if len(group) > 1:
-                # Ensure we don't duplicate contacts that might be in both email and phone groups
-                group_ids = [c['id'] for c in group]
-                if any(id not in processed_ids for id in group_ids):
-                    duplicate_groups.append(group)
-                    processed_ids.update(group_ids)
-        
-        # Process phone groups
-        for phone, group in groups_by_phone.items():
-            if len(group) > 1:
-                # Ensure we don't duplicate contacts that might be in both email and phone groups
-                group_ids = [c['id'] for c in group]
-                if any(id not in processed_ids for id in group_ids):
-                    duplicate_groups.append(group)
-                    processed_ids.update(group_ids)
+            if similarity is not None:
+                contacts_by_id[contact.id]['similarity'] = similarity.get(contact.id)
+    return [
+        [contacts_by_id[contact_id] for contact_id in group if contact_id in contacts_by_id]
+        for group in groups
+    ]
+
+def parse_distance(value):
+    """Optional "same place" distance in metres for duplicate search."""
+    if value is None or value == '':
+        return None
+    return parse_radius(value, maximum=MAX_PAIR_DISTANCE_M, name='distance')
+
+def find_duplicate_groups(file_id=None, keys=None, progress=None, fuzzy=False, threshold=None, distance=None,
+                          session=None):
+    """Duplicate groups (lists of contact dicts) in a file or the whole database.
+    
+    With fuzzy, near-duplicate names (blocked by postcode or city) are
+    joined to the exact groups; with distance, contacts within that many
+    metres of each other and with similar names are joined too. Either
+    way every contact gets a similarity score. Reads go through session,
+    by default the request's read session.
+    """
+    session = session or read_session()
+    key_types = parse_key_types(keys)
+    threshold = parse_threshold(threshold)
+    distance = parse_distance(distance)
+    if set(key_types) <= set(MATCH_TYPES):
+        # Links recorded at ingest cover these keys; only domains need a scan
+        groups = cluster_matches(session, file_id=file_id, match_types=key_types, progress=progress)
+    else:
+        groups = cluster_contacts(
+            session, Contact.__table__, file_id=file_id,
+            key_types=key_types, progress=progress
+        )
+    if not fuzzy and distance is None:
+        return load_duplicate_groups(groups, session=session)
+    
+    matches = []
+    if fuzzy:
+        if progress is not None:
+            # The fuzzy pass reads every selected contact
+            count_stmt = sa.select(sa.func.count()).select_from(Contact)
+            if file_id is not None:
+                count_stmt = count_stmt.where(Contact.file_id == file_id)
+            progress.set_total(progress.processed + session.scalar(count_stmt))
+        matches.extend(find_fuzzy_matches(
+            session, Contact.__table__, file_id=file_id,
+            threshold=threshold, progress=progress
+        ))
+    if distance is not None:
+        matches.extend(find_nearby_matches(
+            session, Contact.__table__, file_id=file_id,
+            distance_m=distance, threshold=threshold, progress=progress
+        ))
+    groups, similarity = merge_fuzzy_matches(groups, matches)
+    return load_duplicate_groups(groups, similarity, session=session)
+
+@app.route('/find_duplicates', defaults={'file_id': None})
+@app.route('/find_duplicates/<file_id>')
+def find_duplicates(file_id):
+    """Find groups of duplicate contacts in a file, or in the whole database.
+    
+    Contacts linked transitively through shared keys end up in one group.
+    The ?keys= parameter selects the keys (email, phone, domain, place_id, cid);
+    ?fuzzy=1 adds near-duplicate names scoring at least ?threshold= (0.7);
+    ?distance= (metres) adds similar names at the same place.
+    """
+    try:
+        duplicate_groups = find_duplicate_groups(
+            file_id, request.args.get('keys'),
+            fuzzy=parse_bool(request.args.get('fuzzy')),
+            threshold=request.args.get('threshold'),
+            distance=request.args.get('distance')
+        )
         
         return jsonify({
             'success': True,
             'duplicates': duplicate_groups
         })
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error finding duplicates: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def merge_contact_groups(data, progress=None):
+    """Merge the duplicate groups of a request; returns (payload, status)."""
+    if not data or 'duplicates' not in data:
+        return {'error': 'Invalid request data'}, 400
+    
+    # Groups of contact ids; the first record of each group is the primary
+    groups = [
+        [contact['id'] for contact in group]
+        for group in data['duplicates']
+        if len(group) >= 2
+    ]
+    
+    stats = merge_duplicate_groups(
+        db.session, Contact.__table__, groups,
+        batch_size=app.config['MERGE_BATCH_SIZE'],
+        progress=progress,
+        copy_extra=True
+    )
+    bump_write_generation()
+    db.session.commit()
+    metrics.rows.inc(stats['deleted'], 'merge')
+    
+    return {'success': True, **stats}, 200
+
 @app.route('/merge_duplicates', methods=['POST'])
 def merge_duplicates():
     try:
-        data = request.json
-        if not data or 'duplicates' not in data:
-            return jsonify({'error': 'Invalid request data'}), 400
-        
-        duplicates = data['duplicates']
-        
-        for group in duplicates:
-            if len(group) < 2:
-                continue
-            
-            # Use the first record as the primary
-            primary_id = group[0]['id']
-            primary_contact = Contact.query.get(primary_id)
-            
-            if not primary_contact:
-                continue
-            
-            # Mark as merged
-            primary_contact.merged = True
-            
-            # Merge data from other records
-            merged_notes = primary_contact.notes or ''
-            
-            for i in range(1, len(group)):
-                dup_id = group[i]['id']
-                dup_contact = Contact.query.get(dup_id)
-                
-                if not dup_contact:
-                    continue
-                
-                # For each field, if we have a value in the duplicate but not in the primary, copy it
-                for field in ['category', 'name', 'email', 'phone', 'facebook', 'website', 'city', 'address', 'company', 'position']:
-                    primary_value = getattr(primary_contact, field)
-                    dup_value = getattr(dup_contact, field)
-                    
-                    if dup_value and dup_value != primary_value:
-                        # If primary doesn't have a value for this field, use the duplicate's value
-                        if not primary_value:
-                            setattr(primary_contact, field, dup_value)
-                        # Otherwise, note the merged value
-                        else:
-                            merged_notes += f"\nMerged {field}: {dup_value}"
-                
-                # Для review_count берем максимальное значение
-                if dup_contact.review_count > primary_contact.review_count:
-                    primary_contact.review_count = dup_contact.review_count
-                
-                # Also merge any notes
-                if dup_contact.notes and dup_contact.notes != primary_contact.notes:
-                    merged_notes += f"\nMerged notes: {dup_contact.notes}"
-                
-                # Delete the duplicate
-                db.session.delete(dup_contact)
-            
-            # Update primary record's notes
-            primary_contact.notes = merged_notes
-            
-            # Commit changes
-            db.session.commit()
-        
-        return jsonify({'success': True})
+        payload, status = merge_contact_groups(request.json)
+        return jsonify(payload), status
     
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Error merging duplicates: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_processed_files')
+@response_cache.cached(current_database)
 def get_processed_files():
     try:
         # Get all processed files
-        files = ProcessedFile.query.order_by(ProcessedFile.processed_date.desc()).all()
+        files = read_session().scalars(
+            sa.select(ProcessedFile).order_by(ProcessedFile.processed_date.desc())
+        ).all()
         
         # Convert to dictionaries for JSON serialization
         file_list = []
@@ -478,7 +1040,9 @@ def get_processed_files():
                 'filename': f.filename,
                 'file_size': f.file_size,
                 'processed_date': f.processed_date.strftime('%Y-%m-%d %H:%M:%S'),
-                'row_count': f.row_count
+                'row_count': f.row_count,
+                'rows_read': f.rows_read,
+                'extra_columns': json.loads(f.extra_columns) if f.extra_columns else []
             }
             file_list.append(file_dict)
         
@@ -494,185 +1058,263 @@ def delete_file(file_id):
     try:
         # Begin transaction
         with db.session.begin():
-            # Delete all contacts associated with the file
-            Contact.query.filter_by(file_id=file_id).delete()
-            
-            # Delete the file record
-            file = ProcessedFile.query.get(file_id)
-            if not file:
-                return jsonify({'error': 'File not found'}), 404
-                
-            db.session.delete(file)
-            
+            # Contacts, and through their triggers their links and extra
+            # fields, go with the file row (ON DELETE CASCADE)
+            table = ProcessedFile.__table__
+            deleted = db.session.execute(sa.delete(table).where(table.c.id == file_id)).rowcount
+            if deleted:
+                bump_write_generation()
+        
+        if not deleted:
+            return jsonify({'error': 'File not found'}), 404
+        
         return jsonify({'success': True, 'message': 'File deleted successfully'})
     except Exception as e:
         logging.error(f"Error deleting file: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def run_mysql_export(data, progress=None, session=None):
+    """Export contacts to MySQL with an optional uniqueness check.
+    
+    Returns (payload, status) so the route and the background job share it.
+    """
+    session = session or read_session()
+    if not data or 'mysql_config' not in data:
+        return {'error': 'Invalid request data'}, 400
+    
+    mysql_config = data['mysql_config']
+    export_all = data.get('export_all', False)
+    file_id = data.get('file_id', None)
+    check_uniqueness = data.get('check_uniqueness', True)  # По умолчанию проверять уникальность
+    
+    # Validate MySQL config
+    required_fields = ['host', 'port', 'database', 'user', 'password']
+    for field in required_fields:
+        if field not in mysql_config:
+            return {'error': f'Missing required field: {field}'}, 400
+    
+    if not export_all and not file_id:
+        return {'error': 'Missing file_id for single file export'}, 400
+    
+    source_file_id = None if export_all else file_id
+    source_filters = [] if export_all else [Contact.file_id == file_id]
+    if session.scalar(sa.select(Contact.id).where(*source_filters).limit(1)) is None:
+        return {'error': 'No contacts to export'}, 404
+    if progress is not None:
+        progress.set_total(session.scalar(sa.select(sa.func.count()).select_from(Contact).where(*source_filters)))
+    
+    # Create MySQL SQLAlchemy engine
+    connection_uri = build_connection_uri(mysql_config, app.config.get('EXPORT_TARGET_URI'))
+    
+    # Reuse a pooled engine for this target; pre-ping validates the connection
+    try:
+        target = export_engines.entry(connection_uri)
+        mysql_engine = target.engine
+        with mysql_engine.connect():  # Test connection
+            pass
+    except Exception as e:
+        export_engines.discard(connection_uri)
+        return {'error': f'Error connecting to MySQL: {str(e)}'}, 500
+    
+    # Create the table (with unique normalized email/phone keys) once per engine
+    contacts_table = define_contacts_table(sa.MetaData())
+    if not target.state.get('schema_ready'):
+        ensure_target_schema(mysql_engine, contacts_table)
+        target.state['schema_ready'] = True
+        target.state['table_names'] = sa.inspect(mysql_engine).get_table_names()
+    
+    # Stream contacts in batches; the unique indexes skip existing records
+    stats = export_contacts(
+        session, Contact.__table__, mysql_engine, contacts_table,
+        file_id=source_file_id,
+        check_uniqueness=check_uniqueness,
+        batch_size=app.config['EXPORT_BATCH_SIZE'],
+        progress=progress
+    )
+    metrics.record_stages('export', stats['stages'], rows=stats['total'])
+    
+    # Get MySQL tables information (reflected once per engine)
+    mysql_tables = []
+    table_names = target.state['table_names']
+    
+    for name in table_names:
+        mysql_tables.append({
+            'name': name,
+            'active': True  # Assume all tables are active by default
+        })
+    
+    return {
+        'success': True,
+        'exported_count': stats['exported_count'],
+        'skipped_count': stats['skipped_count'],
+        'rows_per_sec': stats['rows_per_sec'],
+        'mysql_tables': mysql_tables
+    }, 200
+
 # MySQL related routes and functions
 @app.route('/export_to_mysql', methods=['POST'])
 def export_to_mysql():
     """Export contacts to MySQL database with uniqueness check."""
     try:
-        data = request.json
-        if not data or 'mysql_config' not in data:
-            return jsonify({'error': 'Invalid request data'}), 400
-        
-        mysql_config = data['mysql_config']
-        export_all = data.get('export_all', False)
-        file_id = data.get('file_id', None)
-        check_uniqueness = data.get('check_uniqueness', True)  # По умолчанию проверять уникальность
-        
-        # Validate MySQL config
-        required_fields = ['host', 'port', 'database', 'user', 'password']
-        for field in required_fields:
-            if field not in mysql_config:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-        
-        # Create MySQL SQLAlchemy engine
-        connection_uri = f"mysql+pymysql://{mysql_config['user']}:{mysql_config['password']}@{mysql_config['host']}:{mysql_config['port']}/{mysql_config['database']}"
-        
-        try:
-            mysql_engine = sa.create_engine(connection_uri)
-            mysql_engine.connect()  # Test connection
-        except Exception as e:
-            return jsonify({'error': f'Error connecting to MySQL: {str(e)}'}), 500
-        
-        # Get contacts to export
-        if export_all:
-            contacts = Contact.query.all()
+        payload, status = run_mysql_export(request.json)
+        return jsonify(payload), status
+    
+    except Exception as e:
+        logging.error(f"Error exporting to MySQL: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export_pool_stats')
+def export_pool_stats():
+    """Connection pool statistics for cached export target engines."""
+    export_engines.evict_idle()
+    return jsonify({'success': True, 'engines': export_engines.stats()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request, SQL and stage metrics in the Prometheus text format."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/response_cache_stats')
+def response_cache_stats():
+    """Hit, miss and 304 counters of the read response cache."""
+    return jsonify({'success': True, 'cache': response_cache.stats()})
+
+# Background jobs
+def run_upload_job(params, progress):
+    with open_read_session() as session:
+        return ingest_spooled_files(params['pending'], params['errors'], progress, params.get('known_rows'), session)
+
+def run_find_duplicates_job(params, progress):
+    with open_read_session() as session:
+        duplicate_groups = find_duplicate_groups(
+            params.get('file_id'), params.get('keys'), progress,
+            fuzzy=bool(params.get('fuzzy')), threshold=params.get('threshold'),
+            distance=params.get('distance'), session=session
+        )
+    return {'success': True, 'duplicates': duplicate_groups}
+
+def payload_job(func, reads=False):
+    """Adapt a (payload, status) helper to a job function that raises on errors.
+    
+    With reads, the helper gets a read session opened for the job.
+    """
+    def run(params, progress):
+        if reads:
+            with open_read_session() as session:
+                payload, status = func(params, progress, session=session)
         else:
-            if not file_id:
-                return jsonify({'error': 'Missing file_id for single file export'}), 400
-            contacts = Contact.query.filter_by(file_id=file_id).all()
-        
-        if not contacts:
-            return jsonify({'error': 'No contacts to export'}), 404
-        
-        # Create table if it doesn't exist
-        table_name = 'contacts'
-        metadata = sa.MetaData()
-        
-        # Define the contacts table for MySQL
-        contacts_table = sa.Table(
-            table_name, metadata,
-            sa.Column('id', sa.Integer, primary_key=True),
-            sa.Column('category', sa.String(255)),
-            sa.Column('name', sa.String(255)),
-            sa.Column('email', sa.String(255)),
-            sa.Column('phone', sa.String(255)),
-            sa.Column('facebook', sa.String(255)),
-            sa.Column('website', sa.String(255)),
-            sa.Column('city', sa.String(255)),
-            sa.Column('address', sa.String(255)),
-            sa.Column('company', sa.String(255)),
-            sa.Column('position', sa.String(255)),
-            sa.Column('review_count', sa.Integer, default=0),
-            sa.Column('notes', sa.Text),
-            sa.Column('created_at', sa.DateTime, default=datetime.utcnow),
+            payload, status = func(params, progress)
+        if status != 200:
+            raise ValueError(payload['error'])
+        return payload
+    return run
+
+def run_maintenance_job(params, progress):
+    result = run_maintenance(database_engine(), analyze=params.get('analyze', True), vacuum=params.get('vacuum', True))
+    if result is None:
+        raise ValueError('Maintenance is only available for SQLite databases')
+    last_maintenance[current_database()] = result
+    return {'success': True, 'database': os.path.basename(current_database()), **result}
+
+job_manager.register('upload', run_upload_job)
+job_manager.register('find_duplicates', run_find_duplicates_job)
+job_manager.register('merge_duplicates', payload_job(merge_contact_groups))
+job_manager.register('export_to_mysql', payload_job(run_mysql_export, reads=True))
+job_manager.register('maintenance', run_maintenance_job)
+
+@app.route('/jobs/upload', methods=['POST'])
+def submit_upload_job():
+    """Spool the uploaded files and import them in the background."""
+    files, error_response = request_upload_files()
+    if error_response:
+        return error_response
+    
+    try:
+        known_rows_mode = parse_known_rows_mode(request.form.get('known_rows'), app.config['KNOWN_ROWS'])
+        pending, errors = spool_request_files(files)
+        if not pending:
+            return jsonify({'error': 'No files to process', 'errors': errors}), 400
+        
+        job_id = job_manager.submit(
+            'upload', {'pending': pending, 'errors': errors, 'known_rows': known_rows_mode},
+            on_discard=lambda: discard_spooled_files(pending)
         )
-        
-        # Create the table if it doesn't exist
-        metadata.create_all(mysql_engine)
-        
-        # Get existing records for uniqueness check if enabled
-        existing_emails = set()
-        existing_phones = set()
-        
-        if check_uniqueness:
-            with mysql_engine.connect() as conn:
-                # Get existing emails
-                email_result = conn.execute(sa.text("SELECT email FROM contacts WHERE email IS NOT NULL AND email != ''"))
-                for row in email_result:
-                    if row[0]:
-                        existing_emails.add(row[0].lower())
-                
-                # Get existing phone numbers (normalized)
-                phone_result = conn.execute(sa.text("SELECT phone FROM contacts WHERE phone IS NOT NULL AND phone != ''"))
-                for row in phone_result:
-                    if row[0]:
-                        # Normalize phone by removing non-digit characters
-                        phone = ''.join(char for char in row[0] if char.isdigit())
-                        if phone:
-                            existing_phones.add(phone)
-        
-        # Export contacts, checking for uniqueness if enabled
-        exported_count = 0
-        skipped_count = 0
-        
-        with mysql_engine.connect() as conn:
-            for contact in contacts:
-                # Check uniqueness if enabled
-                skip = False
-                if check_uniqueness:
-                    # Check email uniqueness
-                    if contact.email and contact.email.lower() in existing_emails:
-                        skip = True
-                    
-                    # Check phone uniqueness
-                    if contact.phone:
-                        normalized_phone = ''.join(char for char in contact.phone if char.isdigit())
-                        if normalized_phone and normalized_phone in existing_phones:
-                            skip = True
-                
-                if not skip:
-                    # Insert the contact
-                    insert_stmt = sa.insert(contacts_table).values(
-                        category=contact.category,
-                        name=contact.name,
-                        email=contact.email,
-                        phone=contact.phone,
-                        facebook=contact.facebook,
-                        website=contact.website,
-                        city=contact.city,
-                        address=contact.address,
-                        company=contact.company,
-                        position=contact.position,
-                        review_count=contact.review_count,
-                        notes=contact.notes,
-                        created_at=datetime.utcnow()
-                    )
-                    result = conn.execute(insert_stmt)
-                    conn.commit()
-                    
-                    # Update uniqueness tracking
-                    if check_uniqueness:
-                        if contact.email:
-                            existing_emails.add(contact.email.lower())
-                        if contact.phone:
-                            normalized_phone = ''.join(char for char in contact.phone if char.isdigit())
-                            if normalized_phone:
-                                existing_phones.add(normalized_phone)
-                    
-                    exported_count += 1
-                else:
-                    skipped_count += 1
-        
-        # Get MySQL tables information
-        mysql_tables = []
-        inspector = sa.inspect(mysql_engine)
-        table_names = inspector.get_table_names()
-        
-        for name in table_names:
-            mysql_tables.append({
-                'name': name,
-                'active': True  # Assume all tables are active by default
-            })
-        
-        return jsonify({
-            'success': True,
-            'exported_count': exported_count,
-            'skipped_count': skipped_count,
-            'mysql_tables': mysql_tables
-        })
+        return jsonify({'success': True, 'job_id': job_id}), 202
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logging.error(f"Error exporting to MySQL: {str(e)}")
+        logging.error(f"Error submitting upload job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    """Run find_duplicates, merge_duplicates or export_to_mysql in the background."""
+    try:
+        data = request.get_json(silent=True) or {}
+        if kind == 'upload':
+            return jsonify({'error': 'Upload jobs take multipart files at /jobs/upload'}), 400
+        if kind == 'find_duplicates':
+            # Validate keys, threshold and distance now rather than failing inside the job
+            parse_key_types(data.get('keys'))
+            parse_threshold(data.get('threshold'))
+            parse_distance(data.get('distance'))
+        
+        job_id = job_manager.submit(kind, data)
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error submitting {kind} job: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Job status with progress (rows processed, total, ETA) and its result."""
+    job = job_manager.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Ask a queued or running job to stop; its open transaction is rolled back."""
+    try:
+        if not job_manager.cancel(job_id):
+            return jsonify({'error': 'Job not found or already finished'}), 404
+        return jsonify({'success': True})
+    
+    except Exception as e:
+        logging.error(f"Error cancelling job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs')
+def list_jobs():
+    """Most recent background jobs, newest first."""
+    try:
+        limit = parse_job_limit(request.args.get('limit'))
+        return jsonify({'success': True, 'jobs': job_manager.list(limit)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error listing jobs: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Fields of the contacts returned by find_similar_records
+SIMILAR_FIELDS = [
+    'id', 'category', 'name', 'email', 'phone', 'facebook', 'website', 'city',
+    'address', 'company', 'position', 'review_count', 'notes', 'file_id'
+]
+
 @app.route('/find_similar_records', methods=['POST'])
 def find_similar_records():
-    """Find similar records based on email and phone number."""
+    """Find contacts in other files sharing an email or phone with a file.
+    
+    Reads the links recorded at ingest instead of rescanning the contacts.
+    With all_databases, contacts of the other databases sharing an email or
+    phone are added, each with the name of its database.
+    """
     try:
         data = request.json
         if not data:
@@ -683,133 +1325,130 @@ def find_similar_records():
         if not file_id:
             return jsonify({'error': 'Missing file_id parameter'}), 400
         
+        layout = parse_layout(data.get('format'))
+        table = Contact.__table__
+        columns = [table.c[field] for field in SIMILAR_FIELDS]
+        
         # Get contacts from the file
-        contacts = Contact.query.filter_by(file_id=file_id).all()
+        file_rows = read_session().execute(sa.select(*columns).where(table.c.file_id == file_id)).all()
         
-        if not contacts:
+        if not file_rows:
             return jsonify({'error': 'No contacts found for the file'}), 404
         
-        # Collect emails and phones from the current file
-        emails = set()
-        phones = set()
-        file_contacts = []
-        
-        for contact in contacts:
-            contact_dict = {
-                'id': contact.id,
-                'category': contact.category,
-                'name': contact.name,
-                'email': contact.email,
-                'phone': contact.phone,
-                'facebook': contact.facebook,
-                'website': contact.website,
-                'city': contact.city,
-                'address': contact.address,
-                'company': contact.company,
-                'position': contact.position,
-                'review_count': contact.review_count,
-                'notes': contact.notes,
-                'file_id': contact.file_id
-            }
-            file_contacts.append(contact_dict)
-            
-            if contact.email:
-                emails.add(contact.email.lower())
-            
-            if contact.phone:
-                normalized_phone = ''.join(char for char in contact.phone if char.isdigit())
-                if normalized_phone:
-                    phones.add(normalized_phone)
-        
-        # Find similar contacts in other files
-        similar_contacts = []
-        
-        # Query by emails
-        if emails:
-            similar_by_email = Contact.query.filter(
-                Contact.email.isnot(None),
-                sa.func.lower(Contact.email).in_(emails),
-                Contact.file_id != file_id
-            ).all()
-            
-            for contact in similar_by_email:
-                similar_contacts.append({
-                    'id': contact.id,
-                    'category': contact.category,
-                    'name': contact.name,
-                    'email': contact.email,
-                    'phone': contact.phone,
-                    'facebook': contact.facebook,
-                    'website': contact.website,
-                    'city': contact.city,
-                    'address': contact.address,
-                    'company': contact.company,
-                    'position': contact.position,
-                    'review_count': contact.review_count,
-                    'notes': contact.notes,
-                    'file_id': contact.file_id,
-                    'match_type': 'email'
-                })
-        
-        # Query by normalized phone numbers
-        phone_matches = []
-        if phones:
-            all_contacts = Contact.query.filter(
-                Contact.phone.isnot(None),
-                Contact.file_id != file_id
-            ).all()
-            
-            for contact in all_contacts:
-                if contact.phone:
-                    normalized_phone = ''.join(char for char in contact.phone if char.isdigit())
-                    if normalized_phone in phones:
-                        phone_matches.append({
-                            'id': contact.id,
-                            'category': contact.category,
-                            'name': contact.name,
-                            'email': contact.email,
-                            'phone': contact.phone,
-                            'facebook': contact.facebook,
-                            'website': contact.website,
-                            'city': contact.city,
-                            'address': contact.address,
-                            'company': contact.company,
-                            'position': contact.position,
-                            'review_count': contact.review_count,
-                            'notes': contact.notes,
-                            'file_id': contact.file_id,
-                            'match_type': 'phone'
-                        })
-        
-        # Combine results, removing potential duplicates
+        # Contacts in other files linked at ingest by email, then by phone
+        similar_rows = []
         seen_ids = set()
-        combined_results = []
-        
-        for contact in similar_contacts + phone_matches:
-            if contact['id'] not in seen_ids:
-                seen_ids.add(contact['id'])
-                combined_results.append(contact)
+        for match_type in SIMILAR_MATCH_TYPES:
+            ids = [contact_id for contact_id in similar_contact_ids(read_session(), file_id, match_type)
+                   if contact_id not in seen_ids]
+            seen_ids.update(ids)
+            for start in range(0, len(ids), ID_CHUNK_SIZE):
+                chunk = ids[start:start + ID_CHUNK_SIZE]
+                query = sa.select(*columns).where(table.c.id.in_(chunk)).order_by(table.c.id)
+                similar_rows.extend((*row, match_type) for row in read_session().execute(query))
         
         # Get file information for matches
         file_info = {}
-        file_ids = set(contact['file_id'] for contact in combined_results)
+        file_position = SIMILAR_FIELDS.index('file_id')
+        file_ids = set(row[file_position] for row in similar_rows)
         
         if file_ids:
-            files = ProcessedFile.query.filter(ProcessedFile.id.in_(file_ids)).all()
+            files = read_session().scalars(sa.select(ProcessedFile).where(ProcessedFile.id.in_(file_ids))).all()
             for f in files:
                 file_info[f.id] = f.filename
         
+        similar_fields = SIMILAR_FIELDS + ['match_type']
+        errors = []
+        if data.get('all_databases'):
+            current_name = os.path.basename(current_database())
+            similar_rows = [(*row, current_name) for row in similar_rows]
+            similar_fields.append('database')
+            other_rows, errors = similar_in_other_databases(file_id, current_name)
+            for row in other_rows:
+                file_info.setdefault(row[file_position], row[-3])
+                similar_rows.append((*row[:len(SIMILAR_FIELDS)], row[-2][0], row[-1]))
+        
         return jsonify({
             'success': True,
-            'file_contacts': file_contacts,
-            'similar_contacts': combined_results,
-            'file_info': file_info
+            'file_contacts': contact_payload(file_rows, SIMILAR_FIELDS, layout),
+            'similar_contacts': contact_payload(similar_rows, similar_fields, layout),
+            'file_info': file_info,
+            'errors': errors
         })
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error finding similar records: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def similar_in_other_databases(file_id, current_name):
+    """Contacts of the other databases sharing an email or phone with a file.
+    
+    Returns merge_matches() rows of SIMILAR_FIELDS (so each row ends with
+    the filename, the match types and the database) and per-database errors.
+    """
+    table = Contact.__table__
+    values = {match_type: [] for match_type in SIMILAR_MATCH_TYPES}
+    query = sa.select(table.c.email_norm, table.c.phone_norm).where(table.c.file_id == file_id)
+    for email_norm, phone_norm in read_session().execute(query):
+        values['email'].append(email_norm)
+        values['phone'].append(phone_norm)
+    try:
+        keys = lookup_keys(values)
+    except ValueError:
+        # Neither an email nor a usable phone in the file
+        return [], []
+    paths = {name: path for name, path in federated.paths().items() if name != current_name}
+    results, errors = federated.run(match_query(table, ProcessedFile.__table__, SIMILAR_FIELDS, keys), paths)
+    return merge_matches(results), errors
+
+# Fields of the contacts returned by /lookup
+LOOKUP_FIELDS = ['id', 'name', 'email', 'phone', 'city', 'category', 'website', 'review_count', 'file_id']
+
+@app.route('/lookup', methods=['GET', 'POST'])
+def lookup_contacts():
+    """Find contacts by email, phone, Place Id or Cid in every database.
+    
+    GET takes repeatable email, phone, place_id and cid parameters; POST a
+    JSON object with the same keys holding a value or a list of values.
+    `databases` (comma separated file names, or a list) limits the search.
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            values = {match_type: data.get(match_type) for match_type in NORMALIZERS}
+            values = {match_type: value if isinstance(value, list) else [value] for match_type, value in values.items()}
+            names = data.get('databases')
+            layout = parse_layout(data.get('format'))
+        else:
+            values = {match_type: request.args.getlist(match_type) for match_type in NORMALIZERS}
+            names = request.args.get('databases')
+            layout = parse_layout(request.args.get('format'))
+        if isinstance(names, str):
+            names = [name.strip() for name in names.split(',') if name.strip()]
+        
+        keys = lookup_keys(values)
+        paths = federated.paths(names or None)
+        results, errors = federated.run(
+            match_query(Contact.__table__, ProcessedFile.__table__, LOOKUP_FIELDS, keys), paths
+        )
+        
+        return jsonify({
+            'success': True,
+            'contacts': contact_payload(merge_matches(results), LOOKUP_FIELDS + ['filename', 'match_types', 'database'], layout),
+            'databases': sorted(paths),
+            'errors': errors
+        })
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        logging.error(f"Error looking up contacts: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/toggle_mysql_table', methods=['POST'])
 def toggle_mysql_table():
     """Toggle the active state of a MySQL table."""
@@ -837,40 +1476,28 @@ def toggle_mysql_table():
 def get_database_info():
     """Get information about available databases."""
     try:
-        # Путь к папке с базами данных
-        db_folder = 'instance'
-        
-        # Получение списка файлов баз данных
-        databases = []
-        if os.path.exists(db_folder):
-            for file in os.listdir(db_folder):
-                if file.endswith('.db'):
-                    db_path = os.path.join(db_folder, file)
-                    db_size = os.path.getsize(db_path)
-                    db_modified = os.path.getmtime(db_path)
-                    db_modified_date = datetime.fromtimestamp(db_modified).strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    # Определение текущей активной базы данных
-                    current_db_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-                    is_active = os.path.abspath(current_db_path) == os.path.abspath(db_path)
-                    
-                    databases.append({
-                        'name': file,
-                        'path': db_path,
-                        'size': db_size,
-                        'size_formatted': format_file_size(db_size),
-                        'modified': db_modified_date,
-                        'is_active': is_active
-                    })
-        
-        # Получение текущего пути базы данных
-        current_db = app.config['SQLALCHEMY_DATABASE_URI']
+        current_db = current_database()
+        listed = databases.list(current_db)
+        # Free space of every file, read in parallel over read-only connections
+        health, _ = federated.run(
+            database_health, {info['name']: info['path'] for info in listed}, prepare=False
+        )
+        databases_info = []
+        for info in listed:
+            info['size_formatted'] = format_file_size(info['size'])
+            info['modified'] = datetime.fromtimestamp(info['modified']).strftime('%Y-%m-%d %H:%M:%S')
+            info['health'] = health.get(info['name'])
+            if info['health'] is not None:
+                info['health']['reclaimable_formatted'] = format_file_size(info['health']['reclaimable_bytes'])
+            info['last_maintenance'] = last_maintenance.get(info['path'])
+            databases_info.append(info)
         
         return jsonify({
             'success': True,
-            'databases': databases,
+            'databases': databases_info,
             'current_db': current_db,
-            'db_folder': os.path.abspath(db_folder)
+            'db_folder': databases.folder,
+            'open_engines': databases.stats()
         })
     
     except Exception as e:
@@ -891,69 +1518,48 @@ def create_database():
         if not db_name.endswith('.db'):
             db_name += '.db'
         
-        # Создание путем к новой базе данных
-        db_folder = 'instance'
-        if not os.path.exists(db_folder):
-            os.makedirs(db_folder)
-        
-        db_path = os.path.join(db_folder, db_name)
-        
-        # Проверка, существует ли уже база данных с таким именем
-        if os.path.exists(db_path):
-            return jsonify({'error': f'Database {db_name} already exists'}), 400
-        
-        # Создание новой базы данных
-        new_db_uri = f'sqlite:///{db_path}'
-        
-        # Временно изменяем URI базы данных
-        old_db_uri = app.config['SQLALCHEMY_DATABASE_URI']
-        app.config['SQLALCHEMY_DATABASE_URI'] = new_db_uri
-        
-        # Создаем таблицы в новой базе данных
-        with app.app_context():
-            db.create_all()
-        
-        # Возвращаем старый URI
-        app.config['SQLALCHEMY_DATABASE_URI'] = old_db_uri
+        # Creates the file with all tables; the current database stays selected
+        db_path = databases.create(db_name)
         
         return jsonify({
             'success': True,
-            'message': f'Database {db_name} created successfully',
+            'message': f'Database {os.path.basename(db_path)} created successfully',
             'db_path': db_path
         })
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error creating database: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/switch_database', methods=['POST'])
 def switch_database():
-    """Switch to another database."""
+    """Switch this browser session to another database.
+    
+    Only the session changes; other clients keep their database, and API
+    clients can select one per request with the X-Database header instead.
+    """
     try:
         data = request.json
         if not data or 'db_path' not in data:
             return jsonify({'error': 'Missing database path'}), 400
         
-        db_path = data['db_path']
-        
-        # Проверка существования базы данных
-        if not os.path.exists(db_path):
-            return jsonify({'error': f'Database file not found: {db_path}'}), 404
-        
-        # Изменение URI базы данных
-        new_db_uri = f'sqlite:///{db_path}'
-        app.config['SQLALCHEMY_DATABASE_URI'] = new_db_uri
-        
-        # Перезагрузка соединения с базой данных
-        with app.app_context():
-            db.create_all()  # Убедимся, что все таблицы существуют
+        db_path = databases.resolve(data['db_path'])
+        # Open (and on first use prepare) it now rather than on the next request
+        databases.engine(db_path)
+        session[SESSION_KEY] = os.path.basename(db_path)
         
         return jsonify({
             'success': True,
-            'message': f'Switched to database: {db_path}',
-            'db_uri': new_db_uri
+            'message': f'Switched to database: {os.path.basename(db_path)}',
+            'db_path': db_path
         })
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         logging.error(f"Error switching database: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -966,25 +1572,30 @@ def delete_database():
         if not data or 'db_path' not in data:
             return jsonify({'error': 'Missing database path'}), 400
         
-        db_path = data['db_path']
-        
-        # Проверка существования базы данных
-        if not os.path.exists(db_path):
-            return jsonify({'error': f'Database file not found: {db_path}'}), 404
+        db_path = databases.resolve(data['db_path'])
         
         # Проверка, не удаляем ли мы текущую активную базу данных
-        current_db_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-        if os.path.abspath(current_db_path) == os.path.abspath(db_path):
+        if db_path == current_database():
             return jsonify({'error': 'Cannot delete the currently active database'}), 400
+        if db_path == databases.default_path:
+            return jsonify({'error': 'Cannot delete the default database'}), 400
         
-        # Удаление файла базы данных
-        os.remove(db_path)
+        # Close its pooled connections first; sessions still selecting it fall back to the default
+        databases.discard(db_path)
+        federated.discard(db_path)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
         
         return jsonify({
             'success': True,
-            'message': f'Database deleted: {db_path}'
+            'message': f'Database deleted: {os.path.basename(db_path)}'
         })
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         logging.error(f"Error deleting database: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,9 @@
+"""Reproducible benchmarks for the hot paths of the app.
+
+datagen writes synthetic Maps-Scraper exports; run drives upload, listing,
+duplicate search, merge and export through the Flask test client against
+scratch databases and records wall time, peak RSS and statement counts:
+
+    python -m benchmarks.run --sizes 10k 100k --output baseline.json
+    python -m benchmarks.run --sizes 10k 100k --compare baseline.json
+"""
@@ -0,0 +1,192 @@
+"""Synthetic Maps-Scraper exports with a controlled share of duplicates.
+
+Rows follow the header of the real exports in attached_assets. Each row is
+either a new place or, with probability dup_rate, a copy of an earlier
+place in one of the forms seen in practice:
+
+- rescrape: the same place again (same email, phone, Place Id and Cid)
+- phone: the phone punctuated another way, no email
+- email: the email in another case, a different phone
+- fuzzy: a name variant at the same address, with new identifiers
+
+Places are derived from (seed, index), so only the indexes of original
+rows are kept in memory, and the same arguments always produce the same
+files.
+
+    python -m benchmarks.datagen --rows 100000 --files 2 --dup-rate 0.1 out/
+"""
+import argparse
+import array
+import csv
+import hashlib
+import os
+import random
+
+HEADER = [
+    'Name', 'Fulladdress', 'Street', 'Municipality', 'Categories', 'Phone', 'Phones', 'Claimed',
+    'Review Count', 'Average Rating', 'Review URL', 'Google Maps URL', 'Latitude', 'Longitude',
+    'Website', 'Domain', 'Opening hours', 'Featured image', 'Cid', 'Place Id', 'Kgmid', 'Plus code',
+    'Google Knowledge URL', 'Email', 'Social Medias', 'Facebook', 'Instagram', 'Twitter', 'Yelp'
+]
+
+# (municipality, country as the exports write it, latitude, longitude, dialling code, area code)
+CITIES = [
+    ('Glasgow', 'Великобритания', 55.8617, -4.2583, '44', '141'),
+    ('Leeds', 'Великобритания', 53.8008, -1.5491, '44', '113'),
+    ('London', 'Великобритания', 51.5072, -0.1276, '44', '20'),
+    ('Manchester', 'Великобритания', 53.4808, -2.2426, '44', '161'),
+    ('Huddersfield', 'Великобритания', 53.6458, -1.7850, '44', '1484'),
+    ('Paris', 'Франция', 48.8566, 2.3522, '33', '1'),
+    ('Marseille', 'Франция', 43.2965, 5.3698, '33', '4'),
+    ('Lyon', 'Франция', 45.7640, 4.8357, '33', '4'),
+    ('Nantes', 'Франция', 47.2184, -1.5536, '33', '2'),
+    ('Nice', 'Франция', 43.7102, 7.2620, '33', '4'),
+]
+
+CATEGORIES = ['Ночной клуб', 'Бар', 'Паб', 'Ресторан', 'Кафе', 'Коктейль-бар', 'Караоке-бар', 'Клуб']
+
+NAME_WORDS = ['Cheetah', 'Velvet', 'Neon', 'Blue', 'Golden', 'Red', 'Moon', 'Electric', 'Silver',
+              'Royal', 'Black', 'Urban', 'Crystal', 'Jazz', 'Soul', 'Vinyl', 'Garden', 'Harbour']
+NAME_SUFFIXES = ['Club', 'Bar', 'Lounge', 'Night Club', 'Rooms', 'Social', 'House', 'Tavern']
+
+STREETS = ['Queen St', 'High St', 'Market St', 'Rue de la Paix', 'Bridge St', 'Church Rd',
+           'Avenue Victor Hugo', 'Station Rd', 'Rue Nationale', 'King St']
+
+DUPLICATE_KINDS = ['rescrape', 'phone', 'email', 'fuzzy']
+
+UK_LETTERS = 'ABDEFGHJLNPQRSTUWXYZ'
+
+# Index multiplier spreading phone numbers; coprime with 10 ** 7, so unique
+PHONE_STRIDE = 7919
+
+
+def digest(seed, index, purpose):
+    return hashlib.blake2b(f'{seed}:{index}:{purpose}'.encode(), digest_size=16).hexdigest()
+
+
+def postcode(rng, city):
+    if city[1] == 'Франция':
+        return f'{rng.randint(1, 95):02d}{rng.randint(0, 999):03d}'
+    return f'{city[0][0]}{rng.randint(1, 20)} {rng.randint(1, 9)}{rng.choice(UK_LETTERS)}{rng.choice(UK_LETTERS)}'
+
+
+def place(seed, index):
+    """The place with this index, as a dict of raw values."""
+    rng = random.Random(f'{seed}:{index}')
+    city = CITIES[index % len(CITIES)]
+    name = f'{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {rng.choice(NAME_SUFFIXES)}'
+    street = f'{rng.randint(1, 250)} {rng.choice(STREETS)}'
+    local = f'{(index * PHONE_STRIDE) % 10 ** 7:07d}'
+    slug = name.lower().replace(' ', '')
+    domain = f'{slug}{index}.{"fr" if city[1] == "Франция" else "co.uk"}'
+    return {
+        'name': name,
+        'street': street,
+        'city': city,
+        'postcode': postcode(rng, city),
+        'category': rng.choice(CATEGORIES),
+        'country_code': city[4],
+        'area_code': city[5],
+        'local': local,
+        'email': f'info@{domain}' if rng.random() < 0.7 else '',
+        'domain': domain,
+        'reviews': int(rng.paretovariate(1.2) * 5),
+        'rating': round(rng.uniform(2.5, 5.0), 1),
+        'latitude': city[2] + rng.uniform(-0.05, 0.05),
+        'longitude': city[3] + rng.uniform(-0.08, 0.08),
+        'cid': str(int(digest(seed, index, 'cid'), 16) % 10 ** 19),
+        'place_id': 'ChIJ' + digest(seed, index, 'place')[:23],
+        'claimed': rng.choice(['YES', 'NO']),
+    }
+
+
+def duplicate(seed, index, source, rng):
+    """A copy of `source` as row `index` would record it."""
+    row = dict(source)
+    kind = rng.choice(DUPLICATE_KINDS)
+    if kind == 'phone':
+        row['email'] = ''
+        row['phone_style'] = 'dashed'
+    elif kind == 'email':
+        row['email'] = row['email'].upper() or f'contact@{row["domain"]}'
+        row['local'] = f'{(index * PHONE_STRIDE) % 10 ** 7:07d}'
+    elif kind == 'fuzzy':
+        row['name'] = row['name'].replace('Night Club', 'Nightclub') if 'Night Club' in row['name'] \
+            else row['name'] + ' ' + row['category'].split()[0]
+        row['email'] = ''
+        row['local'] = f'{(index * PHONE_STRIDE) % 10 ** 7:07d}'
+        row['latitude'] += rng.uniform(-0.0001, 0.0001)
+        row['longitude'] += rng.uniform(-0.0001, 0.0001)
+        row['cid'] = str(int(digest(seed, index, 'cid'), 16) % 10 ** 19)
+        row['place_id'] = 'ChIJ' + digest(seed, index, 'place')[:23]
+    return row
+
+
+def csv_row(row):
+    city = row['city']
+    international = f'+{row["country_code"]} {row["area_code"]} {row["local"][:3]} {row["local"][3:]}'
+    national = f'0{row["area_code"]} {row["local"]}'
+    phone = international
+    if row.get('phone_style') == 'dashed':
+        phone = f'+{row["country_code"]}-{row["area_code"]}-{row["local"]}'
+    address = f'{row["street"]}, {city[0]} {row["postcode"]}, {city[1]}'
+    website = f'http://www.{row["domain"]}/'
+    facebook = f'https://www.facebook.com/{row["domain"].split(".")[0]}/'
+    return [
+        row['name'], address, row['street'], city[0], row['category'], phone, f'{national}, {international}',
+        row['claimed'], row['reviews'], row['rating'],
+        f'https://search.google.com/local/reviews?placeid={row["place_id"]}',
+        f'https://www.google.com/maps?cid={row["cid"]}',
+        f'{row["latitude"]:.7f}', f'{row["longitude"]:.7f}', website, row['domain'],
+        'понедельник:[Закрыто], пятница:[21:00–03:00], суббота:[21:00–03:00]', '',
+        row['cid'], row['place_id'], '', '', '', row['email'],
+        f'{{"facebook":"{facebook}"}}', facebook, '', '', ''
+    ]
+
+
+def generate_files(directory, rows, files=1, dup_rate=0.1, seed=0):
+    """Write `rows` rows over `files` CSV exports; returns their paths.
+
+    Duplicates copy any earlier row, so they cross file boundaries too.
+    """
+    if not 0 <= dup_rate < 1:
+        raise ValueError('dup_rate must be in [0, 1)')
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    per_file = -(-rows // files)
+    originals = array.array('L')
+    index = 0
+    for number in range(files):
+        path = os.path.join(directory, f'Synthetic {number + 1} - Maps-Scraper-net_{seed}_{rows}.csv')
+        with open(path, 'w', newline='', encoding='utf-8-sig') as out:
+            writer = csv.writer(out)
+            writer.writerow(HEADER)
+            for _ in range(min(per_file, rows - index)):
+                if originals and rng.random() < dup_rate:
+                    source = place(seed, originals[rng.randrange(len(originals))])
+                    row = duplicate(seed, index, source, rng)
+                else:
+                    row = place(seed, index)
+                    originals.append(index)
+                writer.writerow(csv_row(row))
+                index += 1
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic Maps-Scraper CSV exports')
+    parser.add_argument('directory', help='Output directory')
+    parser.add_argument('--rows', type=int, default=10000, help='Total rows over all files')
+    parser.add_argument('--files', type=int, default=1, help='Number of CSV files')
+    parser.add_argument('--dup-rate', type=float, default=0.1, help='Share of rows copying an earlier row')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    for path in generate_files(args.directory, args.rows, args.files, args.dup_rate, args.seed):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
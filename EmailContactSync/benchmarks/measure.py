@@ -0,0 +1,104 @@
+"""Wall time, peak RSS and SQL statement counts of one benchmark step."""
+import os
+import threading
+import time
+
+import sqlalchemy as sa
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Seconds between RSS samples while a step runs
+SAMPLE_INTERVAL = 0.01
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None when unknown."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RssSampler:
+    """Highest RSS seen by a background thread while the block runs.
+
+    Parse worker processes are not included; run with UPLOAD_WORKERS=1 to
+    count parsing as well.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+class StatementCounter:
+    """Counts statements sent to the driver by any engine in the process.
+
+    An executemany counts once, as it is one round trip through SQLAlchemy.
+    """
+
+    def __init__(self):
+        self.statements = 0
+        self.executemany = 0
+        self._lock = threading.Lock()
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.statements += 1
+            if executemany:
+                self.executemany += 1
+
+    def install(self):
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute', self._on_execute)
+
+    def remove(self):
+        sa.event.remove(sa.engine.Engine, 'before_cursor_execute', self._on_execute)
+
+    def snapshot(self):
+        with self._lock:
+            return self.statements, self.executemany
+
+
+def measure(counter, action):
+    """Run action() and return (its result, measurements dict)."""
+    statements, executemany = counter.snapshot()
+    with RssSampler() as sampler:
+        start = time.perf_counter()
+        result = action()
+        seconds = time.perf_counter() - start
+    after_statements, after_executemany = counter.snapshot()
+    return result, {
+        'seconds': round(seconds, 4),
+        'peak_rss_mb': round(sampler.peak / 1048576, 1) if sampler.peak is not None else None,
+        'statements': after_statements - statements,
+        'executemany': after_executemany - executemany,
+    }
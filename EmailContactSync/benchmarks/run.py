@@ -0,0 +1,268 @@
+"""Drive the hot paths through the Flask test client and record a baseline.
+
+Every size runs in its own process against scratch databases (the app
+reads DATABASE_URI, JOBS_DATABASE_URI and EXPORT_TARGET_URI at import),
+so sizes do not share caches or memory peaks and the real database is
+never touched. The MySQL export writes to a SQLite stand-in.
+
+    python -m benchmarks.run --sizes 10k 100k 1m --output baseline.json
+    python -m benchmarks.run --sizes 10k --compare baseline.json
+
+With --compare, steps slower than the baseline by more than --tolerance
+are listed and the exit status is 1.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.datagen import generate_files
+from benchmarks.measure import measure, StatementCounter
+
+SIZE_SUFFIXES = {'k': 1000, 'm': 1000000}
+
+DEFAULT_SIZES = ['10k', '100k']
+
+# Relative slowdown reported as a regression by --compare
+DEFAULT_TOLERANCE = 0.2
+
+# Steps faster than this in both runs are not compared; timer noise dominates
+MIN_COMPARED_SECONDS = 0.05
+
+EXPORT_CONFIG = {'host': 'localhost', 'port': 3306, 'database': 'benchmark', 'user': 'benchmark', 'password': ''}
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    multiplier = SIZE_SUFFIXES.get(value[-1:], 1)
+    if multiplier > 1:
+        value = value[:-1]
+    try:
+        size = int(float(value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid size: {value}')
+    if size < 1:
+        raise argparse.ArgumentTypeError('size must be positive')
+    return size
+
+
+def scenario(client, paths):
+    """(step name, action) pairs; each action returns a test client response.
+
+    Later steps read ids from earlier responses, so they run in order.
+    """
+    state = {}
+
+    def upload():
+        files = [(open(path, 'rb'), os.path.basename(path)) for path in paths]
+        try:
+            return client.post('/upload', data={'files[]': files}, content_type='multipart/form-data')
+        finally:
+            for stream, _ in files:
+                stream.close()
+
+    def find_duplicates():
+        response = client.get('/find_duplicates')
+        state['duplicates'] = response.get_json().get('duplicates', [])
+        return response
+
+    def find_similar_records():
+        files = client.get('/get_processed_files').get_json()['files']
+        return client.post('/find_similar_records', json={'file_id': files[-1]['id'], 'format': 'columnar'})
+
+    def merge_duplicates():
+        groups = [[{'id': contact['id']} for contact in group] for group in state['duplicates']]
+        return client.post('/merge_duplicates', json={'duplicates': groups})
+
+    def export_to_mysql():
+        return client.post('/export_to_mysql', json={'mysql_config': EXPORT_CONFIG, 'export_all': True})
+
+    return [
+        ('upload', upload),
+        ('get_all_contacts', lambda: client.get('/get_all_contacts')),
+        ('get_all_contacts_columnar', lambda: client.get('/get_all_contacts?format=columnar')),
+        ('get_all_contacts_page', lambda: client.get('/get_all_contacts?limit=100')),
+        ('find_duplicates', find_duplicates),
+        ('find_duplicates_fuzzy', lambda: client.get('/find_duplicates?fuzzy=1')),
+        ('find_similar_records', find_similar_records),
+        ('merge_duplicates', merge_duplicates),
+        ('export_to_mysql', export_to_mysql),
+    ]
+
+
+def step_details(name, payload):
+    """A few counts from a step's response, to spot runs doing different work."""
+    if not isinstance(payload, dict):
+        return {}
+    if name == 'upload':
+        uploads = payload.get('uploaded_files', [])
+        return {'rows': sum(upload['rows'] for upload in uploads),
+                'new': sum(upload.get('new', 0) for upload in uploads),
+                'updated': sum(upload.get('updated', 0) for upload in uploads),
+                'skipped': sum(upload.get('skipped', 0) for upload in uploads),
+                'errors': len(payload.get('errors', []))}
+    if name.startswith('find_duplicates'):
+        groups = payload.get('duplicates', [])
+        return {'groups': len(groups), 'contacts': sum(len(group) for group in groups)}
+    if name == 'merge_duplicates':
+        return {'merged_groups': payload.get('merged_groups'), 'deleted': payload.get('deleted')}
+    if name == 'export_to_mysql':
+        return {'exported': payload.get('exported_count'), 'skipped': payload.get('skipped_count')}
+    return {}
+
+
+def run_single(rows, dup_rate, files, seed, workdir):
+    """Benchmark one size in this process; the app must not be imported yet."""
+    data_dir = os.path.join(workdir, 'data')
+    start = time.perf_counter()
+    paths = generate_files(data_dir, rows, files, dup_rate, seed)
+    generate_seconds = round(time.perf_counter() - start, 2)
+
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'contacts.db')
+    os.environ['JOBS_DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'jobs.sqlite')
+    os.environ['EXPORT_TARGET_URI'] = 'sqlite:///' + os.path.join(workdir, 'export.db')
+
+    counter = StatementCounter()
+    counter.install()
+    (app, client), setup = measure(counter, import_app)
+
+    steps = {'startup': setup}
+    for name, action in scenario(client, paths):
+        response, result = measure(counter, action)
+        result['status'] = response.status_code
+        result['response_bytes'] = len(response.data)
+        result.update(step_details(name, response.get_json(silent=True)))
+        steps[name] = result
+        print(f"{rows} rows, {name}: {result['seconds']}s, {result['statements']} statements", flush=True)
+
+    return {
+        'rows': rows,
+        'files': files,
+        'dup_rate': dup_rate,
+        'seed': seed,
+        'generate_seconds': generate_seconds,
+        'input_bytes': sum(os.path.getsize(path) for path in paths),
+        'steps': steps,
+    }
+
+
+def import_app():
+    from app import app
+    return app, app.test_client()
+
+
+def run_sizes(sizes, dup_rate, files, seed, keep):
+    """Run every size in a child process; returns results keyed by size."""
+    results = {}
+    for rows in sizes:
+        workdir = tempfile.mkdtemp(prefix=f'benchmark_{rows}_')
+        output = os.path.join(workdir, 'result.json')
+        command = [
+            sys.executable, '-m', 'benchmarks.run', '--single', str(rows), '--workdir', workdir,
+            '--dup-rate', str(dup_rate), '--files', str(files), '--seed', str(seed), '--output', output
+        ]
+        try:
+            subprocess.run(command, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            with open(output) as result:
+                results[str(rows)] = json.load(result)
+        finally:
+            if not keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def metadata(args):
+    commit = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        pass
+    return {
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'dup_rate': args.dup_rate,
+        'files': args.files,
+        'seed': args.seed,
+    }
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """Print per-step ratios against a baseline; returns the regressed steps."""
+    regressions = []
+    print(f"\n{'size':>8} {'step':<28} {'base s':>9} {'now s':>9} {'ratio':>6} {'base MB':>8} {'now MB':>8} "
+          f"{'base SQL':>9} {'now SQL':>9}")
+    for size, run in current['results'].items():
+        base_run = baseline.get('results', {}).get(size)
+        if base_run is None:
+            continue
+        for name, step in run['steps'].items():
+            base = base_run['steps'].get(name)
+            if base is None:
+                continue
+            ratio = step['seconds'] / base['seconds'] if base['seconds'] else float('inf')
+            flag = ''
+            if max(step['seconds'], base['seconds']) >= MIN_COMPARED_SECONDS and ratio > 1 + tolerance:
+                regressions.append((size, name, ratio))
+                flag = '  <-- slower'
+            print(f"{size:>8} {name:<28} {base['seconds']:>9.3f} {step['seconds']:>9.3f} {ratio:>6.2f} "
+                  f"{base.get('peak_rss_mb') or 0:>8.1f} {step.get('peak_rss_mb') or 0:>8.1f} "
+                  f"{base['statements']:>9} {step['statements']:>9}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingestion, dedup, listing, merge and export')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[parse_size(size) for size in DEFAULT_SIZES],
+                        help='Row counts, e.g. 10k 100k 1m')
+    parser.add_argument('--dup-rate', type=float, default=0.1, help='Share of duplicate rows')
+    parser.add_argument('--files', type=int, default=2, help='CSV files the rows are split over')
+    parser.add_argument('--seed', type=int, default=0, help='Data generator seed')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Relative slowdown counted as a regression')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directories')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        logging.disable(logging.WARNING)
+        result = run_single(args.single, args.dup_rate, args.files, args.seed, args.workdir)
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
+        return 0
+
+    report = {
+        'meta': metadata(args),
+        'results': run_sizes(args.sizes, args.dup_rate, args.files, args.seed, args.keep),
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(json.load(baseline), report, args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} step(s) slower than the baseline by more than {args.tolerance:.0%}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Duplicate clustering over normalized contact keys.
+
+Contacts sharing any key (email, phone, website domain, Google Place Id or
+Cid) are linked, and links are followed transitively with a disjoint-set
+forest: if A shares an email with B and B shares a phone with C, all three
+land in one group. Runs in near-linear time over the selected contacts.
+
+Can be run as a batch job:
+
+    python clustering.py [--file-id FILE_ID] [--keys email,phone,domain] [--output groups.json]
+"""
+import argparse
+import json
+import logging
+
+import sqlalchemy as sa
+
+from normalization import website_domain
+
+KEY_TYPES = ('email', 'phone', 'domain', 'place_id', 'cid')
+DEFAULT_KEY_TYPES = ('email', 'phone', 'place_id', 'cid')
+
+# Placeholder values shorter than this are not treated as phone numbers
+MIN_PHONE_DIGITS = 6
+
+# Shared hosting and social sites say nothing about who owns a website
+GENERIC_DOMAINS = {
+    'facebook.com', 'm.facebook.com', 'instagram.com', 'twitter.com', 'x.com',
+    'linktr.ee', 'google.com', 'sites.google.com', 'business.site', 'wixsite.com',
+    'tiktok.com', 'youtube.com', 'linkedin.com', 'yelp.com', 'tripadvisor.com'
+}
+
+# Rows fetched per round trip while streaming keys from the database
+FETCH_SIZE = 10000
+
+
+class DisjointSet:
+    """Union-find with path halving and union by size."""
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return root_a
+
+    def components(self, min_size=2):
+        """Groups of items sharing a root, each sorted, ordered by first item."""
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        result = [sorted(group) for group in groups.values() if len(group) >= min_size]
+        result.sort(key=lambda group: group[0])
+        return result
+
+
+def parse_key_types(value):
+    """Parse a comma-separated key list, falling back to the defaults."""
+    if not value:
+        return DEFAULT_KEY_TYPES
+    key_types = tuple(key.strip() for key in value.split(',') if key.strip())
+    unknown = [key for key in key_types if key not in KEY_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown duplicate keys: {', '.join(unknown)}")
+    return key_types
+
+
+def contact_keys(row, key_types=DEFAULT_KEY_TYPES):
+    """Yield the (key type, value) pairs a contact row can be matched on."""
+    if 'email' in key_types and row['email_norm']:
+        yield 'email', row['email_norm']
+    if 'phone' in key_types and row['phone_norm'] and len(row['phone_norm']) >= MIN_PHONE_DIGITS:
+        yield 'phone', row['phone_norm']
+    if 'domain' in key_types:
+        domain = website_domain(row['website'])
+        if domain and domain not in GENERIC_DOMAINS:
+            yield 'domain', domain
+    if 'place_id' in key_types and row['place_id']:
+        yield 'place_id', row['place_id']
+    if 'cid' in key_types and row['cid']:
+        yield 'cid', row['cid']
+
+
+def cluster_rows(rows, key_types=DEFAULT_KEY_TYPES, progress=None):
+    """Connected components of contact ids linked by shared keys.
+
+    `rows` is any iterable of mappings with id, email_norm, phone_norm,
+    website, place_id and cid. Only components of two or more contacts
+    are returned.
+    """
+    forest = DisjointSet()
+    first_owner = {}
+    count = 0
+    for count, row in enumerate(rows, 1):
+        if progress is not None and count % FETCH_SIZE == 0:
+            progress.advance(FETCH_SIZE)
+            progress.check_cancelled()
+        contact_id = row['id']
+        forest.add(contact_id)
+        for key in contact_keys(row, key_types):
+            owner = first_owner.setdefault(key, contact_id)
+            if owner != contact_id:
+                forest.union(owner, contact_id)
+    if progress is not None:
+        progress.advance(count % FETCH_SIZE)
+    return forest.components()
+
+
+def key_rows_select(table, file_id=None):
+    stmt = sa.select(
+        table.c.id, table.c.email_norm, table.c.phone_norm,
+        table.c.website, table.c.place_id, table.c.cid
+    )
+    if file_id is not None:
+        stmt = stmt.where(table.c.file_id == file_id)
+    return stmt.order_by(table.c.id)
+
+
+def cluster_contacts(session, table, file_id=None, key_types=DEFAULT_KEY_TYPES, progress=None):
+    """Cluster the contacts of one file, or of the whole database."""
+    if progress is not None:
+        count_stmt = sa.select(sa.func.count()).select_from(table)
+        if file_id is not None:
+            count_stmt = count_stmt.where(table.c.file_id == file_id)
+        progress.set_total(session.execute(count_stmt).scalar())
+    result = session.execute(
+        key_rows_select(table, file_id),
+        execution_options={'yield_per': FETCH_SIZE}
+    )
+    return cluster_rows(result.mappings(), key_types, progress)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster duplicate contacts')
+    parser.add_argument('--file-id', help='Limit clustering to one uploaded file')
+    parser.add_argument('--keys', help=f"Comma-separated keys from: {', '.join(KEY_TYPES)}")
+    parser.add_argument('--output', help='Write groups of contact ids to this JSON file')
+    args = parser.parse_args()
+
+    from app import app, db, Contact
+
+    with app.app_context():
+        groups = cluster_contacts(
+            db.session, Contact.__table__,
+            file_id=args.file_id, key_types=parse_key_types(args.keys)
+        )
+
+    contacts_in_groups = sum(len(group) for group in groups)
+    print(f"Found {len(groups)} duplicate groups covering {contacts_in_groups} contacts")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(groups, f)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
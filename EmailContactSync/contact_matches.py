@@ -0,0 +1,244 @@
+"""Duplicate links recorded at ingest time in the contact_matches table.
+
+Each imported row is probed against the email, phone, Place Id and Cid
+indexes as it is inserted, and linked to the earliest other contact with
+the same key ('global' scope) and, when that one is in another file, to
+the earliest one in its own file ('file' scope). Contacts sharing a key
+therefore form a star around one contact, and duplicate groups are the
+connected components of these links: the views read the links instead of
+rescanning every contact.
+
+Triggers keep the links valid when contacts are deleted (merges, file
+deletion) or their keys change: contacts linked to the removed contact
+are re-linked to the next earliest one. Existing databases are backfilled
+when the triggers are first created; the links can be rebuilt with:
+
+    python contact_matches.py --rebuild
+"""
+import argparse
+import logging
+
+import sqlalchemy as sa
+
+from clustering import DisjointSet, MIN_PHONE_DIGITS
+from response_cache import bump_generation
+
+MATCH_TABLE = 'contact_matches'
+CONTENT_TABLE = 'contact'
+
+# Match type -> normalized contact column probed through its index
+MATCH_KEYS = {
+    'email': 'email_norm',
+    'phone': 'phone_norm',
+    'place_id': 'place_id',
+    'cid': 'cid',
+}
+MATCH_TYPES = tuple(MATCH_KEYS)
+
+# Contacts compared with the file being viewed in find_similar_records
+SIMILAR_MATCH_TYPES = ('email', 'phone')
+
+FETCH_SIZE = 10000
+
+
+def key_condition(alias, match_type):
+    column = f'{alias}.{MATCH_KEYS[match_type]}'
+    if match_type == 'phone':
+        return f'{column} IS NOT NULL AND length({column}) >= {MIN_PHONE_DIGITS}'
+    return f'{column} IS NOT NULL'
+
+
+def probe_statements(content_table, match_type, selection):
+    """INSERTs linking the contacts n matching `selection` for one key.
+
+    The unary + keeps SQLite on the key index for the same-file lookup
+    instead of scanning the file's contacts.
+    """
+    column = MATCH_KEYS[match_type]
+    global_owner = (
+        f"(SELECT min(o.id) FROM {content_table} o WHERE o.{column} = n.{column} AND o.id != n.id)"
+    )
+    file_owner = (
+        f"(SELECT min(o.id) FROM {content_table} o "
+        f"WHERE o.{column} = n.{column} AND +o.file_id = n.file_id AND o.id != n.id)"
+    )
+    candidates = f"FROM {content_table} n WHERE {selection} AND {key_condition('n', match_type)}"
+    insert = f"INSERT OR IGNORE INTO {MATCH_TABLE}(contact_id, match_id, match_type, scope)"
+    return [
+        f"{insert} SELECT id, owner, '{match_type}', 'global' FROM "
+        f"(SELECT n.id AS id, {global_owner} AS owner {candidates}) WHERE owner IS NOT NULL",
+        f"{insert} SELECT id, owner, '{match_type}', 'file' FROM "
+        f"(SELECT n.id AS id, {file_owner} AS owner, {global_owner} AS global_owner {candidates}) "
+        f"WHERE owner IS NOT NULL AND owner != global_owner",
+    ]
+
+
+def relink_statements(content_table, match_type, contact, condition='1'):
+    """Re-link contacts whose links of one type point at `contact`, then drop those links."""
+    linked = (
+        f"n.id IN (SELECT contact_id FROM {MATCH_TABLE} "
+        f"WHERE match_id = {contact} AND match_type = '{match_type}') AND {condition}"
+    )
+    return probe_statements(content_table, match_type, linked) + [
+        f"DELETE FROM {MATCH_TABLE} WHERE match_id = {contact} AND match_type = '{match_type}' AND {condition}"
+    ]
+
+
+def create_statements(content_table):
+    delete_body = []
+    update_body = []
+    for match_type, column in MATCH_KEYS.items():
+        delete_body += relink_statements(content_table, match_type, 'old.id')
+        changed = f'old.{column} IS NOT new.{column}'
+        update_body += relink_statements(content_table, match_type, 'new.id', changed)
+        update_body.append(
+            f"DELETE FROM {MATCH_TABLE} WHERE contact_id = new.id AND match_type = '{match_type}' AND {changed}"
+        )
+        update_body += probe_statements(content_table, match_type, f'n.id = new.id AND {changed}')
+    delete_body.append(f"DELETE FROM {MATCH_TABLE} WHERE contact_id = old.id")
+
+    columns = ', '.join(MATCH_KEYS.values())
+    any_changed = ' OR '.join(f'old.{column} IS NOT new.{column}' for column in MATCH_KEYS.values())
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {MATCH_TABLE}_ad AFTER DELETE ON {content_table} BEGIN "
+        + ''.join(f'{statement}; ' for statement in delete_body) + "END",
+        f"CREATE TRIGGER IF NOT EXISTS {MATCH_TABLE}_au AFTER UPDATE OF {columns} ON {content_table} "
+        f"WHEN {any_changed} BEGIN "
+        + ''.join(f'{statement}; ' for statement in update_body) + "END",
+    ]
+
+
+def ensure_match_triggers(engine, content_table=CONTENT_TABLE):
+    """Create the triggers maintaining the links, backfilling on first creation.
+
+    Returns True when the triggers were created by this call.
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as conn:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f'{MATCH_TABLE}_ad',)
+        ).first() is not None
+    with engine.begin() as conn:
+        for statement in create_statements(content_table):
+            conn.exec_driver_sql(statement)
+        if not exists:
+            conn.exec_driver_sql(f"DELETE FROM {MATCH_TABLE}")
+            record_matches(conn, content_table=content_table)
+    if not exists:
+        logging.info(f"Created {MATCH_TABLE} triggers and backfilled the links")
+    return not exists
+
+
+def record_matches(session, after_id=0, content_table=CONTENT_TABLE):
+    """Link contacts with ids above after_id; returns the highest id probed.
+
+    Runs in the caller's transaction, so links commit with the rows.
+    """
+    max_id = session.execute(sa.text(f"SELECT max(id) FROM {content_table}")).scalar()
+    if max_id is None or max_id <= after_id:
+        return after_id
+    selection = 'n.id > :after_id AND n.id <= :max_id'
+    for match_type in MATCH_TYPES:
+        for statement in probe_statements(content_table, match_type, selection):
+            session.execute(sa.text(statement), {'after_id': after_id, 'max_id': max_id})
+    return max_id
+
+
+class MatchRecorder:
+    """Links each batch of inserted rows; call after every batch."""
+
+    def __init__(self, session, content_table=CONTENT_TABLE):
+        self.session = session
+        self.content_table = content_table
+        self.last_id = session.execute(sa.text(f"SELECT max(id) FROM {content_table}")).scalar() or 0
+
+    def __call__(self):
+        self.last_id = record_matches(self.session, self.last_id, self.content_table)
+
+
+def rebuild_matches(engine, content_table=CONTENT_TABLE):
+    """Recompute every link from the contact table."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DELETE FROM {MATCH_TABLE}")
+        record_matches(conn, content_table=content_table)
+        bump_generation(conn)
+
+
+def match_links_select(file_id=None, match_types=MATCH_TYPES):
+    types = ', '.join(f"'{match_type}'" for match_type in match_types)
+    if file_id is None:
+        return sa.text(
+            f"SELECT contact_id, match_id FROM {MATCH_TABLE} WHERE match_type IN ({types})"
+        ), {}
+    return sa.text(
+        f"SELECT m.contact_id, m.match_id FROM {MATCH_TABLE} m "
+        f"JOIN {CONTENT_TABLE} a ON a.id = m.contact_id JOIN {CONTENT_TABLE} b ON b.id = m.match_id "
+        f"WHERE a.file_id = :file_id AND b.file_id = :file_id AND m.match_type IN ({types})"
+    ), {'file_id': file_id}
+
+
+def cluster_matches(session, file_id=None, match_types=MATCH_TYPES, progress=None):
+    """Duplicate groups from the recorded links, as cluster_contacts returns them."""
+    unknown = [match_type for match_type in match_types if match_type not in MATCH_KEYS]
+    if unknown:
+        raise ValueError(f"No recorded links for: {', '.join(unknown)}")
+    stmt, params = match_links_select(file_id, match_types)
+    if progress is not None:
+        count_stmt = sa.text(f"SELECT count(*) FROM ({stmt.text})")
+        progress.set_total(session.execute(count_stmt, params).scalar())
+
+    forest = DisjointSet()
+    result = session.execute(stmt, params, execution_options={'yield_per': FETCH_SIZE})
+    for partition in result.partitions(FETCH_SIZE):
+        if progress is not None:
+            progress.check_cancelled()
+        for contact_id, match_id in partition:
+            forest.add(contact_id)
+            forest.add(match_id)
+            forest.union(contact_id, match_id)
+        if progress is not None:
+            progress.advance(len(partition))
+    return forest.components()
+
+
+def similar_contact_ids(session, file_id, match_type):
+    """Ids of contacts in other files sharing a key of this type with the file.
+
+    Every contact sharing a key is linked to the same earliest contact, so
+    the file's contacts and their link targets cover all the stars to read.
+    """
+    stmt = sa.text(
+        f"WITH file_contacts AS (SELECT id FROM {CONTENT_TABLE} WHERE file_id = :file_id), "
+        f"owners AS ("
+        f"SELECT m.match_id AS id FROM {MATCH_TABLE} m JOIN file_contacts f ON f.id = m.contact_id "
+        f"WHERE m.match_type = :match_type AND m.scope = 'global' "
+        f"UNION SELECT id FROM file_contacts) "
+        f"SELECT c.id FROM {CONTENT_TABLE} c WHERE c.file_id != :file_id AND ("
+        f"c.id IN (SELECT id FROM owners) OR c.id IN ("
+        f"SELECT m.contact_id FROM {MATCH_TABLE} m WHERE m.match_type = :match_type "
+        f"AND m.scope = 'global' AND m.match_id IN (SELECT id FROM owners))) "
+        f"ORDER BY c.id"
+    )
+    return session.execute(stmt, {'file_id': file_id, 'match_type': match_type}).scalars().all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the recorded duplicate links')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute all links from the contact table')
+    args = parser.parse_args()
+
+    from app import app, db
+
+    with app.app_context():
+        ensure_match_triggers(db.engine)
+        if args.rebuild:
+            rebuild_matches(db.engine)
+        with db.engine.connect() as conn:
+            count = conn.exec_driver_sql(f"SELECT count(*) FROM {MATCH_TABLE}").scalar()
+        print(f"{count} duplicate links recorded")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
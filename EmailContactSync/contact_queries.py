@@ -0,0 +1,165 @@
+import sqlalchemy as sa
+
+from payloads import contact_payload
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Fields returned for every contact in listing responses
+LISTING_FIELDS = [
+    'id', 'file_id', 'category', 'name', 'email', 'phone', 'facebook',
+    'website', 'city', 'address', 'company', 'position', 'review_count',
+    'notes', 'merged', 'created_at'
+]
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+def parse_bool(value):
+    """Parse a query-string flag; None means "not set"."""
+    if value is None or value == '':
+        return None
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f'Invalid boolean value: {value}')
+
+
+def parse_limit(value):
+    """Parse the page size, clamped to MAX_PAGE_SIZE."""
+    if value is None or value == '':
+        return DEFAULT_PAGE_SIZE
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_cursor(value):
+    """Decode an "<review_count>,<id>" keyset cursor."""
+    if not value:
+        return None
+    try:
+        review_count, contact_id = value.split(',', 1)
+        return int(review_count), int(contact_id)
+    except ValueError:
+        raise ValueError(f'Invalid cursor: {value}')
+
+
+def format_cursor(review_count, contact_id):
+    return f'{review_count or 0},{contact_id}'
+
+
+def build_filters(table, file_id=None, city=None, category=None, has_email=None):
+    """Build WHERE clauses for the listing filters."""
+    clauses = []
+    if file_id is not None:
+        clauses.append(table.c.file_id == file_id)
+    if city:
+        clauses.append(table.c.city == city)
+    if category:
+        clauses.append(table.c.category == category)
+    if has_email is True:
+        clauses.append(sa.and_(table.c.email.isnot(None), table.c.email != ''))
+    elif has_email is False:
+        clauses.append(sa.or_(table.c.email.is_(None), table.c.email == ''))
+    return clauses
+
+
+def filters_from_args(table, args, file_id=None):
+    """Build listing filters from request.args."""
+    return build_filters(
+        table,
+        file_id=file_id,
+        city=args.get('city'),
+        category=args.get('category'),
+        has_email=parse_bool(args.get('has_email'))
+    )
+
+
+def wants_page(args):
+    """Paginated responses are opt-in via the limit/after parameters."""
+    return 'limit' in args or 'after' in args
+
+
+def listing_order(table):
+    """Order of every contact listing and export: review_count DESC, id ASC.
+
+    SQLite reads it from the (review_count, id) indexes, sorting only the
+    ids that share a review_count. `table` may be a subquery.
+    """
+    return table.c.review_count.desc(), table.c.id
+
+
+def count_contacts(session, table, filters):
+    """COUNT(*) over the filtered contacts; served from the indexes."""
+    stmt = sa.select(sa.func.count()).select_from(table).where(*filters)
+    return session.execute(stmt).scalar_one()
+
+
+def keyset_select(table, columns, filters, limit, after=None):
+    """SELECT the next `limit` rows after the (review_count, id) cursor.
+
+    Rows are in listing_order(). The cursor condition is split into
+    "same review_count, higher id" and "lower review_count" branches, each
+    an index range seek, and the two short results are merged. A single
+    OR / row-value predicate makes SQLite walk every tied row before the
+    cursor instead.
+    """
+    base = sa.select(*columns).where(*filters)
+    if after is None:
+        return base.order_by(*listing_order(table)).limit(limit)
+
+    review_count, contact_id = after
+    ties = (
+        base.where(table.c.review_count == review_count, table.c.id > contact_id)
+        .order_by(table.c.id)
+        .limit(limit)
+        .subquery()
+    )
+    lower = (
+        base.where(table.c.review_count < review_count)
+        .order_by(*listing_order(table))
+        .limit(limit)
+        .subquery()
+    )
+    merged = sa.union_all(sa.select(ties), sa.select(lower)).subquery()
+    return (
+        sa.select(merged)
+        .order_by(*listing_order(merged))
+        .limit(limit)
+    )
+
+
+def fetch_page(session, table, filters, limit=DEFAULT_PAGE_SIZE, after=None,
+               fields=LISTING_FIELDS, with_total=None, layout='rows'):
+    """Fetch one keyset page in listing_order().
+
+    `after` is the (review_count, id) pair of the last row of the previous
+    page. The total is only counted for the first page unless with_total
+    says otherwise, since clients keep it while paging. `layout` is a
+    payloads layout for the contacts.
+    """
+    stmt = keyset_select(table, [table.c[field] for field in fields], filters, limit + 1, after)
+    rows = session.execute(stmt).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = format_cursor(last[fields.index('review_count')], last[fields.index('id')])
+
+    if with_total is None:
+        with_total = after is None
+    total = count_contacts(session, table, filters) if with_total else None
+
+    return {
+        'contacts': contact_payload(rows, fields, layout),
+        'next_cursor': next_cursor,
+        'total': total,
+        'limit': limit
+    }
@@ -0,0 +1,170 @@
+"""Per-request selection of the contact database.
+
+Every `<instance>/*.db` file is a separate workspace. A request picks one
+with the X-Database header or, for the browser, the database stored in the
+session; without either it uses the configured default. Nothing global
+changes when a client switches, so concurrent users can work in different
+databases.
+
+DatabaseRegistry keeps one writer engine per file in an EngineRegistry LRU,
+prepared (tables, indexes, triggers) the first time it is opened in this
+process. RoutedSQLAlchemy makes db.session, db.engine and the models'
+queries use the selected engine.
+"""
+import os
+
+from flask_sqlalchemy import SQLAlchemy
+
+from engine_registry import EngineRegistry, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_ENGINES
+from storage import is_sqlite_file
+
+DATABASE_HEADER = 'X-Database'
+SESSION_KEY = 'database'
+DATABASE_SUFFIX = '.db'
+
+
+class RoutedSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose default engine is chosen per app context.
+
+    select_engine() returns the engine for the current context, or None to
+    use the configured one. Bound models (e.g. the job table) are unaffected.
+    """
+
+    select_engine = None
+
+    @property
+    def engines(self):
+        engines = super().engines
+        if self.select_engine is None:
+            return engines
+        engine = self.select_engine()
+        if engine is None:
+            return engines
+        return {**engines, None: engine}
+
+
+# Files SQLite keeps next to a database in WAL mode
+SIDECAR_SUFFIXES = ('-wal', '-shm')
+
+
+def database_file_stat(path):
+    """(size in bytes, last modified) of a database with its WAL and shared memory files.
+
+    Recent writes sit in the -wal file until a checkpoint copies them into
+    the main file, so its size alone under-reports a busy database.
+    """
+    stat = os.stat(path)
+    size, modified = stat.st_size, stat.st_mtime
+    for suffix in SIDECAR_SUFFIXES:
+        try:
+            stat = os.stat(path + suffix)
+        except FileNotFoundError:
+            continue
+        size += stat.st_size
+        modified = max(modified, stat.st_mtime)
+    return size, modified
+
+
+def database_path(url):
+    """Absolute path of a SQLite file URI, or None for other databases."""
+    if not is_sqlite_file(url):
+        return None
+    return os.path.abspath(url.database)
+
+
+class DatabaseRegistry:
+    """Writer engines for the database files of one folder, cached per file.
+
+    Databases are addressed by file name (e.g. clients.db). The default
+    engine is the one Flask-SQLAlchemy built from SQLALCHEMY_DATABASE_URI;
+    it is never evicted. Other files get an engine on first use: configure
+    is called when it is created and prepare once per process before it is
+    handed out. Engines idle for idle_timeout seconds, or beyond
+    max_engines, are disposed and on_dispose is called with them.
+    """
+
+    def __init__(self, folder, default_engine, engine_options=None, max_engines=DEFAULT_MAX_ENGINES,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, configure=None, prepare=None, on_dispose=None):
+        self.folder = os.path.abspath(folder)
+        self.default_engine = default_engine
+        self.default_path = database_path(default_engine.url)
+        self.prepare = prepare
+        self._engines = EngineRegistry(
+            max_engines=max_engines, idle_timeout=idle_timeout,
+            engine_options=engine_options, on_create=configure, on_dispose=on_dispose
+        )
+
+    def path(self, name):
+        """Absolute path of a database file name; ValueError if the name is not one."""
+        name = os.path.basename(str(name or '').strip())
+        if not name.endswith(DATABASE_SUFFIX) or name == DATABASE_SUFFIX or name.startswith('.'):
+            raise ValueError(f'Invalid database name: {name}')
+        return os.path.join(self.folder, name)
+
+    def resolve(self, name):
+        """Path of an existing database; LookupError if there is no such file."""
+        path = self.path(name)
+        if path != self.default_path and not os.path.isfile(path):
+            raise LookupError(f'Database not found: {os.path.basename(path)}')
+        return path
+
+    def engine(self, path=None):
+        """Writer engine of a database path; None or the default path gives the default engine."""
+        if path is None or path == self.default_path:
+            return self.default_engine
+        if not os.path.isfile(path):
+            raise LookupError(f'Database not found: {os.path.basename(path)}')
+        return self._prepared(path)
+
+    def create(self, name):
+        """Create an empty, prepared database file; returns its path."""
+        path = self.path(name)
+        if os.path.exists(path) or path == self.default_path:
+            raise ValueError(f'Database {os.path.basename(path)} already exists')
+        os.makedirs(self.folder, exist_ok=True)
+        self._prepared(path)
+        return path
+
+    def _prepared(self, path):
+        entry = self._engines.entry(f'sqlite:///{path}')
+        # Preparing twice in parallel is harmless: every step is idempotent
+        if not entry.state.get('prepared'):
+            if self.prepare:
+                self.prepare(entry.engine)
+            entry.state['prepared'] = True
+        return entry.engine
+
+    def discard(self, path):
+        """Dispose the engine of a database, e.g. before deleting its file."""
+        self._engines.discard(f'sqlite:///{path}')
+
+    def open_engines(self):
+        """(path, engine) of the default database and every cached one."""
+        engines = [(self.default_path, self.default_engine)]
+        engines.extend((database_path(engine.url), engine) for _, engine in self._engines.items())
+        return engines
+
+    def list(self, current=None):
+        """The database files of the folder, sorted by name."""
+        if not os.path.isdir(self.folder):
+            return []
+        current = current or self.default_path
+        databases = []
+        for name in sorted(os.listdir(self.folder)):
+            path = os.path.join(self.folder, name)
+            if not name.endswith(DATABASE_SUFFIX) or not os.path.isfile(path):
+                continue
+            size, modified = database_file_stat(path)
+            databases.append({
+                'name': name,
+                'path': path,
+                'size': size,
+                'modified': modified,
+                'is_active': path == current,
+                'is_default': path == self.default_path,
+                'open': path == self.default_path or f'sqlite:///{path}' in self._engines,
+            })
+        return databases
+
+    def stats(self):
+        return self._engines.stats()
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+
+DEFAULT_MAX_ENGINES = 8
+DEFAULT_IDLE_TIMEOUT = 600  # seconds
+
+# Pool settings for external export targets
+EXPORT_ENGINE_OPTIONS = {
+    'pool_size': 5,
+    'max_overflow': 5,
+    'pool_pre_ping': True,
+    'pool_recycle': 3600,
+}
+
+
+class EngineEntry:
+    """A cached engine plus the state derived from it."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.uses = 0
+        # Cached per-engine facts, e.g. whether the export schema exists
+        self.state = {}
+
+    def touch(self):
+        self.last_used = time.monotonic()
+        self.uses += 1
+
+
+class EngineRegistry:
+    """LRU of SQLAlchemy engines keyed by connection URI.
+
+    Engines are created once per target and reused, so their pools stay
+    warm across requests. At most max_engines are kept; engines idle for
+    longer than idle_timeout are disposed on the next lookup. on_dispose,
+    if set, is called with each engine the registry disposes.
+    """
+
+    def __init__(self, max_engines=DEFAULT_MAX_ENGINES, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 engine_options=None, on_create=None, on_dispose=None):
+        self.max_engines = max_engines
+        self.idle_timeout = idle_timeout
+        self.engine_options = engine_options or {}
+        self.on_create = on_create
+        self.on_dispose = on_dispose
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def entry(self, uri):
+        """Return the cached entry for a URI, creating the engine if needed."""
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(uri)
+            if entry is None:
+                engine = sa.create_engine(uri, **self.engine_options)
+                if self.on_create:
+                    self.on_create(engine)
+                entry = EngineEntry(engine)
+                self._entries[uri] = entry
+                while len(self._entries) > self.max_engines:
+                    _, oldest = self._entries.popitem(last=False)
+                    self._dispose(oldest.engine)
+            else:
+                self._entries.move_to_end(uri)
+            entry.touch()
+            return entry
+
+    def get(self, uri):
+        return self.entry(uri).engine
+
+    def discard(self, uri):
+        """Dispose the engine for a URI, e.g. after its target was deleted."""
+        with self._lock:
+            entry = self._entries.pop(uri, None)
+        if entry is not None:
+            self._dispose(entry.engine)
+
+    def dispose_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._dispose(entry.engine)
+
+    def _dispose(self, engine):
+        engine.dispose()
+        if self.on_dispose:
+            self.on_dispose(engine)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for uri in [uri for uri, entry in self._entries.items()
+                    if now - entry.last_used > self.idle_timeout]:
+            self._dispose(self._entries.pop(uri).engine)
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_idle()
+
+    def items(self):
+        """(uri, engine) pairs of the cached engines, without touching them."""
+        with self._lock:
+            return [(uri, entry.engine) for uri, entry in self._entries.items()]
+
+    def __contains__(self, uri):
+        with self._lock:
+            return uri in self._entries
+
+    def stats(self):
+        """Pool statistics per cached engine, with passwords hidden."""
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._entries.values())
+        result = []
+        for entry in items:
+            pool = entry.engine.pool
+            info = {
+                'url': entry.engine.url.render_as_string(hide_password=True),
+                'uses': entry.uses,
+                'idle_seconds': round(now - entry.last_used, 1),
+                'age_seconds': round(now - entry.created, 1),
+                'pool': pool.status(),
+            }
+            for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+                method = getattr(pool, name, None)
+                if callable(method):
+                    info[name] = method()
+            result.append(info)
+        return result
@@ -0,0 +1,256 @@
+"""Typed storage for the non-standard columns of uploaded files.
+
+Columns that do not map to a contact field (Average Rating, Claimed,
+Opening hours...) are kept in a key/value table: extra_fields registers
+each column name once, and contact_fields holds one row per contact and
+column with the text value and, when it parses as a number or yes/no, a
+numeric value. Indexes on (field, number) and (field, short text) let
+filters and sorts on one column seek instead of decoding every row.
+"""
+import pandas as pd
+import sqlalchemy as sa
+
+FIELD_TABLE = 'extra_fields'
+VALUE_TABLE = 'contact_fields'
+CONTENT_TABLE = 'contact'
+
+# Text values up to this length are indexed for equality filters
+MAX_INDEXED_TEXT = 32
+
+BOOLEAN_VALUES = {
+    'yes': 1.0, 'true': 1.0, 'да': 1.0,
+    'no': 0.0, 'false': 0.0, 'нет': 0.0,
+}
+
+DEFAULT_FIELD_LIMIT = 100
+MAX_FIELD_LIMIT = 1000
+
+FIELD_CONTACT_COLUMNS = ('id', 'file_id', 'category', 'name', 'email', 'phone', 'website',
+                         'city', 'address', 'review_count')
+
+
+def typed_values(series):
+    """Non-empty values of a column as (positions, texts, numbers) lists.
+
+    Positions are row offsets within the chunk; texts are stripped
+    strings; numbers are floats for numeric and yes/no values, else None.
+    """
+    texts = series.reset_index(drop=True).dropna().astype(str).str.strip()
+    texts = texts[texts != '']
+    numbers = pd.to_numeric(texts, errors='coerce')
+    numbers = numbers.fillna(texts.str.lower().map(BOOLEAN_VALUES))
+    numbers = numbers.astype(object).where(numbers.notna(), None)
+    return texts.index.tolist(), texts.tolist(), numbers.tolist()
+
+
+def create_statements(content_table):
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {VALUE_TABLE}_ad AFTER DELETE ON {content_table} BEGIN "
+        f"DELETE FROM {VALUE_TABLE} WHERE contact_id = old.id; END",
+    ]
+
+
+def ensure_field_triggers(engine, content_table=CONTENT_TABLE):
+    """Create the trigger deleting a contact's extra values with it."""
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as conn:
+        for statement in create_statements(content_table):
+            conn.exec_driver_sql(statement)
+
+
+class ExtraFieldWriter:
+    """Writes the extra column values of inserted batches.
+
+    Field ids are looked up, or registered, once per column name.
+    """
+
+    def __init__(self, session, field_table, value_table):
+        self.session = session
+        self.field_table = field_table
+        self.value_table = value_table
+        self.field_ids = {}
+
+    @property
+    def names(self):
+        """Extra column names written so far, in first-seen order."""
+        return list(self.field_ids)
+
+    def field_id(self, name, label):
+        if name not in self.field_ids:
+            table = self.field_table
+            field_id = self.session.execute(sa.select(table.c.id).where(table.c.name == name)).scalar()
+            if field_id is None:
+                field_id = self.session.execute(sa.insert(table).values(name=name, label=label)).inserted_primary_key[0]
+            self.field_ids[name] = field_id
+        return self.field_ids[name]
+
+    def register(self, extra):
+        """Look up or register the fields of a batch's extra columns without writing values."""
+        for name, (label, *_) in extra.items():
+            self.field_id(name, label)
+
+    def write(self, first_id, extra):
+        """Insert the values of a batch whose contacts got ids first_id, first_id + 1, ..."""
+        return self._insert('INSERT', self._params(lambda position: first_id + position, extra))
+
+    def replace(self, contact_ids, extra):
+        """Overwrite the values of existing contacts; contact_ids[position] is the row's contact."""
+        return self._insert('INSERT OR REPLACE', self._params(contact_ids.__getitem__, extra))
+
+    def _params(self, contact_id, extra):
+        params = []
+        for name, (label, positions, texts, numbers) in extra.items():
+            field_id = self.field_id(name, label)
+            params.extend(
+                (contact_id(position), field_id, text, number)
+                for position, text, number in zip(positions, texts, numbers)
+            )
+        return params
+
+    def _insert(self, verb, params):
+        if params:
+            # A batch holds one value per contact and column, so skip building
+            # SQLAlchemy parameter dicts and hand tuples to the driver
+            self.session.connection().exec_driver_sql(
+                f"{verb} INTO {self.value_table.name} (contact_id, field_id, value_text, value_num) "
+                f"VALUES (?, ?, ?, ?)", params
+            )
+        return len(params)
+
+
+def copy_missing_values(session, pairs):
+    """Give each survivor the extra values it lacks from a duplicate.
+
+    `pairs` are {'survivor_id', 'duplicate_id'} dicts; runs before the
+    duplicates are deleted.
+    """
+    if not pairs:
+        return
+    session.execute(sa.text(
+        f"INSERT OR IGNORE INTO {VALUE_TABLE}(contact_id, field_id, value_text, value_num) "
+        f"SELECT :survivor_id, field_id, value_text, value_num FROM {VALUE_TABLE} WHERE contact_id = :duplicate_id"
+    ), pairs)
+
+
+def list_fields(session):
+    rows = session.execute(sa.text(f"SELECT id, name, label FROM {FIELD_TABLE} ORDER BY id")).mappings()
+    return [dict(row) for row in rows]
+
+
+def parse_field_limit(value):
+    if value is None or value == '':
+        return DEFAULT_FIELD_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_FIELD_LIMIT)
+
+
+def parse_number(value, name):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+
+
+def parse_field_cursor(value):
+    """Decode a "<value>,<contact id>" cursor."""
+    if not value:
+        return None
+    try:
+        number, contact_id = value.rsplit(',', 1)
+        return float(number), int(contact_id)
+    except ValueError:
+        raise ValueError(f'Invalid cursor: {value}')
+
+
+def numeric_page_select(field_id, minimum=None, maximum=None, descending=True, limit=DEFAULT_FIELD_LIMIT,
+                        after=None):
+    """Next page of (contact_id, value_num, value_text) ordered by value, then id.
+
+    As in contact_queries.keyset_select, a cursor splits into a "same
+    value" and a "beyond value" branch, each one index range.
+    """
+    where = "field_id = :field_id AND value_num IS NOT NULL"
+    params = {'field_id': field_id, 'limit': limit}
+    if minimum is not None:
+        where += " AND value_num >= :minimum"
+        params['minimum'] = minimum
+    if maximum is not None:
+        where += " AND value_num <= :maximum"
+        params['maximum'] = maximum
+    direction = 'DESC' if descending else 'ASC'
+    beyond = '<' if descending else '>'
+    order = f"ORDER BY value_num {direction}, contact_id {direction} LIMIT :limit"
+    select = f"SELECT contact_id, value_num, value_text FROM {VALUE_TABLE} WHERE {where}"
+    if after is None:
+        return sa.text(f"{select} {order}"), params
+
+    params['after_value'], params['after_id'] = after
+    return sa.text(
+        f"SELECT * FROM ("
+        f"SELECT * FROM ({select} AND value_num = :after_value AND contact_id {beyond} :after_id {order}) "
+        f"UNION ALL "
+        f"SELECT * FROM ({select} AND value_num {beyond} :after_value {order})"
+        f") {order}"
+    ), params
+
+
+def text_page_select(field_id, text, limit=DEFAULT_FIELD_LIMIT, after=None):
+    """Next page of contacts whose value equals text, by id."""
+    where = "field_id = :field_id AND value_text = :text"
+    if len(text) <= MAX_INDEXED_TEXT:
+        # Same condition as the partial index, so SQLite can use it
+        where += f" AND length(value_text) <= {MAX_INDEXED_TEXT}"
+    params = {'field_id': field_id, 'text': text, 'limit': limit}
+    if after is not None:
+        where += " AND contact_id > :after_id"
+        params['after_id'] = after[1]
+    return sa.text(
+        f"SELECT contact_id, value_num, value_text FROM {VALUE_TABLE} WHERE {where} "
+        f"ORDER BY contact_id LIMIT :limit"
+    ), params
+
+
+def field_contacts(session, name, minimum=None, maximum=None, equals=None, descending=True,
+                   limit=DEFAULT_FIELD_LIMIT, after=None, fields=FIELD_CONTACT_COLUMNS):
+    """One page of contacts filtered and ordered by an extra column.
+
+    With equals, contacts with that exact text are returned by id;
+    otherwise contacts with a numeric value in [minimum, maximum], ordered
+    by value. Returns contacts (each with `value`) and next_cursor.
+    """
+    field_id = session.execute(sa.text(f"SELECT id FROM {FIELD_TABLE} WHERE name = :name"), {'name': name}).scalar()
+    if field_id is None:
+        raise LookupError(f'Unknown field: {name}')
+
+    if equals is not None:
+        stmt, params = text_page_select(field_id, equals, limit + 1, after)
+    else:
+        stmt, params = numeric_page_select(field_id, minimum, maximum, descending, limit + 1, after)
+    values = session.execute(stmt, params).all()
+    has_more = len(values) > limit
+    values = values[:limit]
+
+    contacts_by_id = {}
+    if values:
+        columns = ', '.join(fields)
+        ids = ', '.join(str(int(contact_id)) for contact_id, _, _ in values)
+        rows = session.execute(sa.text(f"SELECT {columns} FROM {CONTENT_TABLE} WHERE id IN ({ids})")).mappings()
+        contacts_by_id = {row['id']: dict(row) for row in rows}
+
+    contacts = []
+    for contact_id, number, text in values:
+        contact = contacts_by_id.get(contact_id)
+        if contact is not None:
+            contact['value'] = number if equals is None else text
+            contacts.append(contact)
+
+    next_cursor = None
+    if has_more:
+        contact_id, number, _ = values[-1]
+        next_cursor = f'{number if equals is None else 0},{contact_id}'
+    return {'field': name, 'contacts': contacts, 'next_cursor': next_cursor, 'limit': limit}
@@ -0,0 +1,200 @@
+"""Contact lookups across every database of the instance folder.
+
+Each campaign lives in its own instance/*.db file (see databases.py). A
+federated lookup probes the normalized email and phone and the Place Id
+and Cid indexes of every file in parallel on a thread pool, and tags each
+contact found with the database it came from. The files are queried
+concurrently, so a lookup takes about as long as the slowest single
+indexed probe rather than the sum of them.
+
+The lookups use read-only engines kept in their own EngineRegistry LRU.
+Before a file is first read in this process it is prepared once through
+the DatabaseRegistry's writer engine, so databases created before the
+normalized columns are migrated instead of failing the lookup.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+
+from clustering import MIN_PHONE_DIGITS
+from contact_matches import MATCH_KEYS
+from engine_registry import EngineRegistry
+from normalization import normalize_email, normalize_identifier, normalize_phone
+from storage import configure_reader, read_only_url, DEFAULT_WRITE_TIMEOUT
+
+DEFAULT_FEDERATED_WORKERS = 8
+DEFAULT_MAX_READERS = 32
+DEFAULT_IDLE_TIMEOUT = 300  # seconds
+
+# Connections per database; a lookup uses one
+READER_POOL_SIZE = 2
+
+# Keys per IN (...) probe, below SQLite's default limit of bound parameters
+KEY_CHUNK_SIZE = 500
+
+# Keys accepted per match type in one lookup
+MAX_LOOKUP_KEYS = 10000
+
+NORMALIZERS = {
+    'email': normalize_email,
+    'phone': normalize_phone,
+    'place_id': normalize_identifier,
+    'cid': normalize_identifier,
+}
+
+
+def lookup_keys(values_by_type):
+    """Normalized, de-duplicated keys by match type from raw values.
+
+    values_by_type maps email, phone, place_id and cid to lists of raw
+    values; phones too short to identify a contact are dropped. Raises
+    ValueError if nothing usable remains or a type has too many keys.
+    """
+    keys = {}
+    for match_type, normalize in NORMALIZERS.items():
+        values = []
+        seen = set()
+        for value in values_by_type.get(match_type) or []:
+            key = normalize(value)
+            if key is None or key in seen:
+                continue
+            if match_type == 'phone' and len(key) < MIN_PHONE_DIGITS:
+                continue
+            seen.add(key)
+            values.append(key)
+        if len(values) > MAX_LOOKUP_KEYS:
+            raise ValueError(f'At most {MAX_LOOKUP_KEYS} {match_type} values per lookup')
+        if values:
+            keys[match_type] = values
+    if not keys:
+        raise ValueError('Give at least one email, phone, place_id or cid')
+    return keys
+
+
+def match_query(contacts, files, fields, keys):
+    """query(conn) returning (contact fields..., filename, match_type) rows.
+
+    A contact matching several keys is returned once per match type;
+    merge_matches() folds them together.
+    """
+    columns = [contacts.c[field] for field in fields]
+    source = contacts.outerjoin(files, files.c.id == contacts.c.file_id)
+
+    def query(conn):
+        rows = []
+        for match_type, values in keys.items():
+            column = contacts.c[MATCH_KEYS[match_type]]
+            for start in range(0, len(values), KEY_CHUNK_SIZE):
+                statement = (
+                    sa.select(*columns, files.c.filename)
+                    .select_from(source)
+                    .where(column.in_(values[start:start + KEY_CHUNK_SIZE]))
+                    .order_by(contacts.c.id)
+                )
+                rows.extend((*row, match_type) for row in conn.execute(statement))
+        return rows
+
+    return query
+
+
+def merge_matches(results):
+    """Rows per database -> one row per contact with its database and match types.
+
+    Output rows are the input columns without the match type, followed by
+    the list of match types and the database name, ordered by database.
+    """
+    merged = []
+    for database in sorted(results):
+        by_id = {}
+        for row in results[database]:
+            contact = by_id.get(row[0])
+            if contact is None:
+                by_id[row[0]] = contact = [*row[:-1], [], database]
+            if row[-1] not in contact[-2]:
+                contact[-2].append(row[-1])
+        merged.extend(by_id.values())
+    return merged
+
+
+class FederatedLookup:
+    """Runs one read-only query on several databases in parallel.
+
+    databases is the app's DatabaseRegistry: the files it lists, plus the
+    default database when it lives outside the instance folder.
+    """
+
+    def __init__(self, databases, max_workers=DEFAULT_FEDERATED_WORKERS, max_readers=DEFAULT_MAX_READERS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, busy_timeout=DEFAULT_WRITE_TIMEOUT):
+        self.databases = databases
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='federated')
+        self._readers = EngineRegistry(
+            max_engines=max_readers, idle_timeout=idle_timeout,
+            engine_options={
+                'pool_size': READER_POOL_SIZE,
+                'max_overflow': 0,
+                'pool_timeout': busy_timeout,
+                'connect_args': {'timeout': busy_timeout, 'check_same_thread': False},
+            },
+            on_create=configure_reader
+        )
+        # Paths migrated by databases.engine() since their reader was opened
+        self._prepared = set()
+
+    def paths(self, names=None):
+        """Database paths by name, optionally only the given names."""
+        paths = {info['name']: info['path'] for info in self.databases.list()}
+        default = self.databases.default_path
+        if default is not None and default not in paths.values():
+            paths.setdefault(os.path.basename(default), default)
+        if names is not None:
+            missing = [name for name in names if name not in paths]
+            if missing:
+                raise LookupError(f"Database not found: {', '.join(missing)}")
+            paths = {name: paths[name] for name in names}
+        return paths
+
+    def reader(self, path):
+        return self._readers.get(reader_uri(path))
+
+    def discard(self, path):
+        """Close the reader of a database, e.g. before deleting its file."""
+        self._prepared.discard(path)
+        self._readers.discard(reader_uri(path))
+
+    def prepare(self, path):
+        """Migrate a database through its writer engine once before reading it."""
+        if path not in self._prepared:
+            self.databases.engine(path)
+            self._prepared.add(path)
+
+    def run(self, query, paths, prepare=True):
+        """query(conn) on every {name: path}; returns (results by name, errors).
+
+        prepare=False reads the files as they are, for queries that do not
+        touch the contact tables.
+        """
+        futures = {
+            name: self.executor.submit(self._run_one, path, query, prepare) for name, path in paths.items()
+        }
+        results = {}
+        errors = []
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except sa.exc.SQLAlchemyError as e:
+                errors.append({'database': name, 'error': str(getattr(e, 'orig', None) or e)})
+            except LookupError as e:
+                # Deleted since it was listed
+                errors.append({'database': name, 'error': str(e)})
+        return results, errors
+
+    def _run_one(self, path, query, prepare):
+        if prepare:
+            self.prepare(path)
+        with self.reader(path).connect() as conn:
+            return query(conn)
+
+
+def reader_uri(path):
+    return read_only_url(f'sqlite:///{path}').render_as_string(hide_password=False)
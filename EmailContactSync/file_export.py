@@ -0,0 +1,151 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import date, datetime
+
+import sqlalchemy as sa
+
+from contact_queries import listing_order
+
+# Contact fields written to export files, in column order
+EXPORT_COLUMNS = [
+    'id', 'file_id', 'category', 'name', 'email', 'phone', 'facebook', 'website',
+    'city', 'address', 'company', 'position', 'review_count', 'notes', 'merged',
+    'place_id', 'cid', 'latitude', 'longitude', 'created_at'
+]
+
+# Rows fetched per round trip, per CSV/NDJSON chunk and per Parquet row group
+DEFAULT_EXPORT_FETCH_SIZE = 5000
+
+# Bytes per chunk when streaming a finished XLSX/Parquet file
+FILE_CHUNK_SIZE = 1024 * 1024
+
+EXPORT_FORMATS = {
+    'csv': {'mimetype': 'text/csv; charset=utf-8', 'extension': 'csv'},
+    'ndjson': {'mimetype': 'application/x-ndjson', 'extension': 'ndjson'},
+    'xlsx': {'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'extension': 'xlsx'},
+    'parquet': {'mimetype': 'application/vnd.apache.parquet', 'extension': 'parquet'},
+}
+
+
+def export_select(table, filters):
+    columns = [table.c[name] for name in EXPORT_COLUMNS]
+    return sa.select(*columns).where(*filters).order_by(*listing_order(table))
+
+
+def iter_partitions(session, table, filters, fetch_size=DEFAULT_EXPORT_FETCH_SIZE):
+    """Yield lists of row tuples from a server-side cursor."""
+    result = session.execute(export_select(table, filters), execution_options={'yield_per': fetch_size})
+    for partition in result.partitions(fetch_size):
+        yield partition
+
+
+def json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def stream_csv(partitions):
+    """CSV text chunks, one per partition, with a BOM so Excel reads UTF-8."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    for partition in partitions:
+        writer.writerows(partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(partitions):
+    """One JSON object per line, one chunk per partition."""
+    for partition in partitions:
+        yield ''.join(
+            json.dumps({name: json_value(value) for name, value in zip(EXPORT_COLUMNS, row)}, ensure_ascii=False) + '\n'
+            for row in partition
+        )
+
+
+def write_xlsx(partitions, path):
+    """Write rows with openpyxl's write-only mode, which streams them to disk."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Contacts')
+    sheet.append(EXPORT_COLUMNS)
+    for partition in partitions:
+        for row in partition:
+            sheet.append(list(row))
+    workbook.save(path)
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    types = {'id': pa.int64(), 'review_count': pa.int64(), 'merged': pa.bool_(),
+             'latitude': pa.float64(), 'longitude': pa.float64(), 'created_at': pa.timestamp('us')}
+    return pa.schema([(name, types.get(name, pa.string())) for name in EXPORT_COLUMNS])
+
+
+def write_parquet(partitions, path):
+    """Write one Parquet row group per partition."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    with pq.ParquetWriter(path, schema, compression='snappy') as writer:
+        for partition in partitions:
+            columns = list(zip(*partition))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+
+
+def stream_file(write, partitions, suffix):
+    """Write a file format that needs seeking to a temp file, then stream it."""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        write(partitions, path)
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(FILE_CHUNK_SIZE)
+                if not block:
+                    break
+                yield block
+    finally:
+        os.remove(path)
+
+
+def check_format(export_format):
+    """Raise ValueError for unknown formats or a missing optional dependency."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    if export_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError('Parquet export requires the pyarrow package')
+
+
+def stream_export(session, table, filters, export_format, fetch_size=DEFAULT_EXPORT_FETCH_SIZE):
+    """Generator of response chunks for an export format.
+
+    Rows are read through a server-side cursor in fetch_size partitions,
+    so memory use does not grow with the number of contacts.
+    """
+    partitions = iter_partitions(session, table, filters, fetch_size)
+    if export_format == 'csv':
+        return stream_csv(partitions)
+    if export_format == 'ndjson':
+        return stream_ndjson(partitions)
+    if export_format == 'xlsx':
+        return stream_file(write_xlsx, partitions, '.xlsx')
+    return stream_file(write_parquet, partitions, '.parquet')
@@ -0,0 +1,247 @@
+"""Fuzzy duplicate detection for contact names with blocking and MinHash/LSH.
+
+Exact keys miss near-duplicates such as "Carwash Nightclub" and "Carwash
+Night Club" at the same address. Comparing every pair of names is
+quadratic, so candidates are narrowed in two steps:
+
+1. Blocking: only contacts sharing a postcode (taken from the address) or,
+   failing that, a city are compared.
+2. LSH: each name becomes a MinHash signature over character shingles.
+   Signatures are cut into bands, and contacts sharing a band bucket
+   within a block become candidate pairs.
+
+Candidates are scored by the estimated name similarity, blended with
+address token similarity when both addresses are known. Work grows with
+the number of contacts and bucket sizes, not with the number of pairs.
+"""
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+import sqlalchemy as sa
+
+from clustering import DisjointSet
+
+DEFAULT_THRESHOLD = 0.7
+
+# Signature length = bands * rows per band; 16 x 4 finds pairs above ~0.5
+NUM_BANDS = 16
+BAND_ROWS = 4
+NUM_PERM = NUM_BANDS * BAND_ROWS
+
+SHINGLE_SIZE = 3
+
+# Buckets larger than this (e.g. a chain with one name per block) are split
+# into consecutive windows instead of being compared all-pairs
+MAX_BUCKET_SIZE = 100
+
+# Weight of the name in the score when both addresses are known
+NAME_WEIGHT = 0.7
+
+FETCH_SIZE = 10000
+
+# Smallest prime above the 32-bit CRC range: with a, b and x below 2^32,
+# a * x + b stays below 2^64, so the uint64 arithmetic never wraps
+HASH_PRIME = 4294967311
+MAX_HASH = (1 << 32) - 1
+
+NON_WORD = re.compile(r'[^\w]+')
+
+# UK postcodes ("M1 4BT", "SW1A 1AA") and 5-digit codes (France, Germany, US)
+UK_POSTCODE = re.compile(r'\b([A-Z]{1,2}\d[A-Z\d]?)\s*(\d[A-Z]{2})\b')
+NUMERIC_POSTCODE = re.compile(r'\b(\d{5})\b')
+
+_rng = np.random.RandomState(1)
+PERM_A = _rng.randint(1, MAX_HASH + 1, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _rng.randint(0, MAX_HASH + 1, size=NUM_PERM, dtype=np.uint64)
+
+
+def normalize_text(value):
+    """Lowercase words without accents or punctuation."""
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return NON_WORD.sub(' ', value.lower()).strip()
+
+
+def name_shingles(name):
+    """Character shingles of a name with spaces removed.
+
+    Dropping spaces makes "night club" and "nightclub" identical.
+    """
+    text = normalize_text(name).replace(' ', '')
+    if not text:
+        return set()
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def address_tokens(address):
+    return set(normalize_text(address).split())
+
+
+def extract_postcode(address):
+    if not address:
+        return None
+    text = str(address).upper()
+    match = UK_POSTCODE.search(text)
+    if match:
+        return f'{match.group(1)} {match.group(2)}'
+    match = NUMERIC_POSTCODE.search(text)
+    if match:
+        return match.group(1)
+    return None
+
+
+def block_key(address, city):
+    """Postcode from the address, else the normalized city, else None."""
+    postcode = extract_postcode(address)
+    if postcode:
+        return 'pc:' + postcode
+    city = normalize_text(city)
+    if city:
+        return 'city:' + city
+    return None
+
+
+def minhash(shingles):
+    """MinHash signature (NUM_PERM uint32 values) of a set of shingles."""
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # Universal hashing (a * x + b) mod p for every permutation at once
+    values = (np.outer(PERM_A, hashes) + PERM_B[:, None]) % HASH_PRIME
+    return (values & MAX_HASH).min(axis=1).astype(np.uint32)
+
+
+def signature_similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.count_nonzero(sig_a == sig_b)) / NUM_PERM
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def bucket_pairs(members):
+    """Pairs of contacts in one LSH bucket, windowed for oversized buckets."""
+    window = len(members) if len(members) <= MAX_BUCKET_SIZE else MAX_BUCKET_SIZE
+    for i in range(len(members)):
+        for j in range(i + 1, min(i + window, len(members))):
+            yield members[i], members[j]
+
+
+class FuzzyIndex:
+    """Name signatures grouped by block; LSH buckets are built per block.
+
+    Only one block's buckets exist at a time, so memory is the signatures
+    (NUM_PERM * 4 bytes per contact) plus the largest block.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.blocks = {}
+        self.signatures = {}
+        self.addresses = {}
+
+    def add(self, contact_id, name, address=None, city=None):
+        block = block_key(address, city)
+        shingles = name_shingles(name)
+        if block is None or not shingles:
+            return
+        self.blocks.setdefault(block, []).append(contact_id)
+        self.signatures[contact_id] = minhash(shingles)
+        tokens = address_tokens(address)
+        if tokens:
+            self.addresses[contact_id] = tokens
+
+    def candidate_pairs(self, members):
+        """Distinct (smaller id, larger id) pairs of a block sharing a bucket."""
+        buckets = {}
+        for contact_id in members:
+            signature = self.signatures[contact_id]
+            for band in range(NUM_BANDS):
+                key = (band, signature[band * BAND_ROWS:(band + 1) * BAND_ROWS].tobytes())
+                buckets.setdefault(key, []).append(contact_id)
+
+        seen = set()
+        for bucket in buckets.values():
+            if len(bucket) < 2:
+                continue
+            for a, b in bucket_pairs(bucket):
+                pair = (a, b) if a < b else (b, a)
+                if pair not in seen:
+                    seen.add(pair)
+                    yield pair
+
+    def score(self, a, b):
+        name_score = signature_similarity(self.signatures[a], self.signatures[b])
+        if a in self.addresses and b in self.addresses:
+            address_score = jaccard(self.addresses[a], self.addresses[b])
+            return NAME_WEIGHT * name_score + (1 - NAME_WEIGHT) * address_score
+        return name_score
+
+    def matches(self):
+        """Candidate pairs scoring at least the threshold, as (a, b, score)."""
+        for members in self.blocks.values():
+            if len(members) < 2:
+                continue
+            for a, b in self.candidate_pairs(members):
+                score = self.score(a, b)
+                if score >= self.threshold:
+                    yield a, b, round(score, 3)
+
+
+def parse_threshold(value):
+    if value is None or value == '':
+        return DEFAULT_THRESHOLD
+    threshold = float(value)
+    if not 0 < threshold <= 1:
+        raise ValueError('threshold must be between 0 and 1')
+    return threshold
+
+
+def fuzzy_rows_select(table, file_id=None):
+    stmt = sa.select(table.c.id, table.c.name, table.c.address, table.c.city)
+    if file_id is not None:
+        stmt = stmt.where(table.c.file_id == file_id)
+    return stmt.order_by(table.c.id)
+
+
+def find_fuzzy_matches(session, table, file_id=None, threshold=DEFAULT_THRESHOLD, progress=None):
+    """Scored near-duplicate pairs (a, b, score) among the selected contacts."""
+    index = FuzzyIndex(threshold)
+    result = session.execute(fuzzy_rows_select(table, file_id), execution_options={'yield_per': FETCH_SIZE})
+    for partition in result.partitions(FETCH_SIZE):
+        if progress is not None:
+            progress.check_cancelled()
+        for row in partition:
+            index.add(row.id, row.name, row.address, row.city)
+        if progress is not None:
+            progress.advance(len(partition))
+    return list(index.matches())
+
+
+def merge_fuzzy_matches(groups, matches):
+    """Combine exact duplicate groups with fuzzy pairs.
+
+    Returns (groups, similarity by contact id): contacts in exact groups
+    score 1.0, others their best fuzzy match score.
+    """
+    forest = DisjointSet()
+    similarity = {}
+    for group in groups:
+        for contact_id in group:
+            forest.add(contact_id)
+            similarity[contact_id] = 1.0
+            forest.union(group[0], contact_id)
+    for a, b, score in matches:
+        forest.add(a)
+        forest.add(b)
+        forest.union(a, b)
+        for contact_id in (a, b):
+            similarity[contact_id] = max(similarity.get(contact_id, 0.0), score)
+    return forest.components(), similarity
@@ -0,0 +1,270 @@
+"""Proximity queries over contact coordinates with an SQLite R*Tree index.
+
+contact_geo is an R*Tree holding one point (a zero-size box) per contact
+with coordinates. Triggers keep it in sync with the contact table, so
+bounding-box lookups read a few tree pages instead of scanning every
+contact. Radius queries take the bounding box of the circle from the
+index and keep the points within the great-circle distance.
+
+Existing databases are backfilled when the index is first created; it can
+be rebuilt by hand with:
+
+    python geo.py --rebuild
+"""
+import argparse
+import logging
+import math
+
+import sqlalchemy as sa
+
+from fuzzy_matching import jaccard, name_shingles
+from response_cache import bump_generation
+
+GEO_TABLE = 'contact_geo'
+CONTENT_TABLE = 'contact'
+
+EARTH_RADIUS_M = 6371008.8
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+DEFAULT_RADIUS_M = 500
+MAX_RADIUS_M = 50000
+
+DEFAULT_NEARBY_LIMIT = 50
+MAX_NEARBY_LIMIT = 500
+
+# Largest distance between two contacts counted as "the same place"
+MAX_PAIR_DISTANCE_M = 1000
+
+# Latitudes are capped here when widening boxes in longitude
+MAX_BOX_LATITUDE = 89.0
+
+FETCH_SIZE = 10000
+
+NEARBY_FIELDS = ('id', 'file_id', 'category', 'name', 'email', 'phone', 'website',
+                 'city', 'address', 'review_count', 'latitude', 'longitude')
+
+
+def create_statements(content_table):
+    has_point = 'new.latitude IS NOT NULL AND new.longitude IS NOT NULL'
+    insert_point = (
+        f"INSERT INTO {GEO_TABLE}(id, min_lat, max_lat, min_lon, max_lon) "
+        f"SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude WHERE {has_point};"
+    )
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {GEO_TABLE} USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+        f"CREATE TRIGGER IF NOT EXISTS {GEO_TABLE}_ai AFTER INSERT ON {content_table} BEGIN {insert_point} END",
+        f"CREATE TRIGGER IF NOT EXISTS {GEO_TABLE}_ad AFTER DELETE ON {content_table} BEGIN "
+        f"DELETE FROM {GEO_TABLE} WHERE id = old.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS {GEO_TABLE}_au AFTER UPDATE OF latitude, longitude ON {content_table} BEGIN "
+        f"DELETE FROM {GEO_TABLE} WHERE id = old.id; {insert_point} END",
+    ]
+
+
+def backfill_statements(content_table):
+    return [
+        f"DELETE FROM {GEO_TABLE}",
+        f"INSERT INTO {GEO_TABLE}(id, min_lat, max_lat, min_lon, max_lon) "
+        f"SELECT id, latitude, latitude, longitude, longitude FROM {content_table} "
+        f"WHERE latitude IS NOT NULL AND longitude IS NOT NULL",
+    ]
+
+
+def ensure_geo_index(engine, content_table=CONTENT_TABLE):
+    """Create the R*Tree index and its triggers, backfilling a new index.
+
+    Returns True when the index was created by this call.
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    exists = GEO_TABLE in sa.inspect(engine).get_table_names()
+    with engine.begin() as conn:
+        for statement in create_statements(content_table):
+            conn.exec_driver_sql(statement)
+        if not exists:
+            for statement in backfill_statements(content_table):
+                conn.exec_driver_sql(statement)
+    if not exists:
+        logging.info(f"Created geospatial index {GEO_TABLE}")
+    return not exists
+
+
+def rebuild_geo_index(engine, content_table=CONTENT_TABLE):
+    """Refill the index from the contact table."""
+    with engine.begin() as conn:
+        for statement in backfill_statements(content_table):
+            conn.exec_driver_sql(statement)
+        bump_generation(conn)
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def longitude_delta(radius_m, latitude):
+    """Degrees of longitude covering radius_m at a latitude."""
+    latitude = min(abs(latitude), MAX_BOX_LATITUDE)
+    return radius_m / (METRES_PER_DEGREE * math.cos(math.radians(latitude)))
+
+
+def bounding_box(lat, lon, radius_m):
+    """(south, west, north, east) enclosing a circle."""
+    lat_delta = radius_m / METRES_PER_DEGREE
+    lon_delta = longitude_delta(radius_m, max(abs(lat - lat_delta), abs(lat + lat_delta)))
+    return (max(lat - lat_delta, -90.0), max(lon - lon_delta, -180.0),
+            min(lat + lat_delta, 90.0), min(lon + lon_delta, 180.0))
+
+
+def parse_point(lat, lon):
+    try:
+        lat = float(lat)
+        lon = float(lon)
+    except (TypeError, ValueError):
+        raise ValueError('lat and lon must be numbers')
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise ValueError('lat must be within [-90, 90] and lon within [-180, 180]')
+    return lat, lon
+
+
+def parse_bbox(value):
+    """Parse "south,west,north,east" in degrees."""
+    try:
+        south, west, north, east = (float(part) for part in value.split(','))
+    except ValueError:
+        raise ValueError('bbox must be south,west,north,east')
+    if south > north or west > east:
+        raise ValueError('bbox south/west must not exceed north/east')
+    parse_point(south, west)
+    parse_point(north, east)
+    return south, west, north, east
+
+
+def parse_radius(value, maximum=MAX_RADIUS_M, default=DEFAULT_RADIUS_M, name='radius'):
+    if value is None or value == '':
+        return default
+    radius = float(value)
+    if not 0 < radius <= maximum:
+        raise ValueError(f'{name} must be between 0 and {maximum} metres')
+    return radius
+
+
+def parse_nearby_limit(value):
+    if value is None or value == '':
+        return DEFAULT_NEARBY_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_NEARBY_LIMIT)
+
+
+def box_statement(fields, file_id=None, suffix=''):
+    columns = ', '.join(f'c.{field}' for field in fields)
+    where = "g.max_lat >= :south AND g.min_lat <= :north AND g.max_lon >= :west AND g.min_lon <= :east"
+    if file_id is not None:
+        where += " AND c.file_id = :file_id"
+    return sa.text(
+        f"SELECT {columns} FROM {GEO_TABLE} g JOIN {CONTENT_TABLE} c ON c.id = g.id WHERE {where}{suffix}"
+    )
+
+
+def contacts_in_box(session, south, west, north, east, file_id=None, limit=DEFAULT_NEARBY_LIMIT,
+                    fields=NEARBY_FIELDS):
+    """Contacts inside a bounding box, in id order."""
+    params = {'south': south, 'west': west, 'north': north, 'east': east, 'limit': limit}
+    if file_id is not None:
+        params['file_id'] = file_id
+    stmt = box_statement(fields, file_id, ' ORDER BY c.id LIMIT :limit')
+    return [dict(row) for row in session.execute(stmt, params).mappings()]
+
+
+def contacts_near(session, lat, lon, radius_m=DEFAULT_RADIUS_M, file_id=None, limit=DEFAULT_NEARBY_LIMIT,
+                  fields=NEARBY_FIELDS):
+    """Contacts within radius_m of a point, nearest first, with distance_m."""
+    south, west, north, east = bounding_box(lat, lon, radius_m)
+    params = {'south': south, 'west': west, 'north': north, 'east': east}
+    if file_id is not None:
+        params['file_id'] = file_id
+    contacts = []
+    for row in session.execute(box_statement(fields, file_id), params).mappings():
+        distance = haversine_m(lat, lon, row['latitude'], row['longitude'])
+        if distance <= radius_m:
+            contact = dict(row)
+            contact['distance_m'] = round(distance, 1)
+            contacts.append(contact)
+    contacts.sort(key=lambda contact: (contact['distance_m'], contact['id']))
+    return contacts[:limit]
+
+
+def find_nearby_matches(session, table, file_id=None, distance_m=50, threshold=0.7, progress=None):
+    """Pairs (a, b, score) of contacts within distance_m whose names are similar.
+
+    A shared location alone is not a duplicate (one building can hold many
+    venues), so pairs must also reach the name similarity threshold. Pairs
+    come from a self-join on the R*Tree, so only neighbouring points are
+    compared.
+    """
+    extent = session.execute(sa.text(f"SELECT min(min_lat), max(max_lat) FROM {GEO_TABLE}")).one()
+    if extent[0] is None:
+        return []
+    lat_delta = distance_m / METRES_PER_DEGREE
+    lon_delta = longitude_delta(distance_m, max(abs(extent[0]), abs(extent[1])))
+
+    params = {'lat_delta': lat_delta, 'lon_delta': lon_delta}
+    where = ""
+    if file_id is not None:
+        where = "WHERE ca.file_id = :file_id AND cb.file_id = :file_id"
+        params['file_id'] = file_id
+    stmt = sa.text(
+        f"SELECT ca.id AS a_id, ca.name AS a_name, ca.latitude AS a_lat, ca.longitude AS a_lon, "
+        f"cb.id AS b_id, cb.name AS b_name, cb.latitude AS b_lat, cb.longitude AS b_lon "
+        f"FROM {GEO_TABLE} a "
+        f"JOIN {GEO_TABLE} b ON b.min_lat >= a.min_lat - :lat_delta AND b.max_lat <= a.max_lat + :lat_delta "
+        f"AND b.min_lon >= a.min_lon - :lon_delta AND b.max_lon <= a.max_lon + :lon_delta AND b.id > a.id "
+        f"JOIN {table.name} ca ON ca.id = a.id JOIN {table.name} cb ON cb.id = b.id {where}"
+    )
+
+    matches = []
+    shingles = {}
+    result = session.execute(stmt, params, execution_options={'yield_per': FETCH_SIZE})
+    for partition in result.mappings().partitions(FETCH_SIZE):
+        if progress is not None:
+            progress.check_cancelled()
+        for row in partition:
+            if haversine_m(row['a_lat'], row['a_lon'], row['b_lat'], row['b_lon']) > distance_m:
+                continue
+            for contact_id, name in ((row['a_id'], row['a_name']), (row['b_id'], row['b_name'])):
+                if contact_id not in shingles:
+                    shingles[contact_id] = name_shingles(name)
+            score = jaccard(shingles[row['a_id']], shingles[row['b_id']])
+            if score >= threshold:
+                matches.append((row['a_id'], row['b_id'], round(score, 3)))
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the contact geospatial index')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from the contact table')
+    parser.add_argument('--near', nargs=2, type=float, metavar=('LAT', 'LON'), help='Print contacts near a point')
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_M, help='Search radius in metres')
+    args = parser.parse_args()
+
+    from app import app, db
+
+    with app.app_context():
+        ensure_geo_index(db.engine)
+        if args.rebuild:
+            rebuild_geo_index(db.engine)
+            print('Geospatial index rebuilt')
+        if args.near:
+            with db.engine.connect() as conn:
+                for contact in contacts_near(conn, args.near[0], args.near[1], args.radius, limit=20):
+                    print(f"{contact['distance_m']:>9} {contact['id']:>7} {contact['name']}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
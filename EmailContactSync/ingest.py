@@ -0,0 +1,479 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import sqlalchemy as sa
+
+from extra_fields import typed_values
+from metrics import StageTimer
+from normalization import normalize_coordinate, normalize_count, normalize_email, normalize_identifier, normalize_phone
+
+# Map common column variations to standard names
+COLUMN_MAPPING = {
+    'category': ['category', 'categories', 'категория', 'cat', 'type', 'тип'],
+    'name': ['name', 'fullname', 'full_name', 'contact_name', 'person', 'заведение', 'название', 'имя'],
+    'email': ['email', 'email_address', 'emailaddress', 'mail', 'почта', 'эл_почта', 'электронная_почта'],
+    'phone': ['phone', 'phone_number', 'phonenumber', 'telephone', 'mobile', 'cell', 'телефон', 'номер', 'тел'],
+    'facebook': ['facebook', 'fb', 'facebook_url', 'fb_url', 'фейсбук'],
+    'website': ['website', 'site', 'web', 'url', 'сайт', 'веб-сайт', 'web_site'],
+    'city': ['city', 'municipality', 'town', 'город', 'населенный_пункт', 'нас_пункт'],
+    'address': ['address', 'location', 'full_address', 'fulladdress', 'адрес', 'местоположение'],
+    'company': ['company', 'organization', 'business_name', 'company_name', 'компания', 'организация', 'фирма'],
+    'position': ['position', 'title', 'job_title', 'должность', 'позиция', 'роль']
+}
+
+# Google Maps identifiers from scraper exports, used as duplicate keys
+IDENTIFIER_MAPPING = {
+    'place_id': ['place_id', 'placeid', 'google_place_id'],
+    'cid': ['cid', 'google_cid']
+}
+
+# Coordinates from scraper exports, stored as floats for proximity queries
+COORDINATE_MAPPING = {
+    'latitude': ['latitude', 'lat', 'широта'],
+    'longitude': ['longitude', 'lng', 'lon', 'long', 'долгота']
+}
+
+# Review counts from scraper exports, used to order listings
+COUNT_MAPPING = {
+    'review_count': ['review_count', 'reviews', 'reviews_count', 'количество_отзывов', 'отзывы']
+}
+
+# Reverse lookup: cleaned column name -> standard name
+VARIATION_TO_STANDARD = {
+    variation: std_col
+    for mapping in (COLUMN_MAPPING, IDENTIFIER_MAPPING, COORDINATE_MAPPING, COUNT_MAPPING)
+    for std_col, variations in mapping.items()
+    for variation in variations
+}
+
+STANDARD_COLUMNS = list(COLUMN_MAPPING.keys())
+
+# Columns written to the contact table for every uploaded row
+CONTACT_COLUMNS = (STANDARD_COLUMNS + ['notes'] + list(IDENTIFIER_MAPPING.keys())
+                   + list(COORDINATE_MAPPING.keys()) + list(COUNT_MAPPING.keys()))
+
+# Fields of a mapped row that make up its content fingerprint (row_hash);
+# email and phone count through their normalized forms
+ROW_HASH_FIELDS = ['category', 'name', 'email_norm', 'phone_norm', 'facebook', 'website', 'city', 'address',
+                   'company', 'position', 'notes', 'place_id', 'cid', 'latitude', 'longitude', 'review_count']
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Bytes read from the upload stream per iteration while spooling
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def clean_column_name(column):
+    """Clean column name (lowercase, remove spaces)."""
+    return str(column).lower().strip().replace(' ', '_')
+
+
+def build_column_plan(columns):
+    """Resolve the source -> standard column renames once per file."""
+    plan = {}
+    for col in columns:
+        std_col = VARIATION_TO_STANDARD.get(col)
+        # The first matching source column wins if several map to one field
+        if std_col and std_col not in plan.values():
+            plan[col] = std_col
+    return plan
+
+
+def standardize_dataframe(df, plan=None):
+    """Rename columns to standard names and add the missing ones."""
+    df.columns = [clean_column_name(col) for col in df.columns]
+    if plan is None:
+        plan = build_column_plan(df.columns)
+    df = df.rename(columns=plan)
+    df = df.loc[:, ~df.columns.duplicated()]
+
+    for col in CONTACT_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    return df
+
+
+def canonical_value(field, value):
+    """Text of a field value as fingerprinted: trimmed, single-spaced and casefolded."""
+    if value is None:
+        return ''
+    if field in COORDINATE_MAPPING:
+        return f'{float(value):.6f}'
+    return ' '.join(str(value).split()).casefold()
+
+
+def row_hash(row):
+    """Fingerprint of a mapped row, equal for rows with the same normalized content.
+
+    Takes the insert parameters built by dataframe_to_rows or a stored
+    contact row; both give the same hash for the same contact.
+    """
+    text = '\x1f'.join(canonical_value(field, row[field]) for field in ROW_HASH_FIELDS)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def dataframe_to_rows(df, file_id):
+    """Convert a standardized DataFrame into insert parameter dicts."""
+    frame = df[CONTACT_COLUMNS].astype(object)
+    frame = frame.where(pd.notna(frame), None)
+    rows = frame.to_dict('records')
+    for row in rows:
+        row['file_id'] = file_id
+        row['email_norm'] = normalize_email(row['email'])
+        row['phone_norm'] = normalize_phone(row['phone'])
+        row['place_id'] = normalize_identifier(row['place_id'])
+        row['cid'] = normalize_identifier(row['cid'])
+        row['review_count'] = normalize_count(row['review_count'])
+        row['latitude'] = normalize_coordinate(row['latitude'], 90)
+        row['longitude'] = normalize_coordinate(row['longitude'], 180)
+        # Keep coordinates only as a pair; (0, 0) is a missing-value placeholder
+        if row['latitude'] is None or row['longitude'] is None or (row['latitude'] == 0 and row['longitude'] == 0):
+            row['latitude'] = row['longitude'] = None
+        row['row_hash'] = row_hash(row)
+    return rows
+
+
+def extra_values(df, labels):
+    """Typed values of the columns kept as extra fields.
+
+    Returns {name: (original label, row positions, texts, numbers)} for
+    the columns of df that are neither contact columns nor empty.
+    """
+    extra = {}
+    for name, label in labels.items():
+        if name not in df.columns:
+            continue
+        positions, texts, numbers = typed_values(df[name])
+        if texts:
+            extra[name] = (label, positions, texts, numbers)
+    return extra
+
+
+def extra_labels(columns, plan):
+    """Cleaned name -> original label of the columns without a contact field."""
+    labels = {}
+    for col in columns:
+        name = clean_column_name(col)
+        if name in plan or name in CONTACT_COLUMNS or name in labels or name == 'file_id':
+            continue
+        labels[name] = str(col).strip()
+    return labels
+
+
+def insert_rows(session, table, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Insert parameter dicts with one executemany per batch."""
+    stmt = sa.insert(table)
+    for start in range(0, len(rows), batch_size):
+        session.execute(stmt, rows[start:start + batch_size])
+    return len(rows)
+
+
+class IngestStats:
+    """Row counts, throughput and per-stage time for a single ingested file.
+
+    rows counts the rows inserted, rows_read every row of the file,
+    including those known_rows skipped or used to update a contact.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.rows_read = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.stages = StageTimer()
+
+    def add(self, count, read=None):
+        self.rows += count
+        self.rows_read += count if read is None else read
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rows_per_sec(self):
+        if self.elapsed <= 0:
+            return float(self.rows_read)
+        return self.rows_read / self.elapsed
+
+
+def spool_upload(stream, suffix='', directory=None):
+    """Copy an upload stream to a temp file, hashing it on the way.
+
+    Returns (path, md5 hexdigest, size in bytes). The caller removes the file.
+    """
+    md5 = hashlib.md5()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                block = stream.read(SPOOL_CHUNK_SIZE)
+                if not block:
+                    break
+                md5.update(block)
+                out.write(block)
+                size += len(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, md5.hexdigest(), size
+
+
+def iter_csv_chunks(path, chunksize=DEFAULT_BATCH_SIZE):
+    """Yield DataFrames of at most chunksize rows from a CSV file."""
+    # Read every cell as text so phones keep leading zeros and Cids keep all digits
+    with pd.read_csv(path, chunksize=chunksize, dtype=str) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def iter_excel_chunks(path, chunksize=DEFAULT_BATCH_SIZE):
+    """Yield DataFrames of at most chunksize rows from an XLSX file.
+
+    Uses openpyxl read-only mode so rows are streamed from the archive
+    instead of loading the whole workbook.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [
+            str(col) if col is not None else f'unnamed:_{i}'
+            for i, col in enumerate(header)
+        ]
+        buffer = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            buffer.append(row)
+            if len(buffer) >= chunksize:
+                yield pd.DataFrame(buffer, columns=columns)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns)
+    finally:
+        workbook.close()
+
+
+def iter_file_chunks(path, file_ext, chunksize=DEFAULT_BATCH_SIZE):
+    """Pick the chunked reader for a file extension."""
+    if file_ext in ['csv', 'txt']:
+        return iter_csv_chunks(path, chunksize)
+    if file_ext == 'xlsx':
+        return iter_excel_chunks(path, chunksize)
+    # Legacy .xls has no streaming reader, load it in one piece
+    return iter([pd.read_excel(path)])
+
+
+def estimate_rows(path, file_ext):
+    """Approximate data row count of a spooled file, for progress reporting."""
+    if file_ext in ['csv', 'txt']:
+        lines = 0
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(SPOOL_CHUNK_SIZE)
+                if not block:
+                    break
+                lines += block.count(b'\n')
+        return max(lines - 1, 0)
+    if file_ext == 'xlsx':
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            max_row = workbook.active.max_row
+        finally:
+            workbook.close()
+        return max(max_row - 1, 0) if max_row else None
+    return None
+
+
+def iter_row_batches(chunks, file_id):
+    """Map DataFrame chunks to insert parameter dicts.
+
+    The column plan is resolved from the first chunk and reused for the
+    rest. Yields (standard column list, rows, extra values) per chunk.
+    """
+    plan = None
+    labels = None
+    for chunk in chunks:
+        if plan is None:
+            plan = build_column_plan([clean_column_name(col) for col in chunk.columns])
+            labels = extra_labels(chunk.columns, plan)
+        chunk = standardize_dataframe(chunk, plan)
+        yield list(chunk.columns), dataframe_to_rows(chunk, file_id), extra_values(chunk, labels)
+
+
+def insert_row_batches(session, table, batches, batch_size=DEFAULT_BATCH_SIZE, progress=None, after_batch=None,
+                       extra_writer=None, known_rows=None):
+    """Insert batches of rows; returns (standard column list, IngestStats).
+
+    after_batch, if given, is called after each batch is inserted. Extra
+    column values go to extra_writer (an ExtraFieldWriter) when given.
+    known_rows (a KnownRows) removes the rows already imported from each
+    batch first, updating the contacts they supersede. The caller owns
+    the transaction and commits it together with the ProcessedFile record.
+    """
+    stats = IngestStats()
+    columns = []
+    batches = iter(batches)
+    while True:
+        # Waiting for the next batch is parsing (or reading the parsed spool)
+        with stats.stages.stage('parse'):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        batch_columns, rows, extra = batch
+        if progress is not None:
+            progress.check_cancelled()
+        if not columns:
+            columns = batch_columns
+        read = len(rows)
+        if extra_writer is not None and extra:
+            # Record the file's extra columns even if every row they hold is skipped
+            extra_writer.register(extra)
+        if known_rows is not None:
+            with stats.stages.stage('known_rows'):
+                rows, extra = known_rows.filter(rows, extra)
+        with stats.stages.stage('insert'):
+            if extra_writer is not None and extra:
+                # The single writer holds the lock, so the batch gets consecutive ids
+                first_id = (session.execute(sa.select(sa.func.max(table.c.id))).scalar() or 0) + 1
+            inserted = insert_rows(session, table, rows, batch_size) if rows else 0
+        if extra_writer is not None and extra:
+            with stats.stages.stage('extra_fields'):
+                extra_writer.write(first_id, extra)
+        if after_batch is not None:
+            with stats.stages.stage('after_batch'):
+                after_batch()
+        stats.add(inserted, read)
+        if progress is not None:
+            progress.advance(read)
+    return columns, stats.finish()
+
+
+def log_ingest(file_id, stats):
+    logging.info(
+        f"Ingested {stats.rows_read} rows ({stats.rows} inserted) for file {file_id} "
+        f"in {stats.elapsed:.2f}s ({stats.rows_per_sec:.0f} rows/sec)"
+    )
+
+
+def parse_to_spool(path, file_ext, file_id, chunksize=DEFAULT_BATCH_SIZE):
+    """Parse and normalize a file into a temp file of pickled row batches.
+
+    Runs in a worker process. Batches go to disk instead of back through
+    the result pipe, so memory stays flat however large the file is.
+    Returns the spool path.
+    """
+    fd, spool_path = tempfile.mkstemp(suffix='.rows')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for batch in iter_row_batches(iter_file_chunks(path, file_ext, chunksize), file_id):
+                pickle.dump(batch, out, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        os.remove(spool_path)
+        raise
+    return spool_path
+
+
+def iter_spooled_batches(spool_path):
+    """Read back the (columns, rows) batches written by parse_to_spool."""
+    with open(spool_path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def remove_spool(future):
+    """Done callback removing the spool file of a parse that is no longer needed."""
+    if not future.cancelled() and future.exception() is None:
+        os.remove(future.result())
+
+
+class ParsePool:
+    """Parses uploaded files in worker processes for a single writer.
+
+    Parsing and normalization run in parallel, one file per process; the
+    caller inserts the parsed batches on its own connection, so SQLite only
+    ever sees one writer. With max_workers <= 1 files are parsed in process.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_workers > 1
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # forkserver avoids forking the threaded web server process;
+                # the server preloads this module only, not the app
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload([__name__])
+                else:
+                    context = multiprocessing.get_context('spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._executor
+
+    def parse(self, items, chunksize=DEFAULT_BATCH_SIZE):
+        """Yield (item, batches) per file, in order, while later files parse.
+
+        `items` are dicts with path, file_ext and file_id. `batches` is an
+        iterable of (columns, rows), or raises the file's parse error when
+        iterated. Closing the generator early cancels the remaining parses.
+        """
+        if not self.enabled or len(items) < 2:
+            for item in items:
+                chunks = iter_file_chunks(item['path'], item['file_ext'], chunksize)
+                yield item, iter_row_batches(chunks, item['file_id'])
+            return
+
+        executor = self.executor()
+        futures = [
+            executor.submit(parse_to_spool, item['path'], item['file_ext'], item['file_id'], chunksize)
+            for item in items
+        ]
+        consumed = 0
+        try:
+            for item, future in zip(items, futures):
+                consumed += 1
+                yield item, self._spooled_batches(future)
+        finally:
+            for future in futures[consumed:]:
+                if not future.cancel():
+                    future.add_done_callback(remove_spool)
+
+    @staticmethod
+    def _spooled_batches(future):
+        spool_path = future.result()
+        try:
+            yield from iter_spooled_batches(spool_path)
+        finally:
+            os.remove(spool_path)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
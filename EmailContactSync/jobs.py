@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import sqlalchemy as sa
+
+DEFAULT_MAX_WORKERS = 2
+
+# Minimum seconds between progress writes to the job table
+PROGRESS_FLUSH_INTERVAL = 2.0
+
+# check_cancelled() calls between reads of the persisted cancel flag, which
+# another server process sets when it receives the cancel request
+CANCEL_POLL_EVERY = 10
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+# Jobs returned by GET /jobs
+DEFAULT_JOB_LIMIT = 50
+MAX_JOB_LIMIT = 500
+
+
+def parse_job_limit(value):
+    if value is None or value == '':
+        return DEFAULT_JOB_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_JOB_LIMIT)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation was requested."""
+
+
+class JobProgress:
+    """Progress counters handed to a job function.
+
+    Counters live in memory and are written to the job table at most every
+    PROGRESS_FLUSH_INTERVAL seconds. Job functions call advance() as they
+    process rows and check_cancelled() between batches.
+    """
+
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+        self.processed = 0
+        self.total = None
+        self.started = time.monotonic()
+        self._last_flush = 0.0
+        self._checks = 0
+
+    def set_total(self, total):
+        self.total = total
+        self.manager._flush_progress(self, force=True)
+
+    def advance(self, count=1):
+        self.processed += count
+        self.manager._flush_progress(self)
+
+    def check_cancelled(self):
+        self._checks += 1
+        persisted = self._checks % CANCEL_POLL_EVERY == 0
+        if self.manager.is_cancel_requested(self.job_id, persisted=persisted):
+            raise JobCancelled()
+
+    def eta_seconds(self):
+        if not self.total or not self.processed:
+            return None
+        elapsed = time.monotonic() - self.started
+        remaining = max(self.total - self.processed, 0)
+        return round(elapsed / self.processed * remaining, 1)
+
+    def to_dict(self):
+        return {
+            'processed': self.processed,
+            'total': self.total,
+            'eta_seconds': self.eta_seconds()
+        }
+
+
+class JobManager:
+    """Runs registered job kinds on a thread pool and records them in the job table.
+
+    If current_database and use_database are given, the value returned by
+    current_database() when a job is submitted is passed to
+    use_database() in the job's app context, so the job works on the same
+    database as the request that queued it.
+    """
+
+    def __init__(self, app, db, job_model, max_workers=DEFAULT_MAX_WORKERS,
+                 current_database=None, use_database=None):
+        self.app = app
+        self.db = db
+        self.job_model = job_model
+        self.current_database = current_database
+        self.use_database = use_database
+        self.handlers = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._live = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def register(self, kind, func):
+        """Register func(params, progress) -> JSON-serializable result."""
+        self.handlers[kind] = func
+
+    def submit(self, kind, params, on_discard=None):
+        """Queue a job and return its id.
+
+        on_discard is called if the job is cancelled before it starts, so
+        callers can release resources such as spooled upload files.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f'Unknown job type: {kind}')
+        job_id = str(uuid.uuid4())
+        job = self.job_model(
+            id=job_id, kind=kind, status='queued',
+            worker_pid=os.getpid(), created_at=datetime.utcnow()
+        )
+        self.db.session.add(job)
+        self.db.session.commit()
+        database = self.current_database() if self.current_database else None
+        self.executor.submit(self._run, job_id, kind, params, on_discard, database)
+        return job_id
+
+    def cancel(self, job_id):
+        """Request cancellation; returns False if the job is unknown or finished."""
+        job = self.db.session.get(self.job_model, job_id)
+        if job is None or job.status not in ACTIVE_STATUSES:
+            return False
+        with self._lock:
+            self._cancelled.add(job_id)
+        job.cancel_requested = True
+        self.db.session.commit()
+        return True
+
+    def is_cancel_requested(self, job_id, persisted=False):
+        """Whether cancellation was requested in this process or, with persisted, in the job table."""
+        with self._lock:
+            if job_id in self._cancelled:
+                return True
+        if not persisted:
+            return False
+        table = self.job_model.__table__
+        try:
+            with self.engine.connect() as conn:
+                requested = conn.execute(sa.select(table.c.cancel_requested).where(table.c.id == job_id)).scalar()
+        except sa.exc.OperationalError as e:
+            logging.warning(f"Could not read the cancel flag of job {job_id}: {e}")
+            return False
+        if requested:
+            with self._lock:
+                self._cancelled.add(job_id)
+        return bool(requested)
+
+    def status(self, job_id):
+        job = self.db.session.get(self.job_model, job_id)
+        if job is None:
+            return None
+        info = job_to_dict(job)
+        with self._lock:
+            progress = self._live.get(job_id)
+        if progress is not None:
+            info.update(progress.to_dict())
+        return info
+
+    @property
+    def engine(self):
+        """Engine of the database holding the job table (its bind, if any)."""
+        return self.db.engines[self.job_model.metadata.info.get('bind_key')]
+
+    def list(self, limit=DEFAULT_JOB_LIMIT):
+        """Most recent jobs, newest first."""
+        jobs = self.job_model.query.order_by(self.job_model.created_at.desc()).limit(limit).all()
+        result = []
+        for job in jobs:
+            info = job_to_dict(job)
+            with self._lock:
+                progress = self._live.get(job.id)
+            if progress is not None:
+                info.update(progress.to_dict())
+            result.append(info)
+        return result
+
+    def recover_interrupted(self):
+        """Mark jobs left active by a process that no longer runs as failed.
+
+        Jobs of live processes are left alone: other server processes, or
+        the parent of a parse worker that imported the app, still own them.
+        """
+        table = self.job_model.__table__
+        with self.engine.begin() as conn:
+            active = conn.execute(
+                sa.select(table.c.id, table.c.worker_pid).where(table.c.status.in_(ACTIVE_STATUSES))
+            ).all()
+            orphaned = [row.id for row in active if not process_alive(row.worker_pid)]
+            if orphaned:
+                conn.execute(
+                    sa.update(table)
+                    .where(table.c.id.in_(orphaned))
+                    .values(status='failed', error='Interrupted by server restart', finished_at=datetime.utcnow())
+                )
+
+    def _update(self, job_id, **values):
+        table = self.job_model.__table__
+        with self.engine.begin() as conn:
+            conn.execute(sa.update(table).where(table.c.id == job_id).values(**values))
+
+    def _flush_progress(self, progress, force=False):
+        now = time.monotonic()
+        if not force and now - progress._last_flush < PROGRESS_FLUSH_INTERVAL:
+            return
+        progress._last_flush = now
+        # Best effort: a failed progress write must not fail the job
+        try:
+            self._update(progress.job_id, processed=progress.processed, total=progress.total)
+        except sa.exc.OperationalError as e:
+            logging.warning(f"Skipped progress update for job {progress.job_id}: {e}")
+
+    def _run(self, job_id, kind, params, on_discard, database=None):
+        with self.app.app_context():
+            if self.use_database:
+                self.use_database(database)
+            if self.is_cancel_requested(job_id, persisted=True):
+                self._update(job_id, status='cancelled', finished_at=datetime.utcnow())
+                if on_discard:
+                    on_discard()
+                return
+
+            progress = JobProgress(self, job_id)
+            with self._lock:
+                self._live[job_id] = progress
+            self._update(job_id, status='running', started_at=datetime.utcnow())
+            try:
+                result = self.handlers[kind](params, progress)
+                self.db.session.commit()
+                self._update(
+                    job_id, status='succeeded', result=json.dumps(result, ensure_ascii=False, default=str),
+                    processed=progress.processed, total=progress.total, finished_at=datetime.utcnow()
+                )
+            except JobCancelled:
+                self.db.session.rollback()
+                self._update(job_id, status='cancelled', processed=progress.processed, finished_at=datetime.utcnow())
+            except Exception as e:
+                self.db.session.rollback()
+                logging.error(f"Job {job_id} ({kind}) failed: {str(e)}")
+                self._update(job_id, status='failed', error=str(e), processed=progress.processed, finished_at=datetime.utcnow())
+            finally:
+                with self._lock:
+                    self._live.pop(job_id, None)
+                    self._cancelled.discard(job_id)
+
+
+def process_alive(pid):
+    """Whether another process with this pid runs on this host."""
+    # At startup no job belongs to this process yet; an equal pid is a reused one
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'processed': job.processed or 0,
+        'total': job.total,
+        'eta_seconds': None,
+        'cancel_requested': bool(job.cancel_requested),
+        'error': job.error,
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
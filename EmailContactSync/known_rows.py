@@ -0,0 +1,186 @@
+"""Row fingerprints that keep overlapping uploads from re-importing contacts.
+
+Every contact stores row_hash, a digest of its normalized fields (see
+ingest.row_hash), in an indexed column. Before each batch of an upload
+is inserted, KnownRows probes that index:
+
+- rows whose hash is already stored, or repeated within the batch, are
+  skipped;
+- in 'upsert' mode, a row sharing its Place Id, else its Cid, with a
+  contact of another file updates the earliest such contact instead of
+  being inserted: fields the row has replace the stored ones, fields it
+  lacks keep them, and its extra column values replace the stored ones;
+- the other rows are inserted as before.
+
+'skip', the default, only skips identical rows and 'insert' imports
+every row. 'upsert' is opt-in because an updated contact stays with its
+original file: deleting that file later also deletes the values the
+newer upload supplied. The probes run in the ingest transaction, so they
+also see the batches of the same upload inserted before.
+"""
+import sqlalchemy as sa
+
+from ingest import row_hash, CONTACT_COLUMNS
+
+KNOWN_ROW_MODES = ('upsert', 'skip', 'insert')
+DEFAULT_KNOWN_ROW_MODE = 'skip'
+
+# Keys identifying the same place across scraper exports, in order of trust
+IDENTITY_KEYS = ('place_id', 'cid')
+
+# Columns an upsert takes from the incoming row together; the first one decides
+UPDATE_GROUPS = [('email', 'email_norm'), ('phone', 'phone_norm'), ('latitude', 'longitude')] + [
+    (column,) for column in CONTACT_COLUMNS if column not in ('email', 'phone', 'latitude', 'longitude')
+]
+UPDATE_COLUMNS = [column for group in UPDATE_GROUPS for column in group]
+
+# Values per IN (...) probe, below SQLite's default limit of bound parameters
+PROBE_CHUNK_SIZE = 500
+
+
+def parse_known_rows_mode(value, default=DEFAULT_KNOWN_ROW_MODE):
+    if value is None or value == '':
+        return default
+    mode = str(value).strip().lower()
+    if mode not in KNOWN_ROW_MODES:
+        raise ValueError(f"known_rows must be one of: {', '.join(KNOWN_ROW_MODES)}")
+    return mode
+
+
+def is_missing(column, value):
+    # Review counts are normalized to 0 when the file has none
+    if column == 'review_count':
+        return not value
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def merge_row(contact, row):
+    """Values of a stored contact updated with the fields an incoming row has."""
+    merged = {}
+    for group in UPDATE_GROUPS:
+        source = contact if is_missing(group[0], row[group[0]]) else row
+        for column in group:
+            merged[column] = source[column]
+    return merged
+
+
+def select_extra(extra, positions):
+    """Extra values of the rows in positions, re-keyed to positions[row position]."""
+    selected = {}
+    for name, (label, value_positions, texts, numbers) in extra.items():
+        indexes = [i for i, position in enumerate(value_positions) if position in positions]
+        if indexes:
+            selected[name] = (
+                label,
+                [positions[value_positions[i]] for i in indexes],
+                [texts[i] for i in indexes],
+                [numbers[i] for i in indexes],
+            )
+    return selected
+
+
+def chunks(values, size=PROBE_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class KnownRows:
+    """Filters the batches of one uploaded file before they are inserted.
+
+    Pass it as insert_row_batches(known_rows=...); skipped and updated
+    count the rows it kept out of the insert.
+    """
+
+    def __init__(self, session, table, file_id, mode=DEFAULT_KNOWN_ROW_MODE, extra_writer=None):
+        if mode not in ('upsert', 'skip'):
+            raise ValueError(f'Unsupported known_rows mode: {mode}')
+        self.session = session
+        self.table = table
+        self.file_id = file_id
+        self.mode = mode
+        self.extra_writer = extra_writer
+        self.skipped = 0
+        self.updated = 0
+
+    def filter(self, rows, extra):
+        """(rows, extra) left to insert after skipping and updating known rows."""
+        known = self._stored_hashes({row['row_hash'] for row in rows})
+        candidates = []
+        for position, row in enumerate(rows):
+            if row['row_hash'] in known:
+                self.skipped += 1
+                continue
+            known.add(row['row_hash'])
+            candidates.append(position)
+
+        contacts = self._contacts_by_identity(rows, candidates) if self.mode == 'upsert' else {}
+        inserts = []
+        updates = {}
+        for position in candidates:
+            contact = contacts.get(position)
+            if contact is None:
+                inserts.append(position)
+                continue
+            merged = merge_row(contact, rows[position])
+            merged['row_hash'] = row_hash(merged)
+            if merged['row_hash'] == row_hash(contact):
+                # The row adds nothing to the stored contact
+                self.skipped += 1
+                continue
+            updates[position] = (contact['id'], merged)
+
+        if updates:
+            self._update(updates.values())
+            self.updated += len(updates)
+            if self.extra_writer is not None:
+                contact_ids = {position: contact_id for position, (contact_id, _) in updates.items()}
+                updated_extra = select_extra(extra, {position: position for position in contact_ids})
+                if updated_extra:
+                    self.extra_writer.replace(contact_ids, updated_extra)
+
+        if len(inserts) == len(rows):
+            return rows, extra
+        new_positions = {position: index for index, position in enumerate(inserts)}
+        return [rows[position] for position in inserts], select_extra(extra, new_positions)
+
+    def _stored_hashes(self, hashes):
+        column = self.table.c.row_hash
+        stored = set()
+        for values in chunks(hashes):
+            stored.update(self.session.execute(sa.select(column).where(column.in_(values))).scalars())
+        return stored
+
+    def _contacts_by_identity(self, rows, positions):
+        """Row position -> earliest contact of another file with the row's Place Id, else Cid."""
+        table = self.table
+        columns = [table.c.id] + [table.c[column] for column in UPDATE_COLUMNS]
+        found = {}
+        for key in IDENTITY_KEYS:
+            wanted = {}
+            for position in positions:
+                value = rows[position][key]
+                if value is not None and position not in found:
+                    wanted.setdefault(value, []).append(position)
+            for values in chunks(wanted):
+                stmt = (
+                    sa.select(*columns)
+                    .where(table.c[key].in_(values), table.c.file_id != self.file_id)
+                    .order_by(table.c.id)
+                )
+                for contact in self.session.execute(stmt).mappings():
+                    for position in wanted.pop(contact[key], ()):
+                        found[position] = contact
+        return found
+
+    def _update(self, updates):
+        # Bound names must differ from the column names in an UPDATE ... SET
+        stmt = (
+            sa.update(self.table)
+            .where(self.table.c.id == sa.bindparam('contact_id'))
+            .values({column: sa.bindparam(f'new_{column}') for column in UPDATE_COLUMNS + ['row_hash']})
+        )
+        self.session.execute(stmt, [
+            {'contact_id': contact_id, **{f'new_{column}': value for column, value in merged.items()}}
+            for contact_id, merged in updates
+        ])
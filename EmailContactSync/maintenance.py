@@ -0,0 +1,149 @@
+"""Routine upkeep of the SQLite databases: planner statistics and free space.
+
+- optimize() refreshes the statistics the query planner uses to choose
+  indexes: a full ANALYZE the first time, then PRAGMA optimize, which
+  only re-analyzes tables that changed enough to matter.
+- reclaim() gives pages freed by deletes and merges back to the file
+  system. Databases with auto_vacuum=INCREMENTAL (every file created
+  since it became a writer pragma) release them in steps; older files
+  are converted by a single full VACUUM once enough of them is free.
+- database_health() reports size, free pages and the share of the file
+  they take, through any connection, including read-only ones.
+
+MaintenanceScheduler runs both periodically on a background thread;
+they also run as the 'maintenance' job.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+from storage import raw_cursor
+
+DEFAULT_INTERVAL = 3600  # seconds
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+# Rows sampled per index by ANALYZE, keeping it fast on large tables
+ANALYSIS_LIMIT = 1000
+
+# Free pages below which reclaiming is not worth the write lock
+MIN_FREE_PAGES = 256
+
+# Share of free pages making a full VACUUM worthwhile without incremental vacuum
+VACUUM_MIN_FREE_RATIO = 0.2
+
+# Pages released per incremental vacuum step; writers can run in between
+INCREMENTAL_PAGES = 2048
+
+
+def database_health(conn):
+    """Size and free space of the database of a SQLAlchemy connection."""
+    def pragma(name):
+        return conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+
+    page_size = pragma('page_size')
+    page_count = pragma('page_count')
+    free_pages = pragma('freelist_count')
+    analyzed = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").first() is not None
+    return {
+        'page_size': page_size,
+        'page_count': page_count,
+        'free_pages': free_pages,
+        'size_bytes': page_size * page_count,
+        'reclaimable_bytes': page_size * free_pages,
+        # Share of the file on the freelist, i.e. allocated but unused
+        'fragmentation': round(free_pages / page_count, 4) if page_count else 0.0,
+        'auto_vacuum': AUTO_VACUUM_MODES.get(pragma('auto_vacuum'), 'unknown'),
+        'analyzed': analyzed,
+    }
+
+
+def optimize(engine):
+    """Refresh planner statistics; returns 'analyze' or 'optimize'."""
+    with raw_cursor(engine) as cursor:
+        cursor.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+        if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+            cursor.execute('ANALYZE')
+            return 'analyze'
+        cursor.execute('PRAGMA optimize')
+        return 'optimize'
+
+
+def reclaim(engine, min_free_pages=MIN_FREE_PAGES, vacuum_min_free_ratio=VACUUM_MIN_FREE_RATIO):
+    """Release free pages to the file system; returns the bytes released."""
+    with raw_cursor(engine) as cursor:
+        def pragma(name):
+            return cursor.execute(f'PRAGMA {name}').fetchone()[0]
+
+        page_size = pragma('page_size')
+        pages_before = pragma('page_count')
+        free_pages = pragma('freelist_count')
+        if free_pages < min_free_pages:
+            return 0
+        if pragma('auto_vacuum') == 2:
+            while free_pages > 0:
+                # executescript steps the pragma to completion; execute frees a single page
+                cursor.executescript(f'PRAGMA incremental_vacuum({INCREMENTAL_PAGES})')
+                remaining = pragma('freelist_count')
+                if remaining >= free_pages:
+                    break
+                free_pages = remaining
+        elif free_pages / pages_before >= vacuum_min_free_ratio:
+            # Rewrites the file and switches it to incremental vacuum for next time
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute('VACUUM')
+        else:
+            return 0
+        # Shrink the main file now rather than at the next automatic checkpoint
+        cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        return (pages_before - pragma('page_count')) * page_size
+
+
+def run_maintenance(engine, analyze=True, vacuum=True):
+    """optimize() and reclaim() one database; None for non-SQLite engines."""
+    if engine.dialect.name != 'sqlite':
+        return None
+    started = time.perf_counter()
+    result = {'optimize': None, 'reclaimed_bytes': 0}
+    if analyze:
+        result['optimize'] = optimize(engine)
+    if vacuum:
+        result['reclaimed_bytes'] = reclaim(engine)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    result['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return result
+
+
+class MaintenanceScheduler:
+    """Calls run() every interval seconds on a daemon thread.
+
+    The thread starts on the first start() call, so processes that only
+    import the app (such as parse workers) do not run it; an interval of
+    0 disables it.
+    """
+
+    def __init__(self, run, interval=DEFAULT_INTERVAL):
+        self.run = run
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='maintenance', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                logging.error(f"Database maintenance failed: {e}")
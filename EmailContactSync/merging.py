@@ -0,0 +1,165 @@
+import logging
+import time
+
+import sqlalchemy as sa
+
+from extra_fields import copy_missing_values
+from normalization import normalize_email, normalize_phone
+
+# Fields copied from duplicates into the primary record; differing values are noted
+MERGE_FIELDS = ['category', 'name', 'email', 'phone', 'facebook', 'website', 'city', 'address', 'company', 'position']
+
+# Identifiers filled in from duplicates when the primary has none
+IDENTIFIER_FIELDS = ['place_id', 'cid']
+
+# Coordinates are taken as a pair from the first duplicate that has them
+COORDINATE_FIELDS = ['latitude', 'longitude']
+
+# Contact ids loaded with one IN query per batch
+DEFAULT_MERGE_BATCH_SIZE = 5000
+
+
+def merge_group(primary, duplicates):
+    """Compute the survivor row for a primary record and its duplicates.
+
+    Empty primary fields take the duplicate's value; other differing values
+    and duplicate notes are appended to the notes. review_count is the max.
+    """
+    survivor = dict(primary)
+    merged_notes = primary['notes'] or ''
+
+    for dup in duplicates:
+        for field in MERGE_FIELDS:
+            primary_value = survivor[field]
+            dup_value = dup[field]
+
+            if dup_value and dup_value != primary_value:
+                # If primary doesn't have a value for this field, use the duplicate's value
+                if not primary_value:
+                    survivor[field] = dup_value
+                # Otherwise, note the merged value
+                else:
+                    merged_notes += f"\nMerged {field}: {dup_value}"
+
+        for field in IDENTIFIER_FIELDS:
+            if not survivor[field] and dup[field]:
+                survivor[field] = dup[field]
+
+        if survivor['latitude'] is None and dup['latitude'] is not None:
+            survivor['latitude'] = dup['latitude']
+            survivor['longitude'] = dup['longitude']
+
+        # Для review_count берем максимальное значение
+        if (dup['review_count'] or 0) > (survivor['review_count'] or 0):
+            survivor['review_count'] = dup['review_count']
+
+        # Also merge any notes
+        if dup['notes'] and dup['notes'] != primary['notes']:
+            merged_notes += f"\nMerged notes: {dup['notes']}"
+
+    survivor['notes'] = merged_notes
+    survivor['merged'] = True
+    survivor['email_norm'] = normalize_email(survivor['email'])
+    survivor['phone_norm'] = normalize_phone(survivor['phone'])
+    return survivor
+
+
+def iter_batches(groups, batch_size):
+    """Split groups into batches holding about batch_size contact ids each."""
+    batch = []
+    count = 0
+    for group in groups:
+        batch.append(group)
+        count += len(group)
+        if count >= batch_size:
+            yield batch
+            batch = []
+            count = 0
+    if batch:
+        yield batch
+
+
+def merge_duplicate_groups(session, table, groups, batch_size=DEFAULT_MERGE_BATCH_SIZE, progress=None,
+                           copy_extra=False):
+    """Merge groups of contact ids; the first id in each group survives.
+
+    Each batch loads its members with one IN query, computes survivors in
+    memory and writes them with one executemany UPDATE and one DELETE. With
+    copy_extra, survivors also take the extra field values they lack. The
+    caller commits, so the whole merge is a single transaction. Returns
+    totals and per-batch timings.
+    """
+    update_columns = MERGE_FIELDS + IDENTIFIER_FIELDS + COORDINATE_FIELDS + ['review_count', 'notes', 'merged', 'email_norm', 'phone_norm']
+    update_stmt = (
+        sa.update(table)
+        .where(table.c.id == sa.bindparam('survivor_id'))
+        .values({col: sa.bindparam(f'new_{col}') for col in update_columns})
+    )
+    select_columns = [table.c.id] + [table.c[col] for col in MERGE_FIELDS + IDENTIFIER_FIELDS + COORDINATE_FIELDS + ['review_count', 'notes']]
+
+    deleted_ids = set()
+    stats = {'merged_groups': 0, 'deleted': 0, 'batches': []}
+
+    if progress is not None:
+        progress.set_total(len(groups))
+
+    for batch in iter_batches(groups, batch_size):
+        if progress is not None:
+            progress.check_cancelled()
+        started = time.perf_counter()
+        ids = {contact_id for group in batch for contact_id in group} - deleted_ids
+        rows = session.execute(sa.select(*select_columns).where(table.c.id.in_(ids))).mappings()
+        contacts = {row['id']: dict(row) for row in rows}
+
+        updates = []
+        to_delete = []
+        extra_pairs = []
+        for group in batch:
+            if len(group) < 2:
+                continue
+            primary = contacts.get(group[0])
+            if primary is None:
+                continue
+            duplicates = []
+            for dup_id in group[1:]:
+                if dup_id == group[0]:
+                    continue
+                dup = contacts.pop(dup_id, None)
+                if dup is None:
+                    continue
+                duplicates.append(dup)
+                to_delete.append(dup_id)
+                extra_pairs.append({'survivor_id': group[0], 'duplicate_id': dup_id})
+
+            survivor = merge_group(primary, duplicates)
+            contacts[group[0]] = survivor
+            updates.append(survivor)
+
+        # The same primary may appear in several groups; keep its final state
+        params = {}
+        for survivor in updates:
+            params[survivor['id']] = {
+                'survivor_id': survivor['id'],
+                **{f'new_{col}': survivor[col] for col in update_columns}
+            }
+        if params:
+            session.execute(update_stmt, list(params.values()))
+        if copy_extra:
+            copy_missing_values(session, extra_pairs)
+        if to_delete:
+            session.execute(sa.delete(table).where(table.c.id.in_(to_delete)))
+            deleted_ids.update(to_delete)
+
+        elapsed = time.perf_counter() - started
+        stats['merged_groups'] += len(updates)
+        stats['deleted'] += len(to_delete)
+        stats['batches'].append({
+            'groups': len(updates),
+            'deleted': len(to_delete),
+            'seconds': round(elapsed, 3)
+        })
+        if progress is not None:
+            progress.advance(len(batch))
+
+    logging.info(f"Merged {stats['merged_groups']} duplicate groups, deleted {stats['deleted']} contacts")
+    return stats
@@ -0,0 +1,259 @@
+"""In-process metrics in the Prometheus text format.
+
+Counters and histograms live in a Registry rendered by /metrics. Three
+sources feed it:
+
+- request hooks in app.py: latency per route, and the number and time of
+  SQL statements each request ran
+- SQLAlchemy cursor events on every engine: statement durations by
+  operation (SELECT, INSERT...)
+- StageTimer: time spent in each stage of an upload or export, and the
+  rows it processed
+
+RequestProfiler optionally profiles every request and keeps a dump of
+the slow ones. Values are per process, like the response cache.
+"""
+import cProfile
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import sqlalchemy as sa
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500, 1000, 10000)
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+FIRST_WORD = re.compile(r'\s*(\w+)')
+UNSAFE_FILENAME = re.compile(r'[^\w.-]+')
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{label_text(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{label_text(names, label_values + (bound,))} {count}')
+                lines.append(f'{self.name}_bucket{label_text(names, label_values + ("+Inf",))} {series[-1]}')
+                labels = label_text(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {series[-2]:.6f}')
+                lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+
+class Registry:
+    """The app's metrics, rendered together by /metrics."""
+
+    def __init__(self):
+        self.request_seconds = Histogram(
+            'http_request_duration_seconds', 'Request latency by route', ('method', 'route', 'status'))
+        self.request_queries = Histogram(
+            'http_request_sql_queries', 'SQL statements run per request', ('route',), COUNT_BUCKETS)
+        self.request_sql_seconds = Histogram(
+            'http_request_sql_seconds', 'Time spent in SQL statements per request', ('route',))
+        self.query_seconds = Histogram(
+            'sql_query_duration_seconds', 'SQL statement duration by operation', ('operation',), SQL_BUCKETS)
+        self.stage_seconds = Histogram(
+            'stage_duration_seconds', 'Time spent in each stage of uploads and exports', ('operation', 'stage'))
+        self.rows = Counter('rows_processed_total', 'Rows processed by operation', ('operation',))
+        self.profiles = Counter('slow_request_profiles_total', 'Profiles written for slow requests', ('route',))
+        self.started = time.time()
+
+    def record_stages(self, operation, stages, rows=None):
+        for stage, seconds in stages.items():
+            self.stage_seconds.observe(seconds, operation, stage)
+        if rows is not None:
+            self.rows.inc(rows, operation)
+
+    def render(self):
+        lines = []
+        for metric in (self.request_seconds, self.request_queries, self.request_sql_seconds,
+                       self.query_seconds, self.stage_seconds, self.rows, self.profiles):
+            lines.extend(metric.render())
+        lines.append('# HELP process_start_time_seconds Start time of the process since the epoch')
+        lines.append('# TYPE process_start_time_seconds gauge')
+        lines.append(f'process_start_time_seconds {self.started:.3f}')
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """Seconds spent per named stage, summed over repeated entries."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+
+class QueryTracker:
+    """Times every SQL statement through engine events.
+
+    Statements run while a request is active on the thread are also
+    counted for that request.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._local = threading.local()
+
+    def install(self):
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute', self._before)
+        sa.event.listen(sa.engine.Engine, 'after_cursor_execute', self._after)
+        sa.event.listen(sa.engine.Engine, 'handle_error', self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('query_started')
+        if not started:
+            return
+        seconds = time.perf_counter() - started.pop()
+        match = FIRST_WORD.match(statement)
+        operation = match.group(1).upper() if match else 'OTHER'
+        self.registry.query_seconds.observe(seconds, operation)
+        totals = getattr(self._local, 'totals', None)
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += seconds
+
+    def _error(self, context):
+        # A failed statement gets no after_cursor_execute; drop its start time.
+        # Errors raised while connecting come without a cursor attribute
+        if context.connection is not None and getattr(context, 'cursor', None) is not None:
+            started = context.connection.info.get('query_started')
+            if started:
+                started.pop()
+
+    def start_request(self):
+        self._local.totals = [0, 0.0]
+
+    def finish_request(self):
+        """(statements, seconds) since start_request on this thread."""
+        totals = getattr(self._local, 'totals', None)
+        self._local.totals = None
+        return tuple(totals) if totals is not None else (0, 0.0)
+
+
+class RequestProfiler:
+    """Profiles requests and writes a dump when one takes at least threshold_ms.
+
+    Profiling slows every request down, so it is opt-in (threshold_ms > 0).
+    cProfile dumps are .prof files for pstats/snakeviz; pyinstrument, when
+    installed and selected, writes .html.
+    """
+
+    def __init__(self, directory, threshold_ms=0, kind='cprofile'):
+        if kind not in PROFILERS:
+            raise ValueError(f"profiler must be one of: {', '.join(PROFILERS)}")
+        if kind == 'pyinstrument' and pyinstrument is None:
+            raise ValueError('pyinstrument is not installed')
+        self.directory = directory
+        self.threshold_ms = threshold_ms
+        self.kind = kind
+
+    @property
+    def enabled(self):
+        return self.threshold_ms > 0
+
+    def start(self):
+        if self.kind == 'pyinstrument':
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop(self, profiler, route, elapsed):
+        """Stop profiling; returns the dump path for slow requests, else None."""
+        if self.kind == 'pyinstrument':
+            profiler.stop()
+        else:
+            profiler.disable()
+        elapsed_ms = elapsed * 1000
+        if elapsed_ms < self.threshold_ms:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        name = UNSAFE_FILENAME.sub('_', route).strip('_') or 'root'
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        path = os.path.join(self.directory, f'{stamp}-{name}-{elapsed_ms:.0f}ms')
+        if self.kind == 'pyinstrument':
+            path += '.html'
+            with open(path, 'w', encoding='utf-8') as out:
+                out.write(profiler.output_html())
+        else:
+            path += '.prof'
+            profiler.dump_stats(path)
+        return path
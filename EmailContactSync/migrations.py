@@ -0,0 +1,171 @@
+import logging
+
+import sqlalchemy as sa
+
+from ingest import row_hash, ROW_HASH_FIELDS
+from normalization import normalize_email, normalize_phone
+from storage import raw_cursor
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def ensure_indexes(engine, tables):
+    """Create any indexes declared on the models that an older database lacks.
+
+    db.create_all() only creates indexes together with new tables, so
+    databases created before an index was added need this step.
+    """
+    for table in tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    logging.info("Database indexes verified")
+
+
+def ensure_columns(engine, table):
+    """ALTER TABLE ADD COLUMN for model columns missing from the database.
+
+    Returns the names of the columns that were added.
+    """
+    existing = {col['name'] for col in sa.inspect(engine).get_columns(table.name)}
+    added = []
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(sa.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+            added.append(column.name)
+    if added:
+        logging.info(f"Added columns to {table.name}: {', '.join(added)}")
+    return added
+
+
+def ensure_foreign_keys(engine, table):
+    """Rebuild a SQLite table whose stored definition lacks the model's foreign keys.
+
+    SQLite cannot add a constraint to an existing table, so the table is
+    recreated from the model and its rows copied over, following the
+    ALTER TABLE procedure of the SQLite documentation: in one transaction
+    with enforcement off, restoring the table's indexes and triggers from
+    their stored SQL. Rows whose parent row is missing are kept and
+    counted in the log. Returns True when the table was rebuilt.
+    """
+    if engine.dialect.name != 'sqlite' or not table.foreign_keys:
+        return False
+    with engine.connect() as conn:
+        if conn.exec_driver_sql(f'PRAGMA foreign_key_list({table.name})').first() is not None:
+            return False
+    
+    # The copy needs the parent tables in its metadata to render its REFERENCES
+    metadata = sa.MetaData()
+    for foreign_key in table.foreign_keys:
+        foreign_key.column.table.to_metadata(metadata)
+    rebuilt_name = f'{table.name}__rebuild'
+    rebuilt = table.to_metadata(metadata, name=rebuilt_name)
+    existing = sa.inspect(engine).get_columns(table.name)
+    # Columns the model no longer declares are carried over rather than dropped
+    for col in existing:
+        if col['name'] not in rebuilt.c:
+            rebuilt.append_column(sa.Column(col['name'], col['type']))
+    create_sql = str(sa.schema.CreateTable(rebuilt).compile(dialect=engine.dialect))
+    columns = ', '.join(col['name'] for col in existing)
+    
+    with raw_cursor(engine) as cursor:
+        enforced = cursor.execute('PRAGMA foreign_keys').fetchone()[0]
+        cursor.execute('PRAGMA foreign_keys = OFF')
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                schema = cursor.execute(
+                    "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') "
+                    "AND sql IS NOT NULL", (table.name,)
+                ).fetchall()
+                cursor.execute(create_sql)
+                cursor.execute(f'INSERT INTO {rebuilt_name} ({columns}) SELECT {columns} FROM {table.name}')
+                cursor.execute(f'DROP TABLE {table.name}')
+                cursor.execute(f'ALTER TABLE {rebuilt_name} RENAME TO {table.name}')
+                for (statement,) in schema:
+                    cursor.execute(statement)
+                orphans = len(cursor.execute(f'PRAGMA foreign_key_check({table.name})').fetchall())
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+        finally:
+            cursor.execute(f'PRAGMA foreign_keys = {enforced}')
+    logging.info(f"Rebuilt {table.name} with its foreign keys ({orphans} rows without a parent kept)")
+    return True
+
+
+def backfill_normalized_contacts(engine, table, batch_size=BACKFILL_BATCH_SIZE):
+    """Fill email_norm/phone_norm for rows written before the columns existed."""
+    select_stmt = (
+        sa.select(table.c.id, table.c.email, table.c.phone)
+        .where(
+            table.c.id > sa.bindparam('last_id'),
+            sa.or_(
+                sa.and_(table.c.email.isnot(None), table.c.email_norm.is_(None)),
+                sa.and_(table.c.phone.isnot(None), table.c.phone_norm.is_(None))
+            )
+        )
+        .order_by(table.c.id)
+        .limit(batch_size)
+    )
+    update_stmt = (
+        sa.update(table)
+        .where(table.c.id == sa.bindparam('contact_id'))
+        .values(email_norm=sa.bindparam('email_norm'), phone_norm=sa.bindparam('phone_norm'))
+    )
+    updated = 0
+    last_id = 0
+    with engine.begin() as conn:
+        while True:
+            rows = conn.execute(select_stmt, {'last_id': last_id}).all()
+            if not rows:
+                break
+            params = [
+                {
+                    'contact_id': row.id,
+                    'email_norm': normalize_email(row.email),
+                    'phone_norm': normalize_phone(row.phone)
+                }
+                for row in rows
+            ]
+            conn.execute(update_stmt, params)
+            updated += len(params)
+            last_id = rows[-1].id
+    if updated:
+        logging.info(f"Backfilled normalized email/phone for {updated} contacts")
+    return updated
+
+
+def backfill_row_hashes(engine, table, batch_size=BACKFILL_BATCH_SIZE):
+    """Fingerprint the rows written before the row_hash column existed.
+
+    Must run after backfill_normalized_contacts, since the hash covers
+    the normalized email and phone.
+    """
+    select_stmt = (
+        sa.select(table.c.id, *(table.c[field] for field in ROW_HASH_FIELDS))
+        .where(table.c.id > sa.bindparam('last_id'), table.c.row_hash.is_(None))
+        .order_by(table.c.id)
+        .limit(batch_size)
+    )
+    update_stmt = (
+        sa.update(table)
+        .where(table.c.id == sa.bindparam('contact_id'))
+        .values(row_hash=sa.bindparam('hash'))
+    )
+    updated = 0
+    last_id = 0
+    with engine.begin() as conn:
+        while True:
+            rows = conn.execute(select_stmt, {'last_id': last_id}).mappings().all()
+            if not rows:
+                break
+            conn.execute(update_stmt, [{'contact_id': row['id'], 'hash': row_hash(row)} for row in rows])
+            updated += len(rows)
+            last_id = rows[-1]['id']
+    if updated:
+        logging.info(f"Backfilled row hashes for {updated} contacts")
+    return updated
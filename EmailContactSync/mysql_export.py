@@ -0,0 +1,197 @@
+import logging
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from metrics import StageTimer
+from normalization import normalize_email, normalize_phone
+
+TARGET_TABLE_NAME = 'contacts'
+
+# Contact fields copied to the target table
+EXPORT_FIELDS = ['category', 'name', 'email', 'phone', 'facebook', 'website', 'city', 'address', 'company', 'position', 'review_count', 'notes']
+
+# Rows per multi-row INSERT and per target transaction
+DEFAULT_EXPORT_BATCH_SIZE = 5000
+BATCHES_PER_TRANSACTION = 4
+
+
+def build_connection_uri(mysql_config, override=None):
+    """SQLAlchemy URI for the export target.
+
+    `override` (app config EXPORT_TARGET_URI) replaces the MySQL URI, e.g.
+    with a SQLite stand-in for local testing.
+    """
+    if override:
+        return override
+    return f"mysql+pymysql://{mysql_config['user']}:{mysql_config['password']}@{mysql_config['host']}:{mysql_config['port']}/{mysql_config['database']}"
+
+
+def define_contacts_table(metadata):
+    """The target contacts table, unique on normalized email and phone.
+
+    NULL keys never conflict, so contacts without an email or phone are
+    only checked on the other key.
+    """
+    return sa.Table(
+        TARGET_TABLE_NAME, metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('category', sa.String(255)),
+        sa.Column('name', sa.String(255)),
+        sa.Column('email', sa.String(255)),
+        sa.Column('phone', sa.String(255)),
+        sa.Column('facebook', sa.String(255)),
+        sa.Column('website', sa.String(255)),
+        sa.Column('city', sa.String(255)),
+        sa.Column('address', sa.String(255)),
+        sa.Column('company', sa.String(255)),
+        sa.Column('position', sa.String(255)),
+        sa.Column('review_count', sa.Integer, default=0),
+        sa.Column('notes', sa.Text),
+        sa.Column('created_at', sa.DateTime, default=datetime.utcnow),
+        sa.Column('email_norm', sa.String(255)),
+        sa.Column('phone_norm', sa.String(255)),
+        sa.Index('uq_contacts_email_norm', 'email_norm', unique=True),
+        sa.Index('uq_contacts_phone_norm', 'phone_norm', unique=True),
+    )
+
+
+def ensure_target_schema(engine, table):
+    """Create the target table, upgrading tables from older exports.
+
+    Tables created before email_norm/phone_norm existed get the columns,
+    a one-off backfill and the unique indexes. When a key already occurs
+    more than once, only its first row keeps the normalized value.
+    """
+    table.metadata.create_all(engine)
+
+    inspector = sa.inspect(engine)
+    columns = {col['name'] for col in inspector.get_columns(table.name)}
+    missing = [name for name in ('email_norm', 'phone_norm') if name not in columns]
+    if missing:
+        with engine.begin() as conn:
+            for name in missing:
+                conn.execute(sa.text(f'ALTER TABLE {table.name} ADD COLUMN {name} VARCHAR(255)'))
+            backfill_target_keys(conn, table)
+        logging.info(f"Upgraded export table {table.name}: added {', '.join(missing)}")
+
+    indexes = {index['name'] for index in sa.inspect(engine).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in indexes:
+            index.create(bind=engine)
+
+
+def backfill_target_keys(conn, table, batch_size=DEFAULT_EXPORT_BATCH_SIZE):
+    seen_emails = set()
+    seen_phones = set()
+    update_stmt = (
+        sa.update(table)
+        .where(table.c.id == sa.bindparam('row_id'))
+        .values(email_norm=sa.bindparam('new_email_norm'), phone_norm=sa.bindparam('new_phone_norm'))
+    )
+    rows = conn.execute(sa.select(table.c.id, table.c.email, table.c.phone).order_by(table.c.id))
+    while True:
+        batch = rows.fetchmany(batch_size)
+        if not batch:
+            break
+        params = []
+        for row in batch:
+            email = normalize_email(row.email)
+            phone = normalize_phone(row.phone)
+            if email in seen_emails:
+                email = None
+            if phone in seen_phones:
+                phone = None
+            seen_emails.add(email)
+            seen_phones.add(phone)
+            params.append({'row_id': row.id, 'new_email_norm': email, 'new_phone_norm': phone})
+        conn.execute(update_stmt, params)
+
+
+def source_select(source_table, file_id=None):
+    columns = [source_table.c[field] for field in EXPORT_FIELDS]
+    stmt = sa.select(*columns, source_table.c.email_norm, source_table.c.phone_norm)
+    if file_id is not None:
+        stmt = stmt.where(source_table.c.file_id == file_id)
+    return stmt.order_by(source_table.c.id)
+
+
+def insert_statement(table, ignore_duplicates):
+    """Multi-row INSERT that silently skips rows hitting a unique key."""
+    stmt = sa.insert(table)
+    if ignore_duplicates:
+        stmt = stmt.prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+    return stmt
+
+
+def export_contacts(session, source_table, engine, target_table, file_id=None,
+                    check_uniqueness=True, batch_size=DEFAULT_EXPORT_BATCH_SIZE, progress=None):
+    """Stream contacts from SQLite into the target table in batches.
+
+    Uniqueness is enforced by the target's unique indexes through INSERT
+    IGNORE, so the existing rows are never pulled into Python. Without the
+    check, rows are inserted with empty keys so the indexes cannot reject
+    them. Returns export counts, throughput and seconds per stage.
+
+    With `progress`, cancellation rolls back only the open transaction;
+    batches committed before it stay in the target.
+    """
+    started = time.perf_counter()
+    stages = StageTimer()
+    stmt = insert_statement(target_table, check_uniqueness)
+    with stages.stage('read'):
+        result = session.execute(source_select(source_table, file_id), execution_options={'yield_per': batch_size})
+        partitions = result.partitions(batch_size)
+
+    total = 0
+    exported = 0
+    conn = engine.connect()
+    try:
+        transaction = conn.begin()
+        batches_in_transaction = 0
+        while True:
+            with stages.stage('read'):
+                partition = next(partitions, None)
+            if partition is None:
+                break
+            if progress is not None:
+                progress.check_cancelled()
+            with stages.stage('prepare'):
+                now = datetime.utcnow()
+                rows = []
+                for row in partition:
+                    values = {field: row[i] for i, field in enumerate(EXPORT_FIELDS)}
+                    values['created_at'] = now
+                    values['email_norm'] = row.email_norm if check_uniqueness else None
+                    values['phone_norm'] = row.phone_norm if check_uniqueness else None
+                    rows.append(values)
+
+            with stages.stage('write'):
+                inserted = conn.execute(stmt, rows).rowcount
+            total += len(rows)
+            exported += inserted if inserted is not None and inserted >= 0 else len(rows)
+            if progress is not None:
+                progress.advance(len(rows))
+
+            batches_in_transaction += 1
+            if batches_in_transaction >= BATCHES_PER_TRANSACTION:
+                with stages.stage('commit'):
+                    transaction.commit()
+                transaction = conn.begin()
+                batches_in_transaction = 0
+        with stages.stage('commit'):
+            transaction.commit()
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    logging.info(f"Exported {exported} of {total} contacts in {elapsed:.2f}s")
+    return {
+        'total': total,
+        'exported_count': exported,
+        'skipped_count': total - exported,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(total / elapsed, 1) if elapsed > 0 else float(total),
+        'stages': stages.seconds
+    }
@@ -0,0 +1,85 @@
+import re
+
+NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_email(value):
+    """Lowercased, trimmed email used for duplicate lookups."""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    return value or None
+
+
+def normalize_identifier(value):
+    """Trimmed external identifier (Place Id, Cid) or None."""
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return None
+        if value.is_integer():
+            value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def normalize_phone(value):
+    """Digits-only phone used for duplicate lookups."""
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return None
+        if value.is_integer():
+            value = int(value)
+    value = NON_DIGITS.sub('', str(value))
+    return value or None
+
+
+def normalize_count(value):
+    """Non-negative integer count; missing or unparsable values count as 0."""
+    if value is None:
+        return 0
+    try:
+        count = int(float(str(value).strip().replace(',', '').replace(' ', '')))
+    except (ValueError, OverflowError):
+        # OverflowError: "inf", "1e400" and other values no int can hold
+        return 0
+    return max(count, 0)
+
+
+def normalize_coordinate(value, limit):
+    """Latitude (limit 90) or longitude (limit 180) as a float, or None.
+
+    Accepts decimal commas; out-of-range values are dropped.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip().replace(',', '.')
+        if not value:
+            return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if value != value or not -limit <= value <= limit:  # NaN or out of range
+        return None
+    return value
+
+
+def website_domain(value):
+    """Host part of a website URL without scheme, "www." or port."""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if not value:
+        return None
+    if '://' in value:
+        value = value.split('://', 1)[1]
+    host = re.split(r'[/?#]', value, 1)[0]
+    host = host.rsplit('@', 1)[-1].split(':', 1)[0]
+    if host.startswith('www.'):
+        host = host[4:]
+    return host or None
@@ -0,0 +1,122 @@
+"""Compact JSON payloads for contact listings.
+
+Listings used to repeat every field name on every row. With
+format=columnar a list of contacts is sent as
+
+    {"fields": ["id", "name", ...], "columns": [[1, 2, ...], ["A", "B", ...]]}
+
+that is, the field names once and one array of values per field. The
+front end turns it back into objects (decodeColumnar in
+duplicateManager.js). The default "rows" layout is unchanged.
+
+Responses are encoded with orjson when it is installed, and JSON bodies
+above a size threshold are compressed with brotli (when installed) or
+gzip, whichever the client accepts.
+"""
+import gzip
+import json
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LAYOUTS = ('rows', 'columnar')
+
+# JSON bodies smaller than this are sent as they are
+MIN_COMPRESS_BYTES = 1024
+
+# Fast settings: listings are compressed on every cache miss
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_MIMETYPES = ('application/json',)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() through orjson, falling back to the stdlib encoder.
+
+    Dates, decimals and other values orjson does not handle natively still
+    go through DefaultJSONProvider.default, so they serialize as before.
+    """
+
+    def dumps_bytes(self, obj):
+        if orjson is None:
+            return json.dumps(obj, default=self.default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return orjson.dumps(obj, default=self.default, option=(
+            orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY
+        ))
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def parse_layout(value):
+    if value is None or value == '':
+        return 'rows'
+    if value not in LAYOUTS:
+        raise ValueError(f"format must be one of: {', '.join(LAYOUTS)}")
+    return value
+
+
+def plain_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def contact_payload(rows, fields, layout='rows'):
+    """Rows (sequences in `fields` order) as a list of dicts or a columnar table."""
+    if layout == 'columnar':
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in fields]
+        for index, column in enumerate(columns):
+            if any(isinstance(value, date) for value in column):
+                columns[index] = [plain_value(value) for value in column]
+        return {'fields': list(fields), 'columns': columns}
+    return [{field: plain_value(value) for field, value in zip(fields, row)} for row in rows]
+
+
+def negotiate_encoding(accept_encodings):
+    """Best content coding the client accepts, or None."""
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response, encoding, min_bytes=MIN_COMPRESS_BYTES):
+    """Compress a finished JSON response in place when it is worth it."""
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < min_bytes:
+        return response
+    response.set_data(compress_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,174 @@
+"""In-memory cache of read responses, invalidated by write generations.
+
+Every database stores a write generation in its write_generation table:
+a counter that writes bump inside their transaction (uploads, merges,
+file deletion, index rebuilds), plus a nonce chosen when the database is
+created. A cached view response is keyed by database, path, query
+arguments and generation, so a bump makes all older entries unreachable;
+they age out of the LRU. Since the generation lives in the database,
+every server process and command-line tool sees the same one.
+
+The ETag is derived from the same key, without hashing the body. A
+request whose If-None-Match matches the current ETag gets a 304 after
+reading only the generation row.
+
+Bodies are stored compressed (see payloads.compress_response), keyed by
+the negotiated content coding as well, so hits are served without
+encoding or compressing again.
+"""
+import functools
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from flask import request, make_response
+
+from payloads import compress_response, negotiate_encoding, MIN_COMPRESS_BYTES
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 1024
+
+GENERATION_TABLE = 'write_generation'
+
+
+def ensure_generation_table(engine):
+    """Create the single-row generation table, with a fresh nonce, if missing."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {GENERATION_TABLE} ("
+            f"id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL, nonce TEXT NOT NULL)"
+        )
+        conn.execute(
+            sa.text(f"INSERT OR IGNORE INTO {GENERATION_TABLE} (id, generation, nonce) VALUES (1, 0, :nonce)"),
+            {'nonce': uuid.uuid4().hex[:8]}
+        )
+
+
+def bump_generation(conn):
+    """Invalidate the cached responses of a database; call inside the write transaction.
+
+    conn is a SQLAlchemy connection or session; the bump commits or rolls
+    back with the write.
+    """
+    conn.execute(sa.text(f"UPDATE {GENERATION_TABLE} SET generation = generation + 1 WHERE id = 1"))
+
+
+def read_generation(conn):
+    """(nonce, generation) of a database; the nonce tells a recreated file from the old one."""
+    row = conn.execute(sa.text(f"SELECT nonce, generation FROM {GENERATION_TABLE} WHERE id = 1")).first()
+    return tuple(row) if row is not None else (None, 0)
+
+
+class ResponseCache:
+    """LRU of response bodies bounded by total bytes and entry count."""
+
+    def __init__(self, generation, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES,
+                 compress_min_bytes=MIN_COMPRESS_BYTES):
+        # generation() returns read_generation() of the current database
+        self.generation = generation
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.compress_min_bytes = compress_min_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def etag(self, key):
+        nonce, generation = key[-1]
+        digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=12).hexdigest()
+        return f'{nonce}-{generation}-{digest}'
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype, encoding=None):
+        size = len(body)
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (body, mimetype, encoding)
+            self._bytes += size
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+    def cached(self, db_key):
+        """Decorator caching a view's 200 responses; db_key() names the current database."""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                database = db_key()
+                encoding = negotiate_encoding(request.accept_encodings)
+                key = (
+                    database, request.path,
+                    tuple(sorted(request.args.items(multi=True))), encoding,
+                    self.generation()
+                )
+                etag = self.etag(key)
+
+                if etag in request.if_none_match:
+                    self.count_not_modified()
+                    response = make_response('', 304)
+                else:
+                    entry = self.get(key)
+                    if entry is not None:
+                        response = make_response(entry[0])
+                        response.mimetype = entry[1]
+                        if entry[2] is not None:
+                            response.headers['Content-Encoding'] = entry[2]
+                    else:
+                        response = make_response(view(*args, **kwargs))
+                        if response.status_code != 200:
+                            return response
+                        compress_response(response, encoding, self.compress_min_bytes)
+                        self.put(key, response.get_data(), response.mimetype,
+                                 response.headers.get('Content-Encoding'))
+
+                response.vary.add('Accept-Encoding')
+                response.set_etag(etag)
+                # Browsers revalidate every time and get a 304 while nothing changed
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+            return wrapper
+        return decorator
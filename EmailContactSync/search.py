@@ -0,0 +1,199 @@
+"""Full-text search over contacts with an SQLite FTS5 index.
+
+contact_fts is an external-content FTS5 table over the contact table: it
+stores only the index, and triggers keep it in sync on insert, update and
+delete. Existing databases are backfilled when the index is first
+created; it can be rebuilt by hand with:
+
+    python search.py --rebuild
+"""
+import argparse
+import html
+import logging
+
+import sqlalchemy as sa
+
+from response_cache import bump_generation
+
+FTS_TABLE = 'contact_fts'
+CONTENT_TABLE = 'contact'
+
+# Indexed columns and their bm25 weights (higher ranks matches first)
+SEARCH_COLUMNS = {
+    'name': 10.0,
+    'company': 5.0,
+    'category': 3.0,
+    'city': 2.0,
+    'address': 2.0,
+    'notes': 1.0,
+}
+
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+
+# Words around a match in snippets
+SNIPPET_TOKENS = 12
+
+# Private-use markers around matches, replaced after escaping the snippet
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+
+
+def create_statements(content_table):
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_values = ', '.join(f'new.{col}' for col in SEARCH_COLUMNS)
+    old_values = ', '.join(f'old.{col}' for col in SEARCH_COLUMNS)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"{columns}, content='{content_table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {content_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {content_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON {content_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+def ensure_search_index(engine, content_table=CONTENT_TABLE):
+    """Create the FTS index and its triggers, backfilling a new index.
+
+    Returns True when the index was created by this call.
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    exists = FTS_TABLE in sa.inspect(engine).get_table_names()
+    with engine.begin() as conn:
+        for statement in create_statements(content_table):
+            conn.exec_driver_sql(statement)
+        if not exists:
+            conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    if not exists:
+        logging.info(f"Created full-text index {FTS_TABLE}")
+    return not exists
+
+
+def rebuild_search_index(engine):
+    """Rebuild the index from the contact table and merge its segments."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        bump_generation(conn)
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: all words must match.
+
+    Words are quoted, so FTS5 operators in the input are taken literally.
+    The last word is a prefix, so results follow the user's typing.
+    """
+    words = [word for word in text.split() if word.strip('"')]
+    if not words:
+        return None
+    terms = ['"{}"'.format(word.replace('"', '""')) for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def match_filter(table, text):
+    """WHERE clause keeping contacts that match a full-text query."""
+    match = build_match_query(text)
+    if match is None:
+        raise ValueError('Empty search query')
+    matching_ids = sa.select(sa.column('rowid')).select_from(sa.table(FTS_TABLE)).where(
+        sa.text(f"{FTS_TABLE} MATCH :match").bindparams(match=match)
+    )
+    return table.c.id.in_(matching_ids)
+
+
+def parse_search_limit(value):
+    if value is None or value == '':
+        return DEFAULT_SEARCH_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_SEARCH_LIMIT)
+
+
+def format_snippet(snippet):
+    """HTML-escape a snippet and mark the matched words."""
+    if not snippet:
+        return snippet
+    return html.escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def search_contacts(session, text, limit=DEFAULT_SEARCH_LIMIT, offset=0, file_id=None,
+                    fields=('id', 'file_id', 'category', 'name', 'email', 'phone', 'website',
+                            'city', 'address', 'company', 'review_count')):
+    """Ranked full-text matches, one page at a time.
+
+    Returns contacts (with rank and snippet), next_offset (None on the last
+    page) and, on the first page, the total number of matches.
+    """
+    match = build_match_query(text)
+    if match is None:
+        raise ValueError('Empty search query')
+
+    weights = ', '.join(str(weight) for weight in SEARCH_COLUMNS.values())
+    where = f"{FTS_TABLE} MATCH :match"
+    params = {'match': match}
+    if file_id is not None:
+        where += " AND c.file_id = :file_id"
+        params['file_id'] = file_id
+
+    columns = ', '.join(f'c.{field}' for field in fields)
+    stmt = sa.text(
+        f"SELECT {columns}, bm25({FTS_TABLE}, {weights}) AS rank, "
+        f"snippet({FTS_TABLE}, -1, :mark_start, :mark_end, '…', {SNIPPET_TOKENS}) AS snippet "
+        f"FROM {FTS_TABLE} JOIN {CONTENT_TABLE} c ON c.id = {FTS_TABLE}.rowid "
+        f"WHERE {where} ORDER BY rank LIMIT :limit OFFSET :offset"
+    )
+    rows = session.execute(stmt, {
+        **params, 'mark_start': MATCH_START, 'mark_end': MATCH_END,
+        'limit': limit + 1, 'offset': offset
+    }).mappings().all()
+
+    contacts = []
+    for row in rows[:limit]:
+        contact = {field: row[field] for field in fields}
+        contact['rank'] = round(row['rank'], 4)
+        contact['snippet'] = format_snippet(row['snippet'])
+        contacts.append(contact)
+
+    result = {
+        'contacts': contacts,
+        'next_offset': offset + limit if len(rows) > limit else None,
+        'limit': limit
+    }
+    if offset == 0:
+        count_stmt = sa.text(
+            f"SELECT count(*) FROM {FTS_TABLE} JOIN {CONTENT_TABLE} c ON c.id = {FTS_TABLE}.rowid WHERE {where}"
+        )
+        result['total'] = session.execute(count_stmt, params).scalar_one()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the contact full-text index')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from the contact table')
+    parser.add_argument('query', nargs='?', help='Search the index and print the best matches')
+    args = parser.parse_args()
+
+    from app import app, db
+
+    with app.app_context():
+        ensure_search_index(db.engine)
+        if args.rebuild:
+            rebuild_search_index(db.engine)
+            print('Full-text index rebuilt')
+        if args.query:
+            with db.engine.connect() as conn:
+                for contact in search_contacts(conn, args.query, limit=20)['contacts']:
+                    print(f"{contact['rank']:>9} {contact['id']:>7} {contact['name']}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -102,6 +102,10 @@ function updateDatabaseInfo(data) {
                             <strong>${db.name}</strong> ${db.is_active ? '<span class="badge bg-success">Active</span>' : ''}
                             <br>
                             <small>${db.size_formatted} • ${db.modified}</small>
+                            ${db.health && db.health.free_pages > 0 ? `
+                                <br>
+                                <small class="text-muted">Reclaimable: ${db.health.reclaimable_formatted} (${(db.health.fragmentation * 100).toFixed(1)}%)</small>
+                            ` : ''}
                             <br>
                             <div class="database-path" title="${db.path}">${db.path}</div>
                         </div>
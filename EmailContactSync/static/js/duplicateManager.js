@@ -141,3 +141,24 @@ function groupDuplicates(contacts) {
     // Filter to only groups with more than one contact
     return Object.values(groups).filter(group => group.length > 1);
 }
+
+// Turn a columnar payload ({fields, columns}) back into a list of contacts;
+// lists already in row form are returned as they are
+function decodeColumnar(payload) {
+    if (!payload || Array.isArray(payload)) return payload || [];
+    
+    const fields = payload.fields;
+    const columns = payload.columns;
+    const count = columns.length > 0 ? columns[0].length : 0;
+    const contacts = new Array(count);
+    
+    for (let i = 0; i < count; i++) {
+        const contact = {};
+        for (let f = 0; f < fields.length; f++) {
+            contact[fields[f]] = columns[f][i];
+        }
+        contacts[i] = contact;
+    }
+    
+    return contacts;
+}
@@ -0,0 +1,140 @@
+// Background job helpers
+
+const JOB_POLL_INTERVAL = 1000;
+
+/**
+ * Submit a background job and poll it until it finishes
+ * @param {string} url - Job submission endpoint (e.g. /jobs/export_to_mysql)
+ * @param {Object} options - fetch options for the submission request
+ * @param {Function} onProgress - Called with the job status on every poll
+ * @returns {Promise<Object>} - Resolves with the job result, rejects with an error message
+ */
+function runJob(url, options, onProgress) {
+    return fetch(url, options)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw (data.errors && data.errors.length ? data.errors.join(', ') : data.error);
+            }
+            return pollJob(data.job_id, onProgress);
+        });
+}
+
+/**
+ * Poll a job until it succeeds, fails or is cancelled
+ * @param {string} jobId - Job ID returned by the submission endpoint
+ * @param {Function} onProgress - Called with the job status on every poll
+ * @returns {Promise<Object>} - Resolves with the job result
+ */
+function pollJob(jobId, onProgress) {
+    return new Promise((resolve, reject) => {
+        function poll() {
+            fetch(`/jobs/${jobId}`)
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) {
+                        reject(data.error);
+                        return;
+                    }
+
+                    const job = data.job;
+                    if (onProgress) {
+                        onProgress(job);
+                    }
+
+                    if (job.status === 'succeeded') {
+                        resolve(job.result);
+                    } else if (job.status === 'failed') {
+                        reject(job.error);
+                    } else if (job.status === 'cancelled') {
+                        reject('Cancelled');
+                    } else {
+                        setTimeout(poll, JOB_POLL_INTERVAL);
+                    }
+                })
+                .catch(reject);
+        }
+        poll();
+    });
+}
+
+/**
+ * Ask the server to cancel a job
+ * @param {string} jobId - Job ID
+ * @returns {Promise<Object>} - Server response
+ */
+function cancelJob(jobId) {
+    return fetch(`/jobs/${jobId}/cancel`, { method: 'POST' })
+        .then(response => response.json());
+}
+
+/**
+ * Format job progress for a button label, e.g. "1,200 / 5,000 (24%) ~12s"
+ * @param {Object} job - Job status returned by /jobs/<job_id>
+ * @returns {string} - Progress text
+ */
+function formatJobProgress(job) {
+    if (job.status === 'queued') {
+        return 'Queued...';
+    }
+
+    let text = job.processed.toLocaleString();
+    if (job.total) {
+        const percent = Math.min(100, Math.round(job.processed / job.total * 100));
+        text += ` / ${job.total.toLocaleString()} (${percent}%)`;
+    }
+    if (job.eta_seconds !== null && job.eta_seconds !== undefined) {
+        text += ` ~${Math.ceil(job.eta_seconds)}s`;
+    }
+    return text;
+}
+
+/**
+ * Progress line with a Cancel button for a running job, shown above the alerts
+ * @param {string} label - What the job does, e.g. "Finding duplicates"
+ * @returns {Object} - onProgress(job) to pass to runJob, and remove() for when it settles
+ */
+function jobStatusBar(label) {
+    const language = localStorage.getItem('uiLanguage') || 'ru';
+    const cancelText = translations['cancel'] ? (translations['cancel'][language] || 'Отмена') : 'Отмена';
+
+    const bar = document.createElement('div');
+    bar.className = 'alert alert-secondary d-flex align-items-center justify-content-between';
+    bar.innerHTML = `
+        <span><span class="spinner-border spinner-border-sm me-2" role="status" aria-hidden="true"></span><span class="job-status-text"></span></span>
+        <button type="button" class="btn btn-sm btn-outline-danger" disabled></button>
+    `;
+    const text = bar.querySelector('.job-status-text');
+    const cancelBtn = bar.querySelector('button');
+    text.textContent = `${label}...`;
+    cancelBtn.textContent = cancelText;
+    document.getElementById('alertContainer').prepend(bar);
+
+    let jobId = null;
+    cancelBtn.addEventListener('click', () => {
+        cancelBtn.disabled = true;
+        cancelJob(jobId)
+            .then(data => {
+                if (!data.success) {
+                    cancelBtn.disabled = false;
+                }
+            })
+            .catch(() => {
+                cancelBtn.disabled = false;
+            });
+    });
+
+    return {
+        onProgress(job) {
+            // Enable cancelling once the job id is known
+            if (jobId === null && !job.cancel_requested) {
+                cancelBtn.disabled = false;
+            }
+            jobId = job.id;
+            text.textContent = `${label}: ${formatJobProgress(job)}`;
+        },
+        remove() {
+            bar.remove();
+        }
+    };
+}
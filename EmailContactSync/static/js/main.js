@@ -49,6 +49,13 @@ document.addEventListener('DOMContentLoaded', function() {
     let totalPages = 1;
     let filteredData = [];
     
+    // Server pages of the listing being viewed (keyset cursor of the next one)
+    const CONTACTS_PAGE_SIZE = 1000;
+    let contactsUrl = null;
+    let nextCursor = null;
+    let totalContacts = 0;
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+    
     // Event Listeners
     
     // File drag and drop
@@ -128,18 +135,29 @@ document.addEventListener('DOMContentLoaded', function() {
         uploadBtn.innerHTML = '<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> Uploading...';
         uploadBtn.disabled = true;
         
-        fetch('/upload', {
+        // Import runs as a background job; show its progress in the button
+        const jobStatus = jobStatusBar('Uploading');
+        runJob('/jobs/upload', {
             method: 'POST',
             body: formData
+        }, job => {
+            uploadBtn.innerHTML = `<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> ${formatJobProgress(job)}`;
+            jobStatus.onProgress(job);
         })
-        .then(response => response.json())
         .then(data => {
             // Reset button
             uploadBtn.innerHTML = originalBtnText;
             uploadBtn.disabled = false;
             
             if (data.success) {
-                showAlert(`Successfully uploaded ${data.uploaded_files.length} file(s)`, 'success');
+                const counts = data.uploaded_files.reduce((total, file) => ({
+                    rows: total.rows + (file.rows || 0),
+                    new: total.new + (file.new || 0),
+                    updated: total.updated + (file.updated || 0),
+                    skipped: total.skipped + (file.skipped || 0)
+                }), {rows: 0, new: 0, updated: 0, skipped: 0});
+                showAlert(`Successfully uploaded ${data.uploaded_files.length} file(s), ${counts.rows} rows: ` +
+                          `${counts.new} new, ${counts.updated} updated, ${counts.skipped} already imported`, 'success');
                 
                 // Clear file input and list
                 fileInput.value = '';
@@ -161,7 +179,8 @@ document.addEventListener('DOMContentLoaded', function() {
             uploadBtn.innerHTML = originalBtnText;
             uploadBtn.disabled = false;
             showAlert('Error uploading files: ' + error, 'danger');
-        });
+        })
+        .finally(() => jobStatus.remove());
     });
     
     // Toggle sidebar - desktop version
@@ -481,7 +500,7 @@ document.addEventListener('DOMContentLoaded', function() {
                             <small class="text-muted d-block">${new Date(file.processed_date).toLocaleString()}</small>
                         </div>
                         <div>
-                            <span class="badge bg-primary rounded-pill">${file.row_count} rows</span>
+                            <span class="badge bg-primary rounded-pill" title="${file.rows_read != null ? `${file.rows_read} rows read` : ''}">${file.row_count} rows</span>
                             <button class="btn btn-sm ${eyeButtonClass} ms-2 load-file-btn" data-file-id="${file.id}" title="${isActive ? 'Сейчас отображается' : 'Нажмите для отображения'}">
                                 <i class="fa fa-eye"></i>
                             </button>
@@ -538,13 +557,9 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show loading
         dataTable.innerHTML = '<tr><td colspan="10" class="text-center"><div class="spinner-border" role="status"><span class="visually-hidden">Loading...</span></div></td></tr>';
         
-        fetch(`/get_file_data/${fileId}`)
-            .then(response => response.json())
+        fetchContactsPage(`/get_file_data/${fileId}`)
             .then(data => {
-                if (data.error) {
-                    showAlert('Error loading file data: ' + data.error, 'danger');
-                    return;
-                }
+                keepPageState(`/get_file_data/${fileId}`, data);
                 
                 // Update current state
                 currentFileId = fileId;
@@ -573,7 +588,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 
                 // Update file info
                 document.getElementById('currentFileName').textContent = data.filename;
-                document.getElementById('recordCount').textContent = data.contacts.length;
+                updateLoadMore();
                 
                 // Enable extract emails button
                 extractEmailsBtn.disabled = false;
@@ -625,6 +640,10 @@ document.addEventListener('DOMContentLoaded', function() {
         noDuplicatesData = [];
         similarRecords = [];
         showingSimilarRecords = false;
+        contactsUrl = null;
+        nextCursor = null;
+        totalContacts = 0;
+        loadMoreBtn.classList.add('d-none');
         
         previewContainer.classList.add('d-none');
         dataTable.innerHTML = '';
@@ -1024,10 +1043,68 @@ document.addEventListener('DOMContentLoaded', function() {
         tableLastPage.parentElement.classList.toggle('disabled', currentPage === totalPages);
     }
     
+    // Fetch the first page of a listing, or the one after `after`
+    function fetchContactsPage(url, after) {
+        const params = new URLSearchParams({format: 'columnar', limit: CONTACTS_PAGE_SIZE});
+        if (after) params.set('after', after);
+        return fetch(`${url}?${params}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) throw new Error(data.error);
+                data.contacts = decodeColumnar(data.contacts);
+                return data;
+            });
+    }
+    
+    // Remember where the listing continues; the total is only sent with the first page
+    function keepPageState(url, data) {
+        contactsUrl = url;
+        nextCursor = data.next_cursor;
+        if (data.total !== null && data.total !== undefined) totalContacts = data.total;
+    }
+    
+    // Show how much of the listing is loaded and whether there is more
+    function updateLoadMore() {
+        const recordCount = document.getElementById('recordCount');
+        recordCount.textContent = nextCursor ? `${currentData.length} / ${totalContacts}` : currentData.length;
+        loadMoreBtn.classList.toggle('d-none', !nextCursor);
+        loadMoreBtn.disabled = false;
+    }
+    
+    // Append the next server page to the loaded contacts
+    loadMoreBtn.addEventListener('click', function() {
+        if (!nextCursor) return;
+        loadMoreBtn.disabled = true;
+        const url = contactsUrl;
+        fetchContactsPage(url, nextCursor)
+            .then(data => {
+                // Another listing was opened meanwhile
+                if (url !== contactsUrl) return;
+                keepPageState(url, data);
+                currentData = currentData.concat(data.contacts);
+                updateLoadMore();
+                // Derived views (duplicates, similar records) are rebuilt from currentData when toggled
+                if (!showingDuplicates && !hidingDuplicates && !showingSimilarRecords) {
+                    renderTableData(currentData);
+                }
+            })
+            .catch(error => {
+                loadMoreBtn.disabled = false;
+                showAlert('Error loading contacts: ' + error.message, 'danger');
+            });
+    });
+    
     // Fetch duplicates
     function fetchDuplicates(fileId) {
-        fetch(`/find_duplicates/${fileId}`)
-            .then(response => response.json())
+        // Runs as a background job that can be cancelled from the status bar
+        const jobStatus = jobStatusBar('Finding duplicates');
+        runJob('/jobs/find_duplicates', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ file_id: fileId })
+        }, jobStatus.onProgress)
             .then(data => {
                 if (data.error) {
                     showAlert('Error finding duplicates: ' + data.error, 'danger');
@@ -1069,7 +1146,8 @@ document.addEventListener('DOMContentLoaded', function() {
             .catch(error => {
                 console.error('Error finding duplicates:', error);
                 showAlert('Error finding duplicates: ' + error, 'danger');
-            });
+            })
+            .finally(() => jobStatus.remove());
     }
     
     // Count total number of duplicate records
@@ -1172,7 +1250,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify({ file_id: currentFileId })
+                body: JSON.stringify({ file_id: currentFileId, format: 'columnar' })
             })
             .then(response => response.json())
             .then(data => {
@@ -1185,7 +1263,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     return;
                 }
                 
-                similarRecords = data.similar_contacts || [];
+                similarRecords = decodeColumnar(data.similar_contacts);
                 
                 if (similarRecords.length === 0) {
                     const language = localStorage.getItem('uiLanguage') || 'ru';
@@ -1316,14 +1394,15 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     function mergeDuplicates(duplicateGroups) {
-        fetch('/merge_duplicates', {
+        // Runs as a background job that can be cancelled from the status bar
+        const jobStatus = jobStatusBar('Merging duplicates');
+        runJob('/jobs/merge_duplicates', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({ duplicates: duplicateGroups })
-        })
-        .then(response => response.json())
+        }, jobStatus.onProgress)
         .then(data => {
             if (data.error) {
                 showAlert('Error merging duplicates: ' + data.error, 'danger');
@@ -1341,7 +1420,8 @@ document.addEventListener('DOMContentLoaded', function() {
         .catch(error => {
             console.error('Error merging duplicates:', error);
             showAlert('Error merging duplicates: ' + error, 'danger');
-        });
+        })
+        .finally(() => jobStatus.remove());
     }
     
     // Statistics function removed
@@ -1385,9 +1465,10 @@ document.addEventListener('DOMContentLoaded', function() {
         // Reset the current state
         resetDataView();
         
-        fetch('/get_all_contacts')
-            .then(response => response.json())
+        fetchContactsPage('/get_all_contacts')
             .then(data => {
+                keepPageState('/get_all_contacts', data);
+                
                 // Update current data
                 currentData = data.contacts;
                 currentColumns = data.columns;
@@ -1403,7 +1484,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 renderTableData(data.contacts);
                 
                 // Update record count
-                document.getElementById('recordCount').textContent = data.contacts.length;
+                updateLoadMore();
                 
                 // Make the extract emails button available
                 extractEmailsBtn.disabled = false;
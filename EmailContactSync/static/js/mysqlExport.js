@@ -81,15 +81,18 @@ function initMySQLExport() {
             check_uniqueness: checkUniqueness
         };
         
-        // Send export request to server
-        fetch('/export_to_mysql', {
+        // Run the export as a background job and show rows exported so far
+        const jobStatus = jobStatusBar('Exporting to MySQL');
+        runJob('/jobs/export_to_mysql', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify(exportData)
+        }, job => {
+            confirmMySQLExportBtn.innerHTML = `<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> Exporting ${formatJobProgress(job)}`;
+            jobStatus.onProgress(job);
         })
-        .then(response => response.json())
         .then(data => {
             confirmMySQLExportBtn.disabled = false;
             confirmMySQLExportBtn.innerHTML = 'Export';
@@ -140,7 +143,8 @@ function initMySQLExport() {
             confirmMySQLExportBtn.disabled = false;
             confirmMySQLExportBtn.innerHTML = 'Export';
             showAlert('Error connecting to MySQL: ' + error, 'danger');
-        });
+        })
+        .finally(() => jobStatus.remove());
     });
     
     // Handle MySQL table visibility toggle
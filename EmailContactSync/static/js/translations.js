@@ -21,6 +21,10 @@ const translations = {
         'ru': 'Следующая',
         'en': 'Next'
     },
+    'load_more': {
+        'ru': 'Загрузить ещё',
+        'en': 'Load more'
+    },
     'last_page': {
         'ru': 'В конец',
         'en': 'Last'
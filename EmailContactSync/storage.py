@@ -0,0 +1,184 @@
+"""SQLite storage layer: one serialized writer, a pool of read-only readers.
+
+The database runs in WAL mode, so readers see the last committed state
+while an import is writing. All writes go through a single pooled
+connection that starts transactions with BEGIN IMMEDIATE: writers queue
+for the pool in process and for the database lock (busy timeout) across
+processes, instead of failing with "database is locked" when a read
+transaction tries to upgrade.
+"""
+import threading
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+DEFAULT_READ_POOL_SIZE = 8
+DEFAULT_WRITE_TIMEOUT = 300  # seconds
+
+# Applied to every connection
+SHARED_PRAGMAS = {
+    'cache_size': -64000,  # KiB, i.e. 64 MB page cache per connection
+    'mmap_size': 268435456,  # 256 MB memory-mapped I/O
+    'temp_store': 'MEMORY',
+}
+
+# WAL plus synchronous=NORMAL is durable against application crashes and
+# only risks the last transactions on power loss. auto_vacuum only takes
+# effect in new files (older ones are converted by maintenance.reclaim),
+# and foreign_keys enables the ON DELETE CASCADE of contacts
+WRITER_PRAGMAS = {
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'foreign_keys': 'ON',
+    'synchronous': 'NORMAL',
+    **SHARED_PRAGMAS,
+}
+
+READER_PRAGMAS = {
+    'query_only': 'ON',
+    **SHARED_PRAGMAS,
+}
+
+
+def is_sqlite_file(url):
+    url = sa.engine.make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+def writer_engine_options(write_timeout=DEFAULT_WRITE_TIMEOUT):
+    """Engine options for the writer: one connection, waiting up to write_timeout.
+
+    The same timeout is used for the pool (writers in this process) and for
+    SQLite's busy handler (writers in other processes).
+    """
+    return {
+        'pool_size': 1,
+        'max_overflow': 0,
+        'pool_timeout': write_timeout,
+        'connect_args': {'timeout': write_timeout, 'check_same_thread': False},
+    }
+
+
+def configure_pragmas(engine, pragmas=WRITER_PRAGMAS):
+    """Apply pragmas to every new connection of a SQLite file engine."""
+    if not is_sqlite_file(engine.url):
+        return
+
+    @sa.event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+
+def configure_writer(engine, pragmas=WRITER_PRAGMAS):
+    """Switch a SQLite engine to WAL and take the write lock on BEGIN."""
+    if not is_sqlite_file(engine.url):
+        return
+
+    @sa.event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself instead of pysqlite's deferred one
+        dbapi_connection.isolation_level = None
+        apply_pragmas(dbapi_connection, pragmas)
+
+    @sa.event.listens_for(engine, 'begin')
+    def _on_begin(conn):
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def configure_reader(engine, pragmas=READER_PRAGMAS):
+    """Run a read-only SQLite engine in autocommit mode with the reader pragmas."""
+
+    @sa.event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        apply_pragmas(dbapi_connection, pragmas)
+
+
+@contextmanager
+def raw_cursor(engine):
+    """DBAPI cursor on a pooled connection, outside SQLAlchemy's transactions.
+
+    For statements that cannot run in a transaction (VACUUM, PRAGMA
+    foreign_keys) or manage their own; writer connections autocommit.
+    """
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+
+
+def read_only_url(url):
+    """URI opening the same SQLite file read-only."""
+    url = sa.engine.make_url(url)
+    database = url.database
+    if database.startswith('file:'):
+        database = database[5:].split('?', 1)[0]
+    return url.set(database=f'file:{database}', query={'mode': 'ro', 'uri': 'true'})
+
+
+class ReadPool:
+    """Read-only engines, one per database file, created on first use.
+
+    Readers run in autocommit mode, so every statement sees the latest
+    committed data and no reader holds back WAL checkpoints.
+    """
+
+    def __init__(self, pool_size=DEFAULT_READ_POOL_SIZE, busy_timeout=DEFAULT_WRITE_TIMEOUT,
+                 pragmas=READER_PRAGMAS):
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.pragmas = pragmas
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def engine(self, writer_engine):
+        """Read-only engine for the writer's database (the writer itself for non-SQLite)."""
+        if not is_sqlite_file(writer_engine.url):
+            return writer_engine
+        key = writer_engine.url.render_as_string(hide_password=False)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                engine = self._create(writer_engine.url)
+                self._engines[key] = engine
+            return engine
+
+    def _create(self, url):
+        engine = sa.create_engine(
+            read_only_url(url),
+            pool_size=self.pool_size,
+            max_overflow=0,
+            pool_timeout=self.busy_timeout,
+            connect_args={'timeout': self.busy_timeout, 'check_same_thread': False},
+        )
+        configure_reader(engine, self.pragmas)
+        return engine
+
+    def discard(self, url):
+        """Dispose the reader of a database, e.g. after its writer was disposed."""
+        key = sa.engine.make_url(url).render_as_string(hide_password=False)
+        with self._lock:
+            engine = self._engines.pop(key, None)
+        if engine is not None:
+            engine.dispose()
+
+    def dispose_all(self):
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+        for engine in engines:
+            engine.dispose()
@@ -0,0 +1,125 @@
+import random
+
+import sqlalchemy as sa
+
+from clustering import MIN_PHONE_DIGITS
+from contact_matches import ensure_match_triggers, record_matches, MATCH_KEYS, MATCH_TABLE
+
+SCHEMA = [
+    "CREATE TABLE contact (id INTEGER PRIMARY KEY, file_id TEXT, email_norm TEXT, phone_norm TEXT, "
+    "place_id TEXT, cid TEXT)",
+    f"CREATE TABLE {MATCH_TABLE} (id INTEGER PRIMARY KEY, contact_id INTEGER, match_id INTEGER, "
+    "match_type TEXT, scope TEXT, UNIQUE (contact_id, match_id, match_type, scope))",
+]
+
+
+def make_engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.exec_driver_sql(statement)
+    ensure_match_triggers(engine)
+    return engine
+
+
+def insert(conn, *contacts):
+    """Insert one batch and link it, as ingest does."""
+    after_id = conn.exec_driver_sql("SELECT coalesce(max(id), 0) FROM contact").scalar()
+    conn.execute(sa.text(
+        "INSERT INTO contact (id, file_id, email_norm, phone_norm, place_id, cid) "
+        "VALUES (:id, :file_id, :email_norm, :phone_norm, :place_id, :cid)"
+    ), [{'email_norm': None, 'phone_norm': None, 'place_id': None, 'cid': None, **contact} for contact in contacts])
+    record_matches(conn, after_id)
+
+
+def components(pairs, ids):
+    parent = {contact_id: contact_id for contact_id in ids}
+
+    def find(contact_id):
+        while parent[contact_id] != contact_id:
+            contact_id = parent[contact_id]
+        return contact_id
+
+    for a, b in pairs:
+        parent[find(a)] = find(b)
+    groups = {}
+    for contact_id in ids:
+        groups.setdefault(find(contact_id), set()).add(contact_id)
+    return sorted(sorted(group) for group in groups.values())
+
+
+def linked_groups(conn):
+    ids = conn.exec_driver_sql("SELECT id FROM contact").scalars().all()
+    pairs = conn.exec_driver_sql(f"SELECT contact_id, match_id FROM {MATCH_TABLE} WHERE scope = 'global'").all()
+    return components(pairs, ids)
+
+
+def key_groups(conn):
+    """Groups of contacts sharing any key, computed from the contact table alone."""
+    rows = conn.exec_driver_sql("SELECT * FROM contact").mappings().all()
+    pairs = []
+    for column in MATCH_KEYS.values():
+        owners = {}
+        for row in rows:
+            key = row[column]
+            if key is None or (column == 'phone_norm' and len(key) < MIN_PHONE_DIGITS):
+                continue
+            pairs.append((row['id'], owners.setdefault(key, row['id'])))
+    return components(pairs, [row['id'] for row in rows])
+
+
+def dangling_links(conn):
+    return conn.exec_driver_sql(
+        f"SELECT count(*) FROM {MATCH_TABLE} m WHERE NOT EXISTS (SELECT 1 FROM contact c WHERE c.id = m.contact_id) "
+        f"OR NOT EXISTS (SELECT 1 FROM contact c WHERE c.id = m.match_id)"
+    ).scalar()
+
+
+def test_delete_relinks_to_next_earliest_contact(tmp_path):
+    engine = make_engine(tmp_path)
+    with engine.begin() as conn:
+        insert(conn, {'id': 1, 'file_id': 'a', 'email_norm': 'x@example.com'})
+        insert(conn, {'id': 2, 'file_id': 'b', 'email_norm': 'x@example.com'},
+               {'id': 3, 'file_id': 'b', 'email_norm': 'x@example.com'})
+        conn.exec_driver_sql("DELETE FROM contact WHERE id = 1")
+        links = set(conn.exec_driver_sql(f"SELECT contact_id, match_id, match_type, scope FROM {MATCH_TABLE}"))
+    assert (3, 2, 'email', 'global') in links
+    assert all(1 not in link[:2] for link in links)
+
+
+def test_key_update_moves_links(tmp_path):
+    engine = make_engine(tmp_path)
+    with engine.begin() as conn:
+        insert(conn, {'id': 1, 'file_id': 'a', 'place_id': 'p1'},
+               {'id': 2, 'file_id': 'a', 'place_id': 'p1'},
+               {'id': 3, 'file_id': 'a', 'place_id': 'p2'})
+        conn.exec_driver_sql("UPDATE contact SET place_id = 'p2' WHERE id = 1")
+        assert linked_groups(conn) == [[1, 3], [2]]
+
+
+def test_links_follow_random_deletes_and_updates(tmp_path):
+    engine = make_engine(tmp_path)
+    rng = random.Random(7)
+
+    def contact(contact_id):
+        return {
+            'id': contact_id,
+            'file_id': rng.choice('ab'),
+            'email_norm': rng.choice([None, 'x@example.com', 'y@example.com']),
+            'phone_norm': rng.choice([None, '441610000001', '12']),
+            'cid': rng.choice([None, '1', '2', '3']),
+        }
+
+    with engine.begin() as conn:
+        for start in range(1, 41, 8):
+            insert(conn, *(contact(contact_id) for contact_id in range(start, start + 8)))
+        for _ in range(40):
+            contact_id = rng.randint(1, 40)
+            if rng.random() < 0.4:
+                conn.execute(sa.text("DELETE FROM contact WHERE id = :id"), {'id': contact_id})
+            else:
+                column = rng.choice(['email_norm', 'phone_norm', 'cid'])
+                conn.execute(sa.text(f"UPDATE contact SET {column} = :value WHERE id = :id"),
+                             {'id': contact_id, 'value': contact(contact_id)[column]})
+            assert linked_groups(conn) == key_groups(conn)
+        assert dangling_links(conn) == 0
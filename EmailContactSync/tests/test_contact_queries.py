@@ -0,0 +1,47 @@
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from contact_queries import fetch_page, listing_order
+from file_export import export_select, EXPORT_COLUMNS
+
+metadata = sa.MetaData()
+contact = sa.Table(
+    'contact', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('review_count', sa.Integer),
+    *(sa.Column(name, sa.String) for name in EXPORT_COLUMNS if name not in ('id', 'review_count')),
+    sa.Index('ix_contact_review_id', 'review_count', 'id'),
+)
+
+
+def make_session(rows):
+    engine = sa.create_engine('sqlite://')
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.insert(contact), rows)
+    return Session(engine)
+
+
+def test_keyset_pages_follow_listing_order():
+    # Many ties, so most page boundaries fall inside one review_count
+    session = make_session([{'file_id': 'f', 'review_count': i % 4} for i in range(53)])
+    expected = [row.id for row in session.execute(sa.select(contact.c.id).order_by(*listing_order(contact)))]
+
+    ids = []
+    after = None
+    while True:
+        page = fetch_page(session, contact, [], limit=5, after=after, fields=['id', 'review_count'])
+        ids.extend(row['id'] for row in page['contacts'])
+        if page['next_cursor'] is None:
+            break
+        review_count, contact_id = page['next_cursor'].split(',')
+        after = int(review_count), int(contact_id)
+
+    assert ids == expected
+    assert expected[:3] == [4, 8, 12]
+
+
+def test_export_uses_listing_order():
+    session = make_session([{'file_id': 'f', 'review_count': count} for count in (1, 3, 3, 0, 3)])
+    exported = [row.id for row in session.execute(export_select(contact, []))]
+    assert exported == [2, 3, 5, 1, 4]
@@ -0,0 +1,25 @@
+import sqlalchemy as sa
+
+from databases import DatabaseRegistry
+
+
+def test_listed_size_includes_the_wal_file(tmp_path):
+    path = tmp_path / 'clients.db'
+    engine = sa.create_engine(f'sqlite:///{path}')
+    registry = DatabaseRegistry(tmp_path, engine)
+    with engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA journal_mode = WAL')
+        conn.exec_driver_sql('PRAGMA wal_autocheckpoint = 0')
+        conn.exec_driver_sql('CREATE TABLE contact (name TEXT)')
+        conn.exec_driver_sql(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000) "
+            "INSERT INTO contact SELECT hex(randomblob(100)) FROM n"
+        )
+        conn.commit()
+
+        # The writes are still in the -wal file while the connection is open
+        wal_size = (tmp_path / 'clients.db-wal').stat().st_size
+        assert wal_size > 100000
+        [listed] = registry.list()
+        assert listed['name'] == 'clients.db'
+        assert listed['size'] >= path.stat().st_size + wal_size
@@ -0,0 +1,122 @@
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from extra_fields import ExtraFieldWriter, FIELD_TABLE, VALUE_TABLE
+from ingest import insert_row_batches, iter_row_batches, CONTACT_COLUMNS
+from known_rows import parse_known_rows_mode, KnownRows
+
+COLUMN_TYPES = {'review_count': sa.Integer, 'latitude': sa.Float, 'longitude': sa.Float}
+
+metadata = sa.MetaData()
+contact = sa.Table(
+    'contact', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('file_id', sa.String),
+    *(sa.Column(name, COLUMN_TYPES.get(name, sa.String)) for name in CONTACT_COLUMNS),
+    sa.Column('email_norm', sa.String, index=True),
+    sa.Column('phone_norm', sa.String, index=True),
+    sa.Column('row_hash', sa.String, index=True),
+)
+extra_fields = sa.Table(
+    FIELD_TABLE, metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('name', sa.String, unique=True),
+    sa.Column('label', sa.String),
+)
+contact_fields = sa.Table(
+    VALUE_TABLE, metadata,
+    sa.Column('contact_id', sa.Integer, primary_key=True),
+    sa.Column('field_id', sa.Integer, primary_key=True),
+    sa.Column('value_text', sa.String),
+    sa.Column('value_num', sa.Float),
+)
+
+FIRST = pd.DataFrame({
+    'Name': ['Cafe', 'Bar'],
+    'Email': ['cafe@x.com', 'bar@x.com'],
+    'Phone': ['+44 161 000 0001', '+44 161 000 0002'],
+    'Place Id': ['p1', 'p2'],
+    'Rating': ['4.5', '3.9'],
+})
+
+
+@pytest.fixture
+def session():
+    engine = sa.create_engine('sqlite://')
+    metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def ingest(session, frame, file_id, mode):
+    writer = ExtraFieldWriter(session, extra_fields, contact_fields)
+    known_rows = KnownRows(session, contact, file_id, mode, writer) if mode != 'insert' else None
+    _, stats = insert_row_batches(
+        session, contact, iter_row_batches([frame.copy()], file_id), extra_writer=writer, known_rows=known_rows
+    )
+    return stats, known_rows, writer
+
+
+def contacts(session):
+    return session.execute(
+        sa.select(contact.c.file_id, contact.c.name, contact.c.email, contact.c.phone).order_by(contact.c.id)
+    ).all()
+
+
+def ratings(session):
+    return session.execute(sa.select(contact_fields.c.contact_id, contact_fields.c.value_text)
+                           .order_by(contact_fields.c.contact_id)).all()
+
+
+def test_skip_is_the_default():
+    assert parse_known_rows_mode(None) == 'skip'
+    assert parse_known_rows_mode(' Upsert ') == 'upsert'
+    with pytest.raises(ValueError):
+        parse_known_rows_mode('merge')
+
+
+def test_skip_mode_skips_identical_rows_and_inserts_changed_ones(session):
+    ingest(session, FIRST, 'a', 'skip')
+    changed = FIRST.assign(Phone=['+44 161 000 0001', '+44 161 999 9999'])
+
+    stats, known_rows, _ = ingest(session, changed, 'b', 'skip')
+
+    assert (stats.rows_read, stats.rows, known_rows.updated, known_rows.skipped) == (2, 1, 0, 1)
+    assert contacts(session)[-1] == ('b', 'Bar', 'bar@x.com', '+44 161 999 9999')
+
+
+def test_fully_skipped_file_still_records_its_extra_columns(session):
+    ingest(session, FIRST, 'a', 'skip')
+
+    stats, known_rows, writer = ingest(session, FIRST, 'b', 'skip')
+
+    assert (stats.rows_read, stats.rows, known_rows.skipped) == (2, 0, 2)
+    assert len(writer.names) == 1
+
+
+def test_upsert_mode_updates_the_earlier_contact(session):
+    ingest(session, FIRST, 'a', 'upsert')
+    newer = pd.DataFrame({'Name': ['Bar'], 'Email': [None], 'Phone': ['+44 161 999 9999'],
+                          'Place Id': ['p2'], 'Rating': ['4.8']})
+
+    stats, known_rows, _ = ingest(session, newer, 'b', 'upsert')
+
+    assert (stats.rows_read, stats.rows, known_rows.updated, known_rows.skipped) == (1, 0, 1, 0)
+    # The missing email keeps the stored one; the contact stays with its file
+    assert contacts(session) == [
+        ('a', 'Cafe', 'cafe@x.com', '+44 161 000 0001'),
+        ('a', 'Bar', 'bar@x.com', '+44 161 999 9999'),
+    ]
+    assert ratings(session) == [(1, '4.5'), (2, '4.8')]
+
+
+def test_insert_mode_imports_every_row(session):
+    ingest(session, FIRST, 'a', 'insert')
+
+    stats, known_rows, _ = ingest(session, FIRST, 'b', 'insert')
+
+    assert known_rows is None
+    assert (stats.rows_read, stats.rows) == (2, 2)
+    assert len(contacts(session)) == 4
@@ -0,0 +1,68 @@
+import sqlalchemy as sa
+
+from migrations import ensure_foreign_keys
+from storage import configure_writer
+
+metadata = sa.MetaData()
+processed_file = sa.Table(
+    'processed_file', metadata,
+    sa.Column('id', sa.String, primary_key=True),
+)
+contact = sa.Table(
+    'contact', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('file_id', sa.String, sa.ForeignKey('processed_file.id', ondelete='CASCADE'), index=True),
+    sa.Column('name', sa.String),
+)
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE processed_file (id VARCHAR PRIMARY KEY)",
+    # No REFERENCES, and a column the model no longer declares
+    "CREATE TABLE contact (id INTEGER PRIMARY KEY, file_id VARCHAR, name VARCHAR, notes VARCHAR)",
+    "CREATE INDEX ix_contact_file_id ON contact (file_id)",
+    "CREATE TABLE audit (contact_id INTEGER)",
+    "CREATE TRIGGER contact_audit AFTER DELETE ON contact BEGIN INSERT INTO audit VALUES (old.id); END",
+    "INSERT INTO processed_file VALUES ('a'), ('b')",
+    "INSERT INTO contact VALUES (1, 'a', 'Cafe', 'n1'), (2, 'a', 'Bar', NULL), (3, 'b', 'Pub', 'n3'), "
+    "(4, 'gone', 'Orphan', NULL)",
+]
+
+
+def legacy_engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    configure_writer(engine)
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.exec_driver_sql(statement)
+    return engine
+
+
+def test_rebuild_adds_cascade_and_keeps_rows_and_schema(tmp_path):
+    engine = legacy_engine(tmp_path)
+
+    assert ensure_foreign_keys(engine, contact) is True
+    assert ensure_foreign_keys(engine, contact) is False
+
+    with engine.begin() as conn:
+        assert conn.exec_driver_sql("SELECT id, file_id, name, notes FROM contact ORDER BY id").all() == [
+            (1, 'a', 'Cafe', 'n1'), (2, 'a', 'Bar', None), (3, 'b', 'Pub', 'n3'), (4, 'gone', 'Orphan', None),
+        ]
+        schema = {name for (name,) in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE tbl_name = 'contact' AND type IN ('index', 'trigger')"
+        )}
+        assert {'ix_contact_file_id', 'contact_audit'} <= schema
+        assert conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE name LIKE '%rebuild%'").first() is None
+        # The orphan is kept rather than silently dropped
+        assert [row[0] for row in conn.exec_driver_sql("PRAGMA foreign_key_check(contact)")] == ['contact']
+
+        conn.exec_driver_sql("DELETE FROM processed_file WHERE id = 'a'")
+        assert conn.exec_driver_sql("SELECT id FROM contact ORDER BY id").scalars().all() == [3, 4]
+        # The restored trigger fired for the cascaded deletes
+        assert conn.exec_driver_sql("SELECT contact_id FROM audit ORDER BY contact_id").scalars().all() == [1, 2]
+
+
+def test_rebuild_leaves_enforcement_on(tmp_path):
+    engine = legacy_engine(tmp_path)
+    ensure_foreign_keys(engine, contact)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
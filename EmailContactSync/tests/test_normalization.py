@@ -0,0 +1,12 @@
+import pytest
+
+from normalization import normalize_count
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, 0), ('', 0), ('n/a', 0), ('12', 12), ('1,234', 1234), ('1 234', 1234), (7.0, 7), ('-3', 0),
+    # Non-finite and huge values read as unparsable instead of failing the file
+    ('inf', 0), ('-inf', 0), ('1e400', 0), (float('inf'), 0), ('nan', 0),
+])
+def test_normalize_count(value, expected):
+    assert normalize_count(value) == expected
@@ -0,0 +1,88 @@
+import pytest
+import sqlalchemy as sa
+from flask import Flask, jsonify
+
+from response_cache import bump_generation, ensure_generation_table, read_generation, ResponseCache
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    ensure_generation_table(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE contact (name TEXT)")
+    return engine
+
+
+def make_client(engine):
+    """A worker process: its own app and in-memory cache over the shared database."""
+    app = Flask(__name__)
+    calls = []
+
+    def generation():
+        with engine.connect() as conn:
+            return read_generation(conn)
+
+    cache = ResponseCache(generation)
+
+    @app.route('/contacts')
+    @cache.cached(lambda: 'contacts.db')
+    def contacts():
+        calls.append(1)
+        with engine.connect() as conn:
+            return jsonify(conn.exec_driver_sql("SELECT name FROM contact ORDER BY name").scalars().all())
+
+    return app.test_client(), calls
+
+
+def write(engine, name, commit=True):
+    conn = engine.connect()
+    transaction = conn.begin()
+    conn.execute(sa.text("INSERT INTO contact (name) VALUES (:name)"), {'name': name})
+    bump_generation(conn)
+    transaction.commit() if commit else transaction.rollback()
+    conn.close()
+
+
+def test_write_in_another_process_invalidates_cache_and_etag(engine):
+    worker, calls = make_client(engine)
+    first = worker.get('/contacts')
+    assert first.get_json() == []
+    assert worker.get('/contacts', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert worker.get('/contacts').get_json() == [] and len(calls) == 1
+
+    # A write committed elsewhere (another worker or a CLI tool)
+    write(engine, 'Cafe')
+
+    revalidated = worker.get('/contacts', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 200
+    assert revalidated.get_json() == ['Cafe']
+    assert revalidated.headers['ETag'] != first.headers['ETag']
+
+
+def test_workers_agree_on_etags(engine):
+    worker_a, _ = make_client(engine)
+    worker_b, _ = make_client(engine)
+    etag = worker_a.get('/contacts').headers['ETag']
+    assert worker_b.get('/contacts', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_rolled_back_write_keeps_generation(engine):
+    with engine.connect() as conn:
+        before = read_generation(conn)
+    write(engine, 'Cafe', commit=False)
+    with engine.connect() as conn:
+        assert read_generation(conn) == before
+
+
+def test_recreated_database_gets_new_nonce(tmp_path):
+    path = tmp_path / 'contacts.db'
+    engine = sa.create_engine(f'sqlite:///{path}')
+    ensure_generation_table(engine)
+    with engine.connect() as conn:
+        old = read_generation(conn)
+    engine.dispose()
+    path.unlink()
+    ensure_generation_table(engine)
+    with engine.connect() as conn:
+        assert read_generation(conn) != old